@@ -1,16 +1,23 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-import psycopg
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Optional, List, Dict, Any, Tuple, Union, Literal, Callable, Annotated, overload
+import ipaddress
 import os
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 import json
 from fastapi.responses import JSONResponse
 
+from analytics_ingest import BufferFull, Writes, ingest_buffer
+from db import connection
+from embedding_versions import current_version
+
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
-DATABASE_URL = os.environ["DATABASE_URL"]
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+ANALYTICS_EVENTS_MAX_BATCH = int(os.getenv("ANALYTICS_EVENTS_MAX_BATCH", "200"))
 
 # Pydantic models for analytics data
 class SessionData(BaseModel):
@@ -62,6 +69,8 @@ class RecommendationData(BaseModel):
     accepted_song_ids: Optional[List[str]] = None
     rejected_song_ids: Optional[List[str]] = None
     recommendation_algorithm: str = 'embedding_average'
+    # Value of the X-Embedding-Version response header the recommendations came with
+    embedding_version: Optional[str] = None
     response_time: Optional[float] = None
 
 class ErrorData(BaseModel):
@@ -79,6 +88,51 @@ class PerformanceData(BaseModel):
     metric_unit: str = 'ms'
     page_path: Optional[str] = None
 
+# Bulk event envelopes: `type` selects the payload model for each item
+class SessionEndEvent(BaseModel):
+    type: Literal["session_end"]
+    session_id: str
+
+class PageViewEvent(PageViewData):
+    type: Literal["pageview"]
+
+class PlaylistEvent(PlaylistData):
+    type: Literal["playlist"]
+
+class SongInteractionEvent(SongInteractionData):
+    type: Literal["song_interaction"]
+
+class SearchQueryEvent(SearchQueryData):
+    type: Literal["search_query"]
+
+class RecommendationEvent(RecommendationData):
+    type: Literal["recommendation"]
+
+class ErrorEvent(ErrorData):
+    type: Literal["error"]
+
+class PerformanceEvent(PerformanceData):
+    type: Literal["performance"]
+
+AnalyticsEvent = Annotated[
+    Union[
+        SessionEndEvent,
+        PageViewEvent,
+        PlaylistEvent,
+        SongInteractionEvent,
+        SearchQueryEvent,
+        RecommendationEvent,
+        ErrorEvent,
+        PerformanceEvent,
+    ],
+    Field(discriminator="type"),
+]
+analytics_event_adapter: TypeAdapter[Any] = TypeAdapter(AnalyticsEvent)
+
+class EventBatch(BaseModel):
+    # Items are validated one by one so a bad event does not reject the batch
+    events: List[Dict[str, Any]] = Field(..., min_length=1, max_length=ANALYTICS_EVENTS_MAX_BATCH)
+
 # Helper function to get client IP
 def get_client_ip(request: Request) -> str:
     forwarded = request.headers.get("X-Forwarded-For")
@@ -91,292 +145,323 @@ def is_mobile_device(user_agent: str) -> bool:
     mobile_keywords = ['mobile', 'android', 'iphone', 'ipad', 'blackberry', 'windows phone']
     return any(keyword in user_agent.lower() for keyword in mobile_keywords)
 
+# Helpers to turn request payloads into typed rows for the ingestion buffer
+@overload
+def parse_uuid(value: str, field: str) -> uuid.UUID: ...
+@overload
+def parse_uuid(value: Optional[str], field: str) -> Optional[uuid.UUID]: ...
+def parse_uuid(value: Optional[str], field: str) -> Optional[uuid.UUID]:
+    """A required id parses to a UUID, an optional one may stay None; malformed ids are a 400."""
+    if value is None:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}: expected a UUID")
+
+def parse_ip(value: Optional[str]) -> Optional[IPAddress]:
+    try:
+        return ipaddress.ip_address(value) if value else None
+    except ValueError:
+        return None
+
+def seconds(value: Optional[float]) -> Optional[timedelta]:
+    return timedelta(seconds=value) if value else None
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+async def submit(writes: Writes) -> None:
+    try:
+        await ingest_buffer.submit(writes)
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Analytics is busy, please retry", headers={"Retry-After": "1"})
+
+# Event builders: validate one payload and describe its writes. They do no I/O,
+# so single-event endpoints and the bulk endpoint share them.
+def session_start_writes(session_data: SessionData, ip_address: Optional[str], user_agent: str) -> Tuple[Writes, Dict[str, Any]]:
+    # Generate session ID if not provided
+    session_id = uuid.uuid4()
+    now = utcnow()
+
+    # Detect mobile
+    is_mobile = session_data.is_mobile or is_mobile_device(user_agent)
+
+    writes = Writes()
+    writes.add_row("user_sessions", (
+        session_id,
+        session_data.user_id,
+        parse_ip(session_data.ip_address or ip_address),
+        user_agent,
+        session_data.referrer,
+        is_mobile,
+        session_data.country_code,
+        session_data.city,
+        now,
+        now
+    ))
+    return writes, {"session_id": str(session_id), "status": "started"}
+
+def session_end_writes(session_id: str) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.touch_session(parse_uuid(session_id, "session_id"), utcnow(), ended=True)
+    return writes, {"status": "session_ended"}
+
+def pageview_writes(pageview_data: PageViewData) -> Tuple[Writes, Dict[str, Any]]:
+    session_id = parse_uuid(pageview_data.session_id, "session_id")
+    now = utcnow()
+    writes = Writes()
+    writes.add_row("page_views", (
+        session_id,
+        pageview_data.page_path,
+        pageview_data.page_title,
+        pageview_data.referrer,
+        seconds(pageview_data.view_duration),
+        now
+    ))
+    # Update session page view count
+    writes.touch_session(session_id, now, page_views=1)
+    return writes, {"status": "pageview_tracked"}
+
+def playlist_writes(playlist_data: PlaylistData) -> Tuple[Writes, Dict[str, Any]]:
+    playlist_id = uuid.uuid4()
+    now = utcnow()
+    writes = Writes()
+    writes.add_row("playlists", (
+        playlist_id,
+        parse_uuid(playlist_data.session_id, "session_id"),
+        playlist_data.playlist_name,
+        playlist_data.song_count,
+        playlist_data.is_public,
+        playlist_data.genres,
+        playlist_data.mood,
+        playlist_data.energy_level,
+        now,
+        now
+    ))
+    return writes, {"playlist_id": str(playlist_id), "status": "playlist_tracked"}
+
+def song_interaction_writes(interaction_data: SongInteractionData) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.add_row("song_interactions", (
+        parse_uuid(interaction_data.session_id, "session_id"),
+        parse_uuid(interaction_data.playlist_id, "playlist_id"),
+        interaction_data.track_id,
+        interaction_data.interaction_type,
+        seconds(interaction_data.interaction_duration),
+        interaction_data.position_in_playlist,
+        utcnow()
+    ))
+    return writes, {"status": "interaction_tracked"}
+
+def search_query_writes(search_data: SearchQueryData) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.add_row("search_queries", (
+        parse_uuid(search_data.session_id, "session_id"),
+        search_data.query_text,
+        search_data.results_count,
+        search_data.clicked_song_id,
+        seconds(search_data.search_duration),
+        search_data.search_type,
+        utcnow()
+    ))
+    return writes, {"status": "search_tracked"}
+
+def tag_algorithm(algorithm: str, embedding_version: Optional[str]) -> str:
+    """'embedding_average' -> 'embedding_average@<version>'; the server's active version if the client sent none."""
+    if "@" in algorithm:
+        return algorithm
+    return f"{algorithm}@{embedding_version or current_version()}"
+
+def recommendation_writes(recommendation_data: RecommendationData) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.add_row("recommendations", (
+        parse_uuid(recommendation_data.session_id, "session_id"),
+        parse_uuid(recommendation_data.playlist_id, "playlist_id"),
+        recommendation_data.source_song_ids,
+        recommendation_data.recommended_song_ids,
+        recommendation_data.accepted_song_ids or [],
+        recommendation_data.rejected_song_ids or [],
+        tag_algorithm(recommendation_data.recommendation_algorithm, recommendation_data.embedding_version),
+        seconds(recommendation_data.response_time),
+        utcnow()
+    ))
+    return writes, {"status": "recommendation_tracked"}
+
+def error_writes(error_data: ErrorData) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.add_row("errors", (
+        parse_uuid(error_data.session_id, "session_id"),
+        error_data.error_type,
+        error_data.error_message,
+        error_data.stack_trace,
+        error_data.user_agent,
+        error_data.page_path,
+        utcnow()
+    ))
+    return writes, {"status": "error_tracked"}
+
+def performance_writes(performance_data: PerformanceData) -> Tuple[Writes, Dict[str, Any]]:
+    writes = Writes()
+    writes.add_row("performance", (
+        parse_uuid(performance_data.session_id, "session_id"),
+        performance_data.metric_name,
+        Decimal(repr(performance_data.metric_value)),
+        performance_data.metric_unit,
+        performance_data.page_path,
+        utcnow()
+    ))
+    return writes, {"status": "performance_tracked"}
+
+EVENT_WRITERS: Dict[type, Callable[[Any], Tuple[Writes, Dict[str, Any]]]] = {
+    SessionEndEvent: lambda event: session_end_writes(event.session_id),
+    PageViewEvent: pageview_writes,
+    PlaylistEvent: playlist_writes,
+    SongInteractionEvent: song_interaction_writes,
+    SearchQueryEvent: search_query_writes,
+    RecommendationEvent: recommendation_writes,
+    ErrorEvent: error_writes,
+    PerformanceEvent: performance_writes,
+}
+
+async def record(built: Tuple[Writes, Dict[str, Any]]) -> Dict[str, Any]:
+    writes, response = built
+    await submit(writes)
+    return response
+
 # Analytics endpoints
+# Tracking writes go through the write-behind buffer (analytics_ingest) and are
+# persisted by its background flusher within ANALYTICS_FLUSH_INTERVAL.
 @router.post("/session/start")
 async def start_session(request: Request, session_data: SessionData):
     """Start a new user session"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                # Generate session ID if not provided
-                session_id = str(uuid.uuid4())
-                
-                # Get client IP
-                ip_address = session_data.ip_address or get_client_ip(request)
-                
-                # Get user agent
-                user_agent = session_data.user_agent or request.headers.get("User-Agent", "")
-                
-                # Detect mobile
-                is_mobile = session_data.is_mobile or is_mobile_device(user_agent)
-                
-                cur.execute("""
-                    INSERT INTO analytics.user_sessions 
-                    (session_id, user_id, ip_address, user_agent, referrer, is_mobile, country_code, city)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING session_id
-                """, (
-                    session_id,
-                    session_data.user_id,
-                    ip_address,
-                    user_agent,
-                    session_data.referrer,
-                    is_mobile,
-                    session_data.country_code,
-                    session_data.city
-                ))
-                
-                conn.commit()
-                return {"session_id": session_id, "status": "started"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start session: {str(e)}")
+    user_agent = session_data.user_agent or request.headers.get("User-Agent", "")
+    return await record(session_start_writes(session_data, get_client_ip(request), user_agent))
 
 @router.post("/session/end")
 async def end_session(session_id: str):
-    """End a user session and calculate duration"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE analytics.user_sessions 
-                    SET session_duration = NOW() - created_at,
-                        last_activity = NOW()
-                    WHERE session_id = %s
-                    RETURNING session_id
-                """, (session_id,))
-                
-                if cur.fetchone():
-                    conn.commit()
-                    return {"status": "session_ended"}
-                else:
-                    raise HTTPException(status_code=404, detail="Session not found")
-                    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to end session: {str(e)}")
+    """
+    End a user session and calculate duration.
+    The session may still be buffered by another worker, so an unknown id is
+    accepted rather than answered with 404; an update that never matches a
+    session is dropped at flush and counted as unmatched_sessions.
+    """
+    return await record(session_end_writes(session_id))
 
 @router.post("/pageview")
 async def track_pageview(pageview_data: PageViewData):
     """Track a page view"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.page_views 
-                    (session_id, page_path, page_title, referrer, view_duration)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    pageview_data.session_id,
-                    pageview_data.page_path,
-                    pageview_data.page_title,
-                    pageview_data.referrer,
-                    timedelta(seconds=pageview_data.view_duration) if pageview_data.view_duration else None
-                ))
-                
-                # Update session page view count
-                cur.execute("""
-                    UPDATE analytics.user_sessions 
-                    SET page_views = page_views + 1,
-                        last_activity = NOW()
-                    WHERE session_id = %s
-                """, (pageview_data.session_id,))
-                
-                conn.commit()
-                return {"status": "pageview_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track pageview: {str(e)}")
+    return await record(pageview_writes(pageview_data))
 
 @router.post("/playlist/create")
 async def track_playlist_creation(playlist_data: PlaylistData):
     """Track playlist creation"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                playlist_id = str(uuid.uuid4())
-                
-                cur.execute("""
-                    INSERT INTO analytics.playlists 
-                    (playlist_id, session_id, playlist_name, song_count, is_public, genres, mood, energy_level)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING playlist_id
-                """, (
-                    playlist_id,
-                    playlist_data.session_id,
-                    playlist_data.playlist_name,
-                    playlist_data.song_count,
-                    playlist_data.is_public,
-                    playlist_data.genres,
-                    playlist_data.mood,
-                    playlist_data.energy_level
-                ))
-                
-                conn.commit()
-                return {"playlist_id": playlist_id, "status": "playlist_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track playlist: {str(e)}")
+    return await record(playlist_writes(playlist_data))
 
 @router.post("/song/interaction")
 async def track_song_interaction(interaction_data: SongInteractionData):
     """Track song interactions (add, remove, play, etc.)"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.song_interactions 
-                    (session_id, playlist_id, track_id, interaction_type, interaction_duration, position_in_playlist)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    interaction_data.session_id,
-                    interaction_data.playlist_id,
-                    interaction_data.track_id,
-                    interaction_data.interaction_type,
-                    timedelta(seconds=interaction_data.interaction_duration) if interaction_data.interaction_duration else None,
-                    interaction_data.position_in_playlist
-                ))
-                
-                conn.commit()
-                return {"status": "interaction_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track interaction: {str(e)}")
+    return await record(song_interaction_writes(interaction_data))
 
 @router.post("/search/query")
 async def track_search_query(search_data: SearchQueryData):
     """Track search queries"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.search_queries 
-                    (session_id, query_text, results_count, clicked_song_id, search_duration, search_type)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    search_data.session_id,
-                    search_data.query_text,
-                    search_data.results_count,
-                    search_data.clicked_song_id,
-                    timedelta(seconds=search_data.search_duration) if search_data.search_duration else None,
-                    search_data.search_type
-                ))
-                
-                conn.commit()
-                return {"status": "search_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track search: {str(e)}")
+    return await record(search_query_writes(search_data))
 
 @router.post("/recommendations/request")
 async def track_recommendations(recommendation_data: RecommendationData):
     """Track recommendation requests and responses"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.recommendations 
-                    (session_id, playlist_id, source_song_ids, recommended_song_ids, accepted_song_ids, rejected_song_ids, recommendation_algorithm, response_time)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    recommendation_data.session_id,
-                    recommendation_data.playlist_id,
-                    recommendation_data.source_song_ids,
-                    recommendation_data.recommended_song_ids,
-                    recommendation_data.accepted_song_ids or [],
-                    recommendation_data.rejected_song_ids or [],
-                    recommendation_data.recommendation_algorithm,
-                    timedelta(seconds=recommendation_data.response_time) if recommendation_data.response_time else None
-                ))
-                
-                conn.commit()
-                return {"status": "recommendation_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track recommendation: {str(e)}")
+    return await record(recommendation_writes(recommendation_data))
 
 @router.post("/error")
 async def track_error(error_data: ErrorData):
     """Track application errors"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.errors 
-                    (session_id, error_type, error_message, stack_trace, user_agent, page_path)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    error_data.session_id,
-                    error_data.error_type,
-                    error_data.error_message,
-                    error_data.stack_trace,
-                    error_data.user_agent,
-                    error_data.page_path
-                ))
-                
-                conn.commit()
-                return {"status": "error_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track error: {str(e)}")
+    return await record(error_writes(error_data))
 
 @router.post("/performance")
 async def track_performance(performance_data: PerformanceData):
     """Track performance metrics"""
-    try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO analytics.performance 
-                    (session_id, metric_name, metric_value, metric_unit, page_path)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    performance_data.session_id,
-                    performance_data.metric_name,
-                    performance_data.metric_value,
-                    performance_data.metric_unit,
-                    performance_data.page_path
-                ))
-                
-                conn.commit()
-                return {"status": "performance_tracked"}
-                
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to track performance: {str(e)}")
+    return await record(performance_writes(performance_data))
+
+@router.post("/events")
+async def track_events(batch: EventBatch):
+    """Track a batch of mixed events; each item is accepted or rejected on its own"""
+    writes = Writes()
+    results: List[Dict[str, Any]] = []
+    for index, item in enumerate(batch.events):
+        try:
+            event = analytics_event_adapter.validate_python(item)
+            event_writes, response = EVENT_WRITERS[type(event)](event)
+        except ValidationError as e:
+            errors = json.loads(e.json(include_url=False, include_input=False))
+            results.append({"index": index, "status": "rejected", "errors": errors})
+            continue
+        except HTTPException as e:
+            results.append({"index": index, "status": "rejected", "errors": [{"msg": e.detail}]})
+            continue
+
+        writes.extend(event_writes)
+        results.append({"index": index, "status": "accepted", "result": response})
+
+    # All accepted events go into the same flush: one COPY per table
+    await submit(writes)
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
 
 # Analytics dashboard endpoints
 @router.get("/dashboard/daily-stats")
 async def get_daily_stats(days: int = 30):
     """Get daily statistics for the dashboard"""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
                     SELECT * FROM analytics.daily_stats 
-                    WHERE date >= CURRENT_DATE - INTERVAL '%s days'
+                    WHERE date >= (now() AT TIME ZONE 'UTC')::date - %s::int
                     ORDER BY date DESC
                 """, (days,))
                 
                 columns = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
+                rows = await cur.fetchall()
                 
                 return [dict(zip(columns, row)) for row in rows]
                 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get daily stats: {str(e)}")
 
+@router.get("/dashboard/hourly-stats")
+async def get_hourly_stats(hours: int = 48):
+    """Get hourly event counts for the dashboard"""
+    try:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT * FROM analytics.hourly_activity
+                    WHERE bucket >= date_trunc('hour', now()) - make_interval(hours => %s)
+                    ORDER BY bucket DESC
+                """, (hours,))
+                
+                columns = [desc[0] for desc in cur.description or ()]
+                rows = await cur.fetchall()
+                
+                return [dict(zip(columns, row)) for row in rows]
+                
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get hourly stats: {str(e)}")
+
 @router.get("/dashboard/popular-songs")
 async def get_popular_songs(limit: int = 20):
     """Get most popular songs based on interactions"""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
                     SELECT * FROM analytics.popular_songs 
                     LIMIT %s
                 """, (limit,))
                 
                 columns = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
+                rows = await cur.fetchall()
                 
                 return [dict(zip(columns, row)) for row in rows]
                 
@@ -387,15 +472,15 @@ async def get_popular_songs(limit: int = 20):
 async def get_search_trends(limit: int = 20):
     """Get search trends and popular queries"""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
                     SELECT * FROM analytics.search_trends 
                     LIMIT %s
                 """, (limit,))
                 
                 columns = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
+                rows = await cur.fetchall()
                 
                 return [dict(zip(columns, row)) for row in rows]
                 
@@ -406,33 +491,18 @@ async def get_search_trends(limit: int = 20):
 async def get_session_metrics():
     """Get session-related metrics"""
     try:
-        with psycopg.connect(DATABASE_URL) as conn:
-            with conn.cursor() as cur:
-                # Total sessions today
-                cur.execute("""
-                    SELECT COUNT(*) as total_sessions_today
-                    FROM analytics.user_sessions 
-                    WHERE DATE(created_at) = CURRENT_DATE
-                """)
-                total_sessions_today = cur.fetchone()[0]
-                
-                # Average session duration
-                cur.execute("""
-                    SELECT AVG(EXTRACT(EPOCH FROM session_duration)) as avg_session_duration
-                    FROM analytics.user_sessions 
-                    WHERE session_duration IS NOT NULL
-                """)
-                avg_session_duration = cur.fetchone()[0]
-                
-                # Mobile vs desktop
-                cur.execute("""
-                    SELECT 
-                        COUNT(CASE WHEN is_mobile THEN 1 END) as mobile_sessions,
-                        COUNT(CASE WHEN NOT is_mobile THEN 1 END) as desktop_sessions
-                    FROM analytics.user_sessions 
-                    WHERE DATE(created_at) = CURRENT_DATE
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                # Today's sessions and the average duration of ended sessions, from the daily rollup
+                await cur.execute("""
+                    SELECT
+                        COALESCE(SUM(unique_sessions) FILTER (WHERE date = (now() AT TIME ZONE 'UTC')::date), 0),
+                        SUM(session_seconds_total) / NULLIF(SUM(ended_sessions), 0),
+                        COALESCE(SUM(mobile_sessions) FILTER (WHERE date = (now() AT TIME ZONE 'UTC')::date), 0)
+                    FROM analytics.daily_activity
                 """)
-                mobile_desktop = cur.fetchone()
+                total_sessions_today, avg_session_duration, mobile_sessions = await cur.fetchone()
+                mobile_desktop = (mobile_sessions, total_sessions_today - mobile_sessions)
                 
                 return {
                     "total_sessions_today": total_sessions_today,
@@ -0,0 +1,511 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Optional
+from uuid import UUID
+
+import psycopg
+from psycopg import sql
+from psycopg_pool import PoolTimeout
+
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+# Events held in memory at most; when full, handlers wait up to
+# ANALYTICS_ENQUEUE_TIMEOUT for the flusher to make room, then fail with 503.
+ANALYTICS_BUFFER_MAX_EVENTS = int(os.getenv('ANALYTICS_BUFFER_MAX_EVENTS', '20000'))
+ANALYTICS_FLUSH_BATCH = int(os.getenv('ANALYTICS_FLUSH_BATCH', '2000'))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '1.0'))
+ANALYTICS_ENQUEUE_TIMEOUT = float(os.getenv('ANALYTICS_ENQUEUE_TIMEOUT', '2.0'))
+# Seconds between rollup refreshes after flushes (0 disables; use the scheduled
+# `setup_analytics.py --refresh-rollups` job instead).
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv('ANALYTICS_ROLLUP_INTERVAL', '60'))
+# Each worker has its own buffer, so a row can reach the database before the
+# session or playlist it references, which may still sit in another worker's
+# buffer. Such rows, and session updates that match no session, are kept for up
+# to this many seconds of flushes before they are dropped.
+ANALYTICS_ORPHAN_TIMEOUT = float(os.getenv('ANALYTICS_ORPHAN_TIMEOUT', '10'))
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    columns: tuple[str, ...]
+    types: tuple[str, ...]
+    # (column, table) of the foreign keys to other buffered tables.
+    parents: tuple[tuple[str, str], ...] = ()
+
+    def parent_columns(self) -> list[tuple[int, str]]:
+        return [(self.columns.index(column), parent) for column, parent in self.parents]
+
+
+SESSION_PARENT = (('session_id', 'user_sessions'),)
+SESSION_AND_PLAYLIST_PARENTS = (('session_id', 'user_sessions'), ('playlist_id', 'playlists'))
+
+# Primary keys of the tables other buffered rows reference.
+PARENT_KEYS = {'user_sessions': 'session_id', 'playlists': 'playlist_id'}
+
+# Flush order follows the foreign keys: sessions, then playlists, then the rest.
+TABLES: dict[str, TableSpec] = {
+    'user_sessions': TableSpec(
+        ('session_id', 'user_id', 'ip_address', 'user_agent', 'referrer', 'is_mobile',
+         'country_code', 'city', 'created_at', 'last_activity'),
+        ('uuid', 'text', 'inet', 'text', 'text', 'bool',
+         'text', 'text', 'timestamptz', 'timestamptz'),
+    ),
+    'playlists': TableSpec(
+        ('playlist_id', 'session_id', 'playlist_name', 'song_count', 'is_public', 'genres',
+         'mood', 'energy_level', 'created_at', 'updated_at'),
+        ('uuid', 'uuid', 'text', 'int4', 'bool', 'text[]',
+         'text', 'int4', 'timestamptz', 'timestamptz'),
+        SESSION_PARENT,
+    ),
+    'page_views': TableSpec(
+        ('session_id', 'page_path', 'page_title', 'referrer', 'view_duration', 'created_at'),
+        ('uuid', 'text', 'text', 'text', 'interval', 'timestamptz'),
+        SESSION_PARENT,
+    ),
+    'song_interactions': TableSpec(
+        ('session_id', 'playlist_id', 'track_id', 'interaction_type', 'interaction_duration',
+         'position_in_playlist', 'created_at'),
+        ('uuid', 'uuid', 'text', 'text', 'interval', 'int4', 'timestamptz'),
+        SESSION_AND_PLAYLIST_PARENTS,
+    ),
+    'search_queries': TableSpec(
+        ('session_id', 'query_text', 'results_count', 'clicked_song_id', 'search_duration',
+         'search_type', 'created_at'),
+        ('uuid', 'text', 'int4', 'text', 'interval', 'text', 'timestamptz'),
+        SESSION_PARENT,
+    ),
+    'recommendations': TableSpec(
+        ('session_id', 'playlist_id', 'source_song_ids', 'recommended_song_ids',
+         'accepted_song_ids', 'rejected_song_ids', 'recommendation_algorithm', 'response_time',
+         'created_at'),
+        ('uuid', 'uuid', 'text[]', 'text[]', 'text[]', 'text[]', 'text', 'interval',
+         'timestamptz'),
+        SESSION_AND_PLAYLIST_PARENTS,
+    ),
+    'errors': TableSpec(
+        ('session_id', 'error_type', 'error_message', 'stack_trace', 'user_agent', 'page_path',
+         'created_at'),
+        ('uuid', 'text', 'text', 'text', 'text', 'text', 'timestamptz'),
+        SESSION_PARENT,
+    ),
+    'performance': TableSpec(
+        ('session_id', 'metric_name', 'metric_value', 'metric_unit', 'page_path', 'created_at'),
+        ('uuid', 'text', 'numeric', 'text', 'text', 'timestamptz'),
+        SESSION_PARENT,
+    ),
+}
+
+# Advisory-locked inside the function, so concurrent workers skip instead of queueing.
+REFRESH_ROLLUPS_SQL = "SELECT analytics.refresh_rollups()"
+
+# One UPDATE per flush for all touched sessions instead of one per page view.
+SESSION_UPDATE_SQL = """
+    UPDATE analytics.user_sessions AS s
+    SET page_views = s.page_views + v.page_views,
+        last_activity = GREATEST(s.last_activity, v.last_activity),
+        session_duration = COALESCE(v.ended_at - s.created_at, s.session_duration)
+    FROM unnest(%s::uuid[], %s::int[], %s::timestamptz[], %s::timestamptz[])
+        AS v(session_id, page_views, last_activity, ended_at)
+    WHERE s.session_id = v.session_id
+    RETURNING s.session_id
+"""
+
+EXISTING_KEYS_SQL = "SELECT {key} FROM {table} WHERE {key} = ANY(%s)"
+
+
+class BufferFull(Exception):
+    """Raised when the buffer stayed full for ANALYTICS_ENQUEUE_TIMEOUT."""
+
+
+@dataclass
+class SessionUpdate:
+    page_views: int
+    last_activity: datetime
+    ended_at: Optional[datetime] = None
+    # Monotonic time of the first flush that found no such session.
+    waiting_since: Optional[float] = None
+
+
+# A row held back because a parent row is missing, with the time it was first held back.
+WaitingRow = tuple[tuple[Any, ...], float]
+
+
+@dataclass
+class Writes:
+    """Rows and session changes produced by one or more events, submitted together."""
+
+    rows: list[tuple[str, tuple[Any, ...]]] = field(default_factory=list)
+    sessions: list[tuple[UUID, datetime, int, bool]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self.sessions)
+
+    def add_row(self, table: str, row: tuple[Any, ...]) -> None:
+        """Queue one row for `analytics.<table>`; columns follow TABLES[table]."""
+        self.rows.append((table, row))
+
+    def touch_session(self, session_id: UUID, at: datetime, page_views: int = 0, ended: bool = False) -> None:
+        """Session counter/activity change; coalesced to one UPDATE per session per flush."""
+        self.sessions.append((session_id, at, page_views, ended))
+
+    def extend(self, other: 'Writes') -> None:
+        self.rows.extend(other.rows)
+        self.sessions.extend(other.sessions)
+
+
+class AnalyticsBuffer:
+    """
+    Write-behind buffer for analytics events. Handlers enqueue rows and return;
+    a background task writes them per table with binary COPY, on size or time.
+    """
+
+    def __init__(
+        self,
+        max_events: int = ANALYTICS_BUFFER_MAX_EVENTS,
+        flush_batch: int = ANALYTICS_FLUSH_BATCH,
+        flush_interval: float = ANALYTICS_FLUSH_INTERVAL,
+    ):
+        self.max_events = max_events
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._rows: dict[str, list[tuple[Any, ...]]] = {table: [] for table in TABLES}
+        self._waiting: dict[str, list[WaitingRow]] = {table: [] for table in TABLES}
+        self._sessions: dict[UUID, SessionUpdate] = {}
+        self._pending = 0
+        # Buffered plus in-flight events; bounded by max_events.
+        self._occupied = 0
+        self._space = asyncio.Condition()
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task[None]] = None
+        self._stopping = False
+        self.flushed_events = 0
+        self.dropped_rows = 0
+        self.orphaned_rows = 0
+        self.unmatched_sessions = 0
+        self.flushes = 0
+        self.rollup_refreshes = 0
+        self._rollups_dirty = False
+        self._rollups_refreshed_at = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _reserve(self, count: int) -> None:
+        if self._occupied + count > self.max_events:
+            # Full: make sure the flusher runs, then wait for it to free room.
+            self._wake.set()
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: self._occupied + count <= self.max_events),
+                        ANALYTICS_ENQUEUE_TIMEOUT,
+                    )
+            except asyncio.TimeoutError as exc:
+                raise BufferFull('Analytics buffer is full') from exc
+        self._occupied += count
+
+    async def _release(self, count: int) -> None:
+        self._occupied -= count
+        async with self._space:
+            self._space.notify_all()
+
+    async def submit(self, writes: Writes) -> None:
+        """
+        Buffer all rows and session changes of `writes`. They are appended without
+        yielding to the loop, so one submission always lands in the same flush.
+        """
+        count = len(writes)
+        if count == 0:
+            return
+        await self._reserve(count)
+
+        for table, row in writes.rows:
+            self._rows[table].append(row)
+        for session_id, at, page_views, ended in writes.sessions:
+            update = self._sessions.get(session_id)
+            if update is None:
+                update = self._sessions[session_id] = SessionUpdate(0, at)
+            update.page_views += page_views
+            update.last_activity = max(update.last_activity, at)
+            if ended:
+                update.ended_at = at
+
+        self._pending += count
+        if self._pending >= self.flush_batch:
+            self._wake.set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher and drain everything still buffered."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            self._wake.clear()
+            try:
+                await self.flush()
+                await self._maybe_refresh_rollups()
+            except Exception:
+                logger.exception('Analytics flush failed; events stay buffered')
+
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Final analytics flush failed; %s events lost', self._pending)
+        else:
+            if self._pending:
+                logger.warning('%s analytics events still waited for their session or playlist at shutdown',
+                               self._pending)
+
+    def _take(
+        self
+    ) -> tuple[dict[str, list[tuple[Any, ...]]], dict[str, list[WaitingRow]], dict[UUID, SessionUpdate], int]:
+        rows, waiting, sessions, count = self._rows, self._waiting, self._sessions, self._pending
+        self._rows = {table: [] for table in TABLES}
+        self._waiting = {table: [] for table in TABLES}
+        self._sessions = {}
+        self._pending = 0
+        return rows, waiting, sessions, count
+
+    def _requeue(
+        self,
+        rows: dict[str, list[tuple[Any, ...]]],
+        waiting: dict[str, list[WaitingRow]],
+        sessions: dict[UUID, SessionUpdate],
+        count: int
+    ) -> None:
+        for table, table_rows in rows.items():
+            self._rows[table][:0] = table_rows
+        for table, waiting_rows in waiting.items():
+            self._waiting[table][:0] = waiting_rows
+        for session_id, update in sessions.items():
+            current = self._sessions.get(session_id)
+            if current is None:
+                self._sessions[session_id] = update
+            else:
+                current.page_views += update.page_views
+                current.last_activity = max(current.last_activity, update.last_activity)
+                current.ended_at = current.ended_at or update.ended_at
+                current.waiting_since = update.waiting_since
+        self._pending += count
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            rows, waiting, sessions, count = self._take()
+            if count == 0:
+                return
+
+            started = time.perf_counter()
+            # Rows and session updates whose session or playlist is not in the database yet.
+            held_rows: dict[str, list[WaitingRow]] = {table: [] for table in TABLES}
+            held_sessions: dict[UUID, SessionUpdate] = {}
+            try:
+                async with connection() as conn:
+                    existing: dict[str, set[Any]] = {parent: set() for parent in PARENT_KEYS}
+                    for table in TABLES:
+                        if rows[table] or waiting[table]:
+                            ready = await self._hold_orphans(
+                                conn, table, rows[table], waiting[table], existing, held_rows[table]
+                            )
+                            if ready:
+                                await self._write_table(conn, table, ready)
+                            rows[table], waiting[table] = [], []
+                    if sessions:
+                        await self._update_sessions(conn, sessions, held_sessions)
+                        sessions = {}
+            except (psycopg.OperationalError, PoolTimeout):
+                # Database unreachable: keep what was not written and retry on the next tick.
+                self._requeue(rows, waiting, sessions, count)
+                self._requeue({}, held_rows, held_sessions, 0)
+                raise
+            except Exception:
+                await self._release(count)
+                raise
+
+            held = sum(len(table_rows) for table_rows in held_rows.values()) + len(held_sessions)
+            self._requeue({}, held_rows, held_sessions, held)
+            await self._release(count - held)
+            self.flushed_events += count - held
+            self.flushes += 1
+            self._rollups_dirty = True
+            logger.debug('Flushed %s analytics events in %.1fms (%s held back)',
+                         count - held, (time.perf_counter() - started) * 1000, held)
+
+    async def _existing_keys(self, conn: psycopg.AsyncConnection, parent: str, keys: set[Any]) -> set[Any]:
+        query = sql.SQL(EXISTING_KEYS_SQL).format(
+            key=sql.Identifier(PARENT_KEYS[parent]),
+            table=sql.Identifier('analytics', parent),
+        )
+        async with conn.cursor() as cur:
+            await cur.execute(query, (list(keys),))
+            return {row[0] for row in await cur.fetchall()}
+
+    async def _hold_orphans(
+        self,
+        conn: psycopg.AsyncConnection,
+        table: str,
+        rows: list[tuple[Any, ...]],
+        waiting: list[WaitingRow],
+        existing: dict[str, set[Any]],
+        held: list[WaitingRow]
+    ) -> list[tuple[Any, ...]]:
+        """
+        The rows of `table` whose parents exist, to be written now. Rows with a
+        missing parent go to `held` until ANALYTICS_ORPHAN_TIMEOUT, then are dropped.
+        `existing` caches the parent keys already found during this flush.
+        """
+        candidates: list[tuple[tuple[Any, ...], Optional[float]]] = [*waiting, *((row, None) for row in rows)]
+        missing: list[tuple[int, set[Any]]] = []
+        for index, parent in TABLES[table].parent_columns():
+            keys = {row[index] for row, _ in candidates if row[index] is not None} - existing[parent]
+            if keys:
+                found = await self._existing_keys(conn, parent, keys)
+                existing[parent] |= found
+                if keys - found:
+                    missing.append((index, keys - found))
+        if not missing:
+            return [row for row, _ in candidates]
+
+        now = time.monotonic()
+        ready: list[tuple[Any, ...]] = []
+        orphaned = 0
+        for row, since in candidates:
+            if not any(row[index] in keys for index, keys in missing):
+                ready.append(row)
+            elif since is None or now - since < ANALYTICS_ORPHAN_TIMEOUT:
+                held.append((row, now if since is None else since))
+            else:
+                orphaned += 1
+        if orphaned:
+            self.orphaned_rows += orphaned
+            self.dropped_rows += orphaned
+            logger.warning('Dropped %s analytics.%s rows whose session or playlist never arrived', orphaned, table)
+        return ready
+
+    async def _maybe_refresh_rollups(self) -> None:
+        if not self._rollups_dirty or ANALYTICS_ROLLUP_INTERVAL <= 0:
+            return
+        if time.monotonic() - self._rollups_refreshed_at < ANALYTICS_ROLLUP_INTERVAL:
+            return
+
+        self._rollups_refreshed_at = time.monotonic()
+        try:
+            async with connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(REFRESH_ROLLUPS_SQL)
+                    row = await cur.fetchone()
+            refreshed = row is not None and row[0]
+        except Exception:
+            logger.warning('Analytics rollup refresh failed', exc_info=True)
+            return
+
+        self._rollups_dirty = False
+        if refreshed:
+            self.rollup_refreshes += 1
+
+    async def _write_table(self, conn: psycopg.AsyncConnection, table: str, rows: list[tuple[Any, ...]]) -> None:
+        spec = TABLES[table]
+        copy_sql = sql.SQL('COPY {} ({}) FROM STDIN (FORMAT BINARY)').format(
+            sql.Identifier('analytics', table),
+            sql.SQL(', ').join(map(sql.Identifier, spec.columns)),
+        )
+        try:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    async with cur.copy(copy_sql) as copy:
+                        copy.set_types(list(spec.types))
+                        for row in rows:
+                            await copy.write_row(row)
+        except psycopg.OperationalError:
+            raise
+        except psycopg.Error as exc:
+            # A single bad row (e.g. unknown session or track id) fails the whole
+            # COPY; retry row by row so only the offending rows are dropped.
+            logger.warning('COPY into analytics.%s failed (%s); retrying row by row', table, exc)
+            await self._insert_rows(conn, table, rows)
+
+    async def _insert_rows(self, conn: psycopg.AsyncConnection, table: str, rows: list[tuple[Any, ...]]) -> None:
+        spec = TABLES[table]
+        insert_sql = sql.SQL('INSERT INTO {} ({}) VALUES ({})').format(
+            sql.Identifier('analytics', table),
+            sql.SQL(', ').join(map(sql.Identifier, spec.columns)),
+            sql.SQL(', ').join(sql.Placeholder() * len(spec.columns)),
+        )
+        async with conn.cursor() as cur:
+            for row in rows:
+                try:
+                    async with conn.transaction():
+                        await cur.execute(insert_sql, row)
+                except psycopg.OperationalError:
+                    raise
+                except psycopg.Error as exc:
+                    self.dropped_rows += 1
+                    logger.warning('Dropped analytics.%s row: %s', table, exc)
+
+    async def _update_sessions(
+        self,
+        conn: psycopg.AsyncConnection,
+        sessions: dict[UUID, SessionUpdate],
+        held: dict[UUID, SessionUpdate]
+    ) -> None:
+        """Apply the coalesced updates; those of sessions not in the database yet go to `held`."""
+        # Sorted ids keep row lock order consistent across workers.
+        ordered = sorted(sessions.items(), key=lambda item: item[0])
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                await cur.execute(SESSION_UPDATE_SQL, (
+                    [session_id for session_id, _ in ordered],
+                    [update.page_views for _, update in ordered],
+                    [update.last_activity for _, update in ordered],
+                    [update.ended_at for _, update in ordered],
+                ))
+                matched = {row[0] for row in await cur.fetchall()}
+
+        now = time.monotonic()
+        unmatched = 0
+        for session_id, update in ordered:
+            if session_id in matched:
+                continue
+            if update.waiting_since is None or now - update.waiting_since < ANALYTICS_ORPHAN_TIMEOUT:
+                update.waiting_since = update.waiting_since or now
+                held[session_id] = update
+            else:
+                unmatched += 1
+        if unmatched:
+            self.unmatched_sessions += unmatched
+            logger.warning('Dropped updates of %s unknown analytics sessions', unmatched)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'pending': self._pending,
+            'capacity': self.max_events,
+            'flushed_events': self.flushed_events,
+            'dropped_rows': self.dropped_rows,
+            'orphaned_rows': self.orphaned_rows,
+            'unmatched_sessions': self.unmatched_sessions,
+            'flushes': self.flushes,
+            'rollup_refreshes': self.rollup_refreshes,
+        }
+
+
+ingest_buffer = AnalyticsBuffer()
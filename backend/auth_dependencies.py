@@ -1,10 +1,17 @@
+import hashlib
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Any, Optional
 
 import jwt
 from fastapi import Depends, Header, HTTPException, status
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+from metrics import record_stage
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +19,15 @@ SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
 SUPABASE_JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUDIENCE', '')
 ANON_RECOMMENDATION_LIMIT = int(os.getenv('ANON_RECOMMENDATION_LIMIT', '5'))
 AUTH_RECOMMENDATION_LIMIT = int(os.getenv('AUTH_RECOMMENDATION_LIMIT', '25'))
+# Verified tokens are reused until their exp, but for at most AUTH_TOKEN_CACHE_TTL
+# seconds, so a rotated secret or revoked session is picked up within that window.
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_TOKEN_CACHE_MAX_ENTRIES', '10000'))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv('AUTH_TOKEN_CACHE_TTL', '300'))
 
 
 class AuthenticatedUser(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     email: Optional[str] = None
     role: Optional[str] = None
@@ -22,6 +35,8 @@ class AuthenticatedUser(BaseModel):
 
 
 class AccessContext(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     user: Optional[AuthenticatedUser]
     max_recommendations: int
 
@@ -97,7 +112,85 @@ def _decode_supabase_token(token: str) -> AuthenticatedUser:
     )
 
 
-def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[AuthenticatedUser]:
+ANONYMOUS_CONTEXT = AccessContext(user=None, max_recommendations=ANON_RECOMMENDATION_LIMIT)
+
+
+@dataclass(frozen=True)
+class _VerifiedToken:
+    user: AuthenticatedUser
+    context: AccessContext
+    expires_at: float  # time.time() based, like the exp claim
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified tokens keyed by a digest of (secret, token), so a
+    request with a known token costs a dict lookup instead of an HMAC check and
+    two model constructions. Invalid tokens are never cached.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[bytes, _VerifiedToken] = OrderedDict()
+        self._lock = threading.Lock()  # sync dependencies run in the threadpool
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.decode_seconds = 0.0
+
+    @staticmethod
+    def key(secret: str, token: str) -> bytes:
+        # The secret is part of the key: after a rotation old entries simply stop matching.
+        secret_key = hashlib.blake2b(secret.encode('utf-8')).digest()
+        return hashlib.blake2b(token.encode('utf-8'), key=secret_key, digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[_VerifiedToken]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: bytes, entry: _VerifiedToken, decode_seconds: float) -> None:
+        with self._lock:
+            self.decode_seconds += decode_seconds
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        average_decode = self.decode_seconds / self.misses if self.misses else 0.0
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'decode_seconds': self.decode_seconds,
+            # Verification time the hits would have cost at the observed average.
+            'decode_seconds_saved': self.hits * average_decode,
+        }
+
+
+token_cache = TokenCache(AUTH_TOKEN_CACHE_MAX_ENTRIES, AUTH_TOKEN_CACHE_TTL)
+
+
+def _verify(authorization: Optional[str]) -> Optional[_VerifiedToken]:
     if not authorization:
         return None
 
@@ -106,14 +199,37 @@ def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[A
         return None
 
     token = _extract_bearer_token(authorization)
-    return _decode_supabase_token(token)
+    if token is None:
+        return None
+    key = TokenCache.key(SUPABASE_JWT_SECRET, token)
+    entry = token_cache.get(key)
+    if entry is not None:
+        return entry
+
+    started = time.perf_counter()
+    user = _decode_supabase_token(token)
+    context = AccessContext(user=user, max_recommendations=AUTH_RECOMMENDATION_LIMIT)
+    decode_seconds = time.perf_counter() - started
+    record_stage('auth_decode', decode_seconds)
+
+    expires_at = time.time() + AUTH_TOKEN_CACHE_TTL
+    exp = user.claims.get('exp')
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, float(exp))
+    entry = _VerifiedToken(user=user, context=context, expires_at=expires_at)
+    token_cache.set(key, entry, decode_seconds)
+    return entry
 
 
-def get_access_context(
-    user: Optional[AuthenticatedUser] = Depends(get_optional_user)
-) -> AccessContext:
-    limit = AUTH_RECOMMENDATION_LIMIT if user else ANON_RECOMMENDATION_LIMIT
-    return AccessContext(user=user, max_recommendations=limit)
+def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[AuthenticatedUser]:
+    entry = _verify(authorization)
+    return entry.user if entry else None
+
+
+def get_access_context(authorization: Optional[str] = Header(None)) -> AccessContext:
+    """Shared immutable context: one per verified token, one for all anonymous requests."""
+    entry = _verify(authorization)
+    return entry.context if entry else ANONYMOUS_CONTEXT
 
 
 def require_authenticated_user(
@@ -0,0 +1,81 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.environ['DATABASE_URL']
+
+# Pool sizing is per uvicorn worker: workers * DB_POOL_MAX_SIZE must stay below
+# the Postgres max_connections budget.
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', '300'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '3600'))
+DB_POOL_CHECK = os.getenv('DB_POOL_CHECK', 'true').lower() in ('1', 'true', 'yes')
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+async def open_pool() -> AsyncConnectionPool:
+    """Create and open the worker's connection pool (called from the app lifespan)."""
+    global _pool
+    if _pool is not None:
+        return _pool
+
+    _pool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check=AsyncConnectionPool.check_connection if DB_POOL_CHECK else None,
+        name='mynewplaylist',
+        open=False,
+    )
+    await _pool.open()
+    logger.info(
+        'Database pool opened (min=%s, max=%s, timeout=%ss)',
+        DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT
+    )
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is None:
+        return
+    await _pool.close()
+    _pool = None
+    logger.info('Database pool closed')
+
+
+def pool_stats() -> Optional[dict[str, int]]:
+    return _pool.get_stats() if _pool is not None else None
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError('Database pool is not open; is the app lifespan running?')
+    return _pool
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[AsyncConnection]:
+    """
+    Borrow a connection from the pool.
+    Raises psycopg_pool.PoolTimeout if none becomes available within DB_POOL_TIMEOUT.
+    """
+    started = time.perf_counter()
+    async with get_pool().connection() as conn:
+        record_stage('pool_acquire', time.perf_counter() - started)
+        yield conn
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import psycopg
+from psycopg import sql
+from psycopg_pool import PoolTimeout
+
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+# Identifies the Word2Vec model whose vectors are in b25.songs; used as the active
+# version on databases without b25.embedding_versions.
+EMBEDDING_MODEL_VERSION = os.getenv('EMBEDDING_MODEL_VERSION', 'b25-CBOW-256-5-150v4')
+EMBEDDING_DIMS = int(os.getenv('EMBEDDING_DIMS', '256'))
+# How long a worker trusts its view of the active version; an activation (or
+# rollback) reaches every worker within this many seconds.
+EMBEDDING_VERSION_TTL = float(os.getenv('EMBEDDING_VERSION_TTL', '5'))
+
+# The generation moves whenever rows of the version's table or of the neighbour
+# lists are written, so content reloaded under the same version name (load_embeddings.py
+# without --version, build_neighbors.py) gets fresh recommendation cache entries.
+ACTIVE_VERSION_SQL = """
+    SELECT v.version,
+           v.table_name,
+           COALESCE(v.dims, %s),
+           concat_ws(
+               '.',
+               t.n_tup_ins + t.n_tup_upd + t.n_tup_del,
+               n.n_tup_ins + n.n_tup_upd + n.n_tup_del
+           )
+    FROM b25.embedding_versions v
+    LEFT JOIN pg_stat_user_tables t ON t.schemaname = 'b25' AND t.relname = v.table_name
+    LEFT JOIN pg_stat_user_tables n ON n.schemaname = 'b25' AND n.relname = 'song_neighbors'
+    WHERE v.active
+"""
+
+
+@dataclass(frozen=True)
+class EmbeddingVersion:
+    """An embedding model version and the b25 table holding its song rows."""
+
+    version: str
+    table_name: str
+    dims: int = EMBEDDING_DIMS
+    # Write counter of the version's data; not part of its identity.
+    generation: str = field(default='', compare=False)
+
+    @property
+    def table(self) -> sql.Identifier:
+        return sql.Identifier('b25', self.table_name)
+
+    @property
+    def cache_namespace(self) -> str:
+        """Recommendation cache namespace: the version and the generation of its data."""
+        return f'{self.version}@{self.generation}' if self.generation else self.version
+
+
+LEGACY_VERSION = EmbeddingVersion(EMBEDDING_MODEL_VERSION, 'songs')
+
+_active: Optional[EmbeddingVersion] = None
+_checked_at = 0.0
+_lock = asyncio.Lock()
+
+
+def _fresh() -> Optional[EmbeddingVersion]:
+    """The cached active version, unless it is missing or older than EMBEDDING_VERSION_TTL."""
+    if _active is not None and time.monotonic() - _checked_at < EMBEDDING_VERSION_TTL:
+        return _active
+    return None
+
+
+async def get_active_version() -> EmbeddingVersion:
+    """
+    The version requests should be served from. Re-read at most every
+    EMBEDDING_VERSION_TTL seconds; if the database cannot be reached the
+    last known version is kept.
+    """
+    global _active, _checked_at
+    active = _fresh()
+    if active is not None:
+        return active
+
+    async with _lock:
+        active = _fresh()
+        if active is not None:
+            return active
+
+        try:
+            async with connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(ACTIVE_VERSION_SQL, (EMBEDDING_DIMS,))
+                    row = await cur.fetchone()
+            resolved = EmbeddingVersion(*row) if row else LEGACY_VERSION
+        except psycopg.errors.UndefinedTable:
+            resolved = LEGACY_VERSION
+        except (psycopg.OperationalError, PoolTimeout):
+            if _active is None:
+                raise
+            logger.warning('Could not refresh the active embedding version; keeping %s', _active.version)
+            resolved = _active
+
+        if _active is not None and resolved != _active:
+            logger.info('Active embedding version changed: %s -> %s', _active.version, resolved.version)
+        _active = resolved
+        _checked_at = time.monotonic()
+        return _active
+
+
+def current_version() -> str:
+    """Last resolved version without a database round trip (for tagging)."""
+    return (_active or LEGACY_VERSION).version
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from pgvector.psycopg import register_vector_async
+from psycopg import sql
+
+from db import connection
+from embedding_versions import EMBEDDING_MODEL_VERSION, EmbeddingVersion, get_active_version
+from recommendation_cache import cache
+from recommendation_sql import NO_FILTERS, RecommendationFilters
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency, only needed for EMBEDDING_ENGINE=ann
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# 'sql' keeps every recommendation in pgvector; 'exact' serves them from an
+# in-process matrix with brute-force search; 'ann' adds an hnswlib index on top.
+EMBEDDING_ENGINE = os.getenv('EMBEDDING_ENGINE', 'sql').lower()
+EMBEDDING_LOAD_BATCH = int(os.getenv('EMBEDDING_LOAD_BATCH', '20000'))
+EMBEDDING_ANN_M = int(os.getenv('EMBEDDING_ANN_M', '16'))
+EMBEDDING_ANN_EF_CONSTRUCTION = int(os.getenv('EMBEDDING_ANN_EF_CONSTRUCTION', '200'))
+EMBEDDING_ANN_EF_SEARCH = int(os.getenv('EMBEDDING_ANN_EF_SEARCH', '200'))
+EMBEDDING_BATCH_SCORE_BYTES = int(os.getenv('EMBEDDING_BATCH_SCORE_BYTES', str(64 * 2**20)))
+# Seconds before a failed load of the active version is attempted again.
+EMBEDDING_RELOAD_RETRY = float(os.getenv('EMBEDDING_RELOAD_RETRY', '60'))
+
+# Stands in for a NULL relevance, so no min_relevance filter admits it (as in SQL).
+MISSING_RELEVANCE = np.iinfo(np.int64).min
+
+LOAD_EMBEDDINGS_SQL = sql.SQL("""
+    SELECT track_id, track_name, artist_name, track_external_urls, relevance, embedding
+    FROM {songs}
+    WHERE embedding IS NOT NULL
+""")
+
+
+class EmbeddingIndex:
+    """Contiguous float32 copy of b25.songs embeddings with a track_id -> row index."""
+
+    def __init__(
+        self,
+        track_ids: list[str],
+        track_names: list[Optional[str]],
+        artist_names: list[Optional[str]],
+        track_external_urls: list[Optional[str]],
+        matrix: np.ndarray,
+        use_ann: bool = False,
+        version: str = EMBEDDING_MODEL_VERSION,
+        relevance: Optional[list[Optional[int]]] = None,
+    ):
+        self.version = version
+        self.track_ids = track_ids
+        self.track_names = track_names
+        self.artist_names = artist_names
+        self.track_external_urls = track_external_urls
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.rows = {track_id: row for row, track_id in enumerate(track_ids)}
+        self.relevance = np.array(
+            [MISSING_RELEVANCE if value is None else value for value in (relevance or [None] * len(track_ids))],
+            dtype=np.int64,
+        )
+        # One code per artist name; songs without an artist get a unique negative code.
+        self.artist_codes: dict[str, int] = {}
+        self.artist_of = np.fromiter(
+            (
+                -1 - row if name is None else self.artist_codes.setdefault(name, len(self.artist_codes))
+                for row, name in enumerate(artist_names)
+            ),
+            dtype=np.intp,
+            count=len(artist_names),
+        )
+        self.ann: Any = self._build_ann() if use_ann else None
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1])
+
+    def _build_ann(self) -> Any:
+        if hnswlib is None:
+            raise RuntimeError('EMBEDDING_ENGINE=ann requires the hnswlib package')
+        index = hnswlib.Index(space='l2', dim=self.dim)
+        index.init_index(
+            max_elements=len(self),
+            ef_construction=EMBEDDING_ANN_EF_CONSTRUCTION,
+            M=EMBEDDING_ANN_M,
+        )
+        index.add_items(self.matrix, np.arange(len(self)), num_threads=-1)
+        index.set_ef(EMBEDDING_ANN_EF_SEARCH)
+        return index
+
+    def lookup(self, song_ids: Sequence[str]) -> np.ndarray:
+        """Rows of the known seeds; unknown and duplicate ids are ignored like the SQL AVG."""
+        rows = {self.rows[song_id] for song_id in song_ids if song_id in self.rows}
+        return np.fromiter(sorted(rows), dtype=np.intp, count=len(rows))
+
+    def centroid(self, rows: np.ndarray) -> np.ndarray:
+        return self.matrix[rows].mean(axis=0, dtype=np.float64).astype(np.float32)
+
+    def _scores(self, centroids: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2; the constant term does not change the order.
+        return self.sq_norms - 2.0 * (centroids @ self.matrix.T)
+
+    def _top_k(self, scores: np.ndarray, k: int, exclude: np.ndarray) -> np.ndarray:
+        scores[exclude] = np.inf
+        k = min(k, len(self) - len(exclude))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        return np.argpartition(scores, k - 1)[:k]
+
+    def _ann_candidates(self, centroid: np.ndarray, k: int, exclude: np.ndarray) -> np.ndarray:
+        fetch = min(k + len(exclude), len(self))
+        labels, _ = self.ann.knn_query(centroid, k=fetch)
+        candidates = labels[0].astype(np.intp)
+        return candidates[~np.isin(candidates, exclude)][:k]
+
+    def _rank(self, centroid: np.ndarray, candidates: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Report exact distances (as pgvector's <-> would) and order by them.
+        distances = np.linalg.norm(self.matrix[candidates] - centroid, axis=1)
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def search(self, centroid: np.ndarray, k: int, exclude: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k rows nearest to the centroid (L2), excluding the given rows."""
+        if self.ann is not None:
+            candidates = self._ann_candidates(centroid, k, exclude)
+        else:
+            candidates = self._top_k(self._scores(centroid), k, exclude)
+        return self._rank(centroid, candidates)
+
+    def _excluded(self, filters: RecommendationFilters, seed_rows: np.ndarray) -> np.ndarray:
+        excluded = np.zeros(len(self), dtype=bool)
+        excluded[seed_rows] = True
+        if filters.min_relevance is not None:
+            excluded |= self.relevance < filters.min_relevance
+        codes = [self.artist_codes[name] for name in filters.exclude_artists if name in self.artist_codes]
+        if codes:
+            excluded |= np.isin(self.artist_of, codes)
+        return excluded
+
+    def search_filtered(
+        self,
+        centroid: np.ndarray,
+        k: int,
+        seed_rows: np.ndarray,
+        filters: RecommendationFilters
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k rows passing the filters. Always scored exactly (also with an ANN
+        index), so restrictive filters cannot leave the result short.
+        """
+        scores = self._scores(centroid)
+        excluded = self._excluded(filters, seed_rows)
+        scores[excluded] = np.inf
+        available = len(self) - int(excluded.sum())
+        if available <= 0:
+            return self._rank(centroid, np.empty(0, dtype=np.intp))
+        if not filters.one_per_artist:
+            k = min(k, available)
+            return self._rank(centroid, np.argpartition(scores, k - 1)[:k])
+
+        # Widen the nearest candidates until they span k distinct artists.
+        fetch = min(k * 4, available)
+        while True:
+            candidates = np.argpartition(scores, fetch - 1)[:fetch]
+            candidates = candidates[np.argsort(scores[candidates], kind='stable')]
+            _, first = np.unique(self.artist_of[candidates], return_index=True)
+            picked = candidates[np.sort(first)][:k]
+            if len(picked) >= k or fetch >= available:
+                return self._rank(centroid, picked)
+            fetch = min(fetch * 2, available)
+
+    def to_results(self, rows: np.ndarray, distances: np.ndarray) -> list[dict[str, Any]]:
+        return [
+            {
+                'track_id': self.track_ids[row],
+                'track_name': self.track_names[row],
+                'artist_name': self.artist_names[row],
+                'track_external_urls': self.track_external_urls[row],
+                'distance': float(distance),
+            }
+            for row, distance in zip(rows.tolist(), distances.tolist())
+        ]
+
+    def recommend(
+        self,
+        song_ids: Sequence[str],
+        limit: int,
+        filters: RecommendationFilters = NO_FILTERS
+    ) -> Optional[list[dict[str, Any]]]:
+        """
+        Nearest songs to the average embedding of the seeds.
+        Returns None when none of the seeds are known so the caller can fall back to SQL.
+        """
+        seed_rows = self.lookup(song_ids)
+        if seed_rows.size == 0:
+            return None
+        if filters:
+            rows, distances = self.search_filtered(self.centroid(seed_rows), limit, seed_rows, filters)
+        else:
+            rows, distances = self.search(self.centroid(seed_rows), limit, seed_rows)
+        return self.to_results(rows, distances)
+
+    def recommend_many(self, seed_sets: Sequence[Sequence[str]], limit: int) -> list[Optional[list[dict[str, Any]]]]:
+        """
+        Batch form of recommend(): all centroids are scored against the catalog with
+        one matrix product per block. Entries whose seeds are all unknown are None.
+        """
+        results: list[Optional[list[dict[str, Any]]]] = [None] * len(seed_sets)
+        seed_rows = [self.lookup(song_ids) for song_ids in seed_sets]
+        known = [i for i, rows in enumerate(seed_rows) if rows.size]
+        if not known:
+            return results
+
+        centroids = np.stack([self.centroid(seed_rows[i]) for i in known])
+        if self.ann is not None:
+            for centroid, i in zip(centroids, known):
+                results[i] = self.to_results(*self.search(centroid, limit, seed_rows[i]))
+            return results
+
+        # Bound the (block x catalog) score matrix to ~EMBEDDING_BATCH_SCORE_BYTES.
+        block = max(1, EMBEDDING_BATCH_SCORE_BYTES // (4 * len(self)))
+        for start in range(0, len(known), block):
+            scores = self._scores(centroids[start:start + block])
+            for offset, i in enumerate(known[start:start + block]):
+                candidates = self._top_k(scores[offset], limit, seed_rows[i])
+                results[i] = self.to_results(*self._rank(centroids[start + offset], candidates))
+        return results
+
+
+_index: Optional[EmbeddingIndex] = None
+_loading: Optional[asyncio.Task[Optional[EmbeddingIndex]]] = None
+_failed: dict[str, float] = {}
+
+
+def get_index(version: Optional[str] = None) -> Optional[EmbeddingIndex]:
+    """
+    The loaded in-process index, or None while loading / when EMBEDDING_ENGINE=sql.
+    With `version`, only an index holding that embedding version is returned.
+    """
+    if _index is not None and version is not None and _index.version != version:
+        return None
+    return _index
+
+
+def start_index_load(version: Optional[EmbeddingVersion] = None) -> Optional[asyncio.Task[Optional[EmbeddingIndex]]]:
+    """
+    Load `version` (default: the active one) in the background unless it is already
+    loaded or loading. The previous index keeps serving its own version meanwhile.
+    """
+    global _loading
+    if EMBEDDING_ENGINE not in ('exact', 'ann'):
+        return None
+    if version is not None:
+        if _index is not None and _index.version == version.version:
+            return None
+        if time.monotonic() - _failed.get(version.version, -EMBEDDING_RELOAD_RETRY) < EMBEDDING_RELOAD_RETRY:
+            return None
+    if _loading is not None and not _loading.done():
+        return _loading
+
+    _loading = asyncio.create_task(load_index(version))
+    return _loading
+
+
+async def _fetch_catalog(
+    version: EmbeddingVersion,
+) -> tuple[
+    list[str], list[Optional[str]], list[Optional[str]], list[Optional[str]], list[Optional[int]], np.ndarray
+]:
+    track_ids: list[str] = []
+    track_names: list[Optional[str]] = []
+    artist_names: list[Optional[str]] = []
+    urls: list[Optional[str]] = []
+    relevance: list[Optional[int]] = []
+    chunks: list[np.ndarray] = []
+
+    async with connection() as conn:
+        await register_vector_async(conn)
+        async with conn.cursor(name='embedding_index_load') as cur:
+            await cur.execute(LOAD_EMBEDDINGS_SQL.format(songs=version.table))
+            while True:
+                batch = await cur.fetchmany(EMBEDDING_LOAD_BATCH)
+                if not batch:
+                    break
+                for track_id, track_name, artist_name, url, song_relevance, _ in batch:
+                    track_ids.append(track_id)
+                    track_names.append(track_name)
+                    artist_names.append(artist_name)
+                    urls.append(url)
+                    relevance.append(song_relevance)
+                chunks.append(np.stack([row[5] for row in batch]).astype(np.float32, copy=False))
+
+    matrix = np.concatenate(chunks) if chunks else np.empty((0, 0), dtype=np.float32)
+    return track_ids, track_names, artist_names, urls, relevance, matrix
+
+
+async def load_index(version: Optional[EmbeddingVersion] = None) -> Optional[EmbeddingIndex]:
+    """
+    Load (or reload) the catalog embeddings of `version` (default: the active one)
+    into memory according to EMBEDDING_ENGINE. Failures are logged and leave the
+    previous index (or the SQL path) in place. Reloading the version already loaded
+    (the catalog changed in place) drops the recommendation cache.
+    """
+    global _index
+    if EMBEDDING_ENGINE not in ('exact', 'ann'):
+        return None
+
+    started = time.perf_counter()
+    try:
+        if version is None:
+            version = await get_active_version()
+        track_ids, track_names, artist_names, urls, relevance, matrix = await _fetch_catalog(version)
+        if not track_ids:
+            logger.warning('No embeddings found in %s; recommendations stay on SQL', version.table_name)
+            _failed[version.version] = time.monotonic()
+            return None
+
+        index = await asyncio.to_thread(
+            EmbeddingIndex,
+            track_ids,
+            track_names,
+            artist_names,
+            urls,
+            matrix,
+            EMBEDDING_ENGINE == 'ann',
+            version.version,
+            relevance,
+        )
+    except Exception:
+        logger.exception('Failed to load the %s embedding engine', EMBEDDING_ENGINE)
+        if version is not None:
+            _failed[version.version] = time.monotonic()
+        return None
+
+    reloaded = _index is not None and _index.version == index.version
+    _index = index
+    _failed.pop(version.version, None)
+    if reloaded:
+        await cache.invalidate()
+    logger.info(
+        'Loaded %s embeddings of %s (%s dims, %.1f MiB) into the %s engine in %.1fs',
+        len(index), index.version, index.dim, index.matrix.nbytes / 2**20, EMBEDDING_ENGINE,
+        time.perf_counter() - started
+    )
+    return index
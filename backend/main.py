@@ -1,14 +1,83 @@
+import asyncio
+import contextlib
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
-import psycopg
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from psycopg_pool import PoolTimeout
+from pydantic import BaseModel, Field
 
 from analytics import router as analytics_router
-from auth_dependencies import AccessContext, get_access_context
+from analytics_ingest import ingest_buffer
+from auth_dependencies import (
+    AccessContext,
+    AuthenticatedUser,
+    get_access_context,
+    require_authenticated_user,
+    token_cache,
+)
+from db import close_pool, open_pool, pool_stats
+from embeddings import start_index_load
+from metrics import (
+    MetricsMiddleware,
+    TimedJSONResponse,
+    mark_worker_dead,
+    render_metrics,
+    start_metrics_refresh,
+)
+from profiling import SlowRequestMiddleware, install_profiler_signal, profiler, slow_requests
+from rate_limit import rate_limiter
+from recommendation_cache import cache
+from recommendation_sql import RecommendationFilters
+from recommendations import recommend, recommend_many
+from search import SEARCH_MAX_LIMIT, SEARCH_STREAM_MAX_LIMIT, search_cache, search_songs, stream_search
+from singleflight import recommendation_flights, search_flights
+from streaming import NDJSONResponse, export_songs, try_acquire_stream_slot
+from suggest import SUGGEST_MAX_LIMIT, get_suggest_index, start_suggest_index, suggest_from_database
+
+RECOMMENDATION_BATCH_MAX_ITEMS = int(os.getenv('RECOMMENDATION_BATCH_MAX_ITEMS', '100'))
+RECOMMENDATION_MAX_EXCLUDED_ARTISTS = int(os.getenv('RECOMMENDATION_MAX_EXCLUDED_ARTISTS', '500'))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await open_pool()
+    await ingest_buffer.start()
+    # The in-process embedding index loads in the background; until it is
+    # ready recommendations are served by pgvector.
+    index_loader = start_index_load()
+    # Typeahead prefix index; /search/suggest uses the database until it is built.
+    suggest_loader = start_suggest_index()
+    metrics_refresh = start_metrics_refresh(pool_stats, {
+        'recommendation_cache': cache.stats,
+        'search_cache': search_cache.stats,
+        'token_cache': token_cache.stats,
+        'rate_limit': rate_limiter.stats,
+        'analytics_ingest': ingest_buffer.stats,
+        'slow_requests': slow_requests.stats,
+        'recommendation_coalescing': recommendation_flights.stats,
+        'search_coalescing': search_flights.stats,
+    })
+    install_profiler_signal()
+    try:
+        yield
+    finally:
+        for task in (index_loader, suggest_loader, metrics_refresh):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        # Drain buffered analytics before the pool goes away.
+        await ingest_buffer.stop()
+        await close_pool()
+        await profiler.stop()
+        mark_worker_dead()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 
 # Configure CORS (production is same-origin via nginx; this is a safe fallback)
 allowed_origins_env = os.getenv('ALLOWED_ORIGINS', '*')
@@ -21,112 +90,199 @@ app.add_middleware(
     allow_credentials=False if '*' in allowed_origins else True,
     allow_methods=['*'],
     allow_headers=['*'],
+    expose_headers=[
+        'X-Recommendation-Limit',
+        'X-Recommendation-Plan',
+        'X-Recommendation-User',
+        'X-Embedding-Version',
+        'Retry-After',
+    ],
 )
 
+# Slow-request log inside the metrics middleware, which collects the stage timings.
+app.add_middleware(SlowRequestMiddleware)
+# Outermost, so latency includes CORS handling and error responses.
+app.add_middleware(MetricsMiddleware)
+
 # Include analytics router
 app.include_router(analytics_router)
 
-DATABASE_URL = os.environ['DATABASE_URL']
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout) -> JSONResponse:
+    # All pooled connections stayed busy for DB_POOL_TIMEOUT; shed load instead of queueing.
+    return JSONResponse(
+        status_code=503,
+        content={'detail': 'Database is busy, please retry shortly.'},
+        headers={'Retry-After': '1'},
+    )
+
+
+def _quota_detail(context: AccessContext) -> dict[str, object]:
+    max_limit = context.max_recommendations
+    detail: dict[str, object] = {
+        'message': f'You can request up to {max_limit} recommendations per call.',
+        'max_limit': max_limit,
+        'is_authenticated': context.is_authenticated,
+    }
+    if not context.is_authenticated:
+        detail['hint'] = 'Sign in with Google to unlock higher limits.'
+    return detail
+
+
+def _plan_response(content: object, context: AccessContext, embedding_version: str) -> JSONResponse:
+    response = TimedJSONResponse(content=content)
+    response.headers['X-Embedding-Version'] = embedding_version
+    response.headers['X-Recommendation-Limit'] = str(context.max_recommendations)
+    response.headers['X-Recommendation-Plan'] = (
+        'authenticated' if context.is_authenticated else 'anonymous'
+    )
+    if context.user:
+        response.headers['X-Recommendation-User'] = context.user.id
+    return response
 
 
 @app.get('/recommend-average/')
-def get_recommendations_by_average(
+async def get_recommendations_by_average(
+    request: Request,
     song_ids: list[str] = Query(..., description='List of song IDs'),
     limit: int = Query(10, gt=0, description='Number of recommendations to return'),
+    min_relevance: Optional[int] = Query(None, description='Only recommend songs with at least this relevance'),
+    exclude_artists: list[str] = Query([], description='Artists to leave out, e.g. those already in the playlist'),
+    one_per_artist: bool = Query(False, description='At most one recommended song per artist'),
     context: AccessContext = Depends(get_access_context)
 ):
     """
     Get song recommendations based on the average embedding of multiple songs.
-    Enforces per-plan quotas based on the Supabase session (guest vs. authenticated).
+    Enforces per-plan quotas and request rates based on the Supabase session
+    (guest vs. authenticated).
+    Filters are applied during the vector search, so filtered requests still return
+    `limit` songs whenever the catalog has enough matches.
     """
     max_limit = context.max_recommendations
     if limit > max_limit:
-        detail: dict[str, object] = {
-            'message': f'You can request up to {max_limit} recommendations per call.',
-            'max_limit': max_limit,
-            'is_authenticated': context.is_authenticated,
-        }
-        if not context.is_authenticated:
-            detail['hint'] = 'Sign in with Google to unlock higher limits.'
-        raise HTTPException(status_code=403, detail=detail)
+        raise HTTPException(status_code=403, detail=_quota_detail(context))
+    if len(exclude_artists) > RECOMMENDATION_MAX_EXCLUDED_ARTISTS:
+        raise HTTPException(
+            status_code=422,
+            detail=f'At most {RECOMMENDATION_MAX_EXCLUDED_ARTISTS} artists can be excluded.'
+        )
+    await rate_limiter.enforce(request, context)
 
     effective_limit = min(limit, max_limit)
+    filters = RecommendationFilters(
+        min_relevance=min_relevance,
+        exclude_artists=frozenset(exclude_artists),
+        one_per_artist=one_per_artist,
+    )
+
+    request_class = 'authenticated' if context.is_authenticated else 'anonymous'
+    result, embedding_version = await recommend(song_ids, effective_limit, filters, request_class)
+    return _plan_response(result, context, embedding_version)
+
+
+class RecommendationBatchItem(BaseModel):
+    song_ids: list[str] = Field(..., min_length=1, description='Seed song IDs')
+    limit: int = Field(10, gt=0, description='Number of recommendations to return')
 
-    with psycopg.connect(DATABASE_URL) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT track_id,
-                       track_name,
-                       artist_name,
-                       track_external_urls,
-                       embedding <-> (
-                           SELECT AVG(embedding)
-                           FROM b25.songs
-                           WHERE track_id = ANY(%s::text[])
-                       ) AS distance
-                FROM b25.songs
-                WHERE track_id != ALL(%s::text[])
-                ORDER BY distance
-                LIMIT %s
-                """,
-                (song_ids, song_ids, effective_limit)
-            )
-
-            rows = cur.fetchall()
-            result = [
-                {
-                    'track_id': r[0],
-                    'track_name': r[1],
-                    'artist_name': r[2],
-                    'track_external_urls': r[3],
-                    'distance': r[4]
-                }
-                for r in rows
-            ]
-            response = JSONResponse(content=result)
-            response.headers['X-Recommendation-Limit'] = str(max_limit)
-            response.headers['X-Recommendation-Plan'] = (
-                'authenticated' if context.is_authenticated else 'anonymous'
-            )
-            if context.user:
-                response.headers['X-Recommendation-User'] = context.user.id
-            return response
+
+class RecommendationBatchRequest(BaseModel):
+    items: list[RecommendationBatchItem] = Field(
+        ..., min_length=1, max_length=RECOMMENDATION_BATCH_MAX_ITEMS
+    )
+
+
+@app.post('/recommend-batch')
+async def get_recommendations_batch(
+    request: Request,
+    batch: RecommendationBatchRequest,
+    context: AccessContext = Depends(get_access_context)
+):
+    """
+    Recommendations for many seed sets in one round trip, returned in input order.
+    The per-plan quota applies to each item; items over quota are rejected individually.
+    Each accepted item counts as one call against the plan's request rate.
+    """
+    max_limit = context.max_recommendations
+    accepted = [i for i, item in enumerate(batch.items) if item.limit <= max_limit]
+    if accepted:
+        await rate_limiter.enforce(request, context, cost=len(accepted))
+    computed, embedding_version = await recommend_many(
+        [batch.items[i].song_ids for i in accepted],
+        [batch.items[i].limit for i in accepted],
+    )
+    by_position = dict(zip(accepted, computed))
+
+    results: list[dict[str, object]] = []
+    for i in range(len(batch.items)):
+        if i in by_position:
+            results.append({'status': 'ok', 'recommendations': by_position[i]})
+        else:
+            results.append({'status': 'rejected', 'error': _quota_detail(context)})
+    return _plan_response({'results': results}, context, embedding_version)
 
 
 @app.get('/search-advanced/')
-def search_songs_advanced(query: str, limit: int = 50):
+async def search_songs_advanced(query: str, limit: int = Query(50, gt=0, le=SEARCH_MAX_LIMIT)):
+    """
+    Ranked song search: weighted full-text match (track name over artist) blended
+    with trigram similarity and catalog relevance, best match first.
+    For more than SEARCH_MAX_LIMIT results use /search-advanced/stream.
+    """
+    return await search_songs(query, limit)
+
+
+async def _ndjson_response(chunks: AsyncIterator[bytes]) -> NDJSONResponse:
+    if not await try_acquire_stream_slot():
+        raise HTTPException(
+            status_code=503,
+            detail='Too many streams in progress, please retry shortly.',
+            headers={'Retry-After': '1'},
+        )
+    return NDJSONResponse(chunks)
+
+
+@app.get('/search-advanced/stream')
+async def stream_search_songs(
+    query: str,
+    limit: int = Query(1000, gt=0, le=SEARCH_STREAM_MAX_LIMIT),
+):
+    """
+    Same ranking as /search-advanced/ for bulk consumers: newline-delimited JSON,
+    a line of column names followed by one song per line as an array in that
+    order, sent while the rows are still being read.
+    """
+    return await _ndjson_response(stream_search(query, limit))
+
+
+@app.get('/songs/export')
+async def export_catalog(user: AuthenticatedUser = Depends(require_authenticated_user)):
+    """The whole song catalog as NDJSON like /search-advanced/stream, ordered by track id (signed-in users only)."""
+    return await _ndjson_response(export_songs())
+
+
+@app.get('/search/suggest')
+async def suggest_songs(
+    q: str = Query(..., description='What the user has typed so far'),
+    limit: int = Query(8, gt=0, le=SUGGEST_MAX_LIMIT),
+):
     """
-    Advanced search using PostgreSQL full-text search capabilities.
-    Provides better ranking and relevance scoring.
+    Typeahead suggestions: songs whose track name, a word of it, or artist starts
+    with `q` (accent- and case-insensitive), most relevant first. Served from the
+    in-process prefix index without a database round trip; while the index is
+    loading or disabled, from a prefix query on whole track and artist names.
     """
-    with psycopg.connect(DATABASE_URL) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                    SELECT
-                        track_id,
-                        track_name,
-                        artist_name,
-                        track_external_urls
-                    FROM b25.songs
-                    WHERE
-                        to_tsvector('english', track_name || ' ' || artist_name) @@ plainto_tsquery('english', %s)
-                        OR track_name ILIKE %s
-                    ORDER BY track_name
-                    LIMIT %s;
-                """,
-                (query, f'%{query}%', limit)
-            )
-
-            rows = cur.fetchall()
-            columns = [desc[0] for desc in cur.description]
-
-            results = [
-                dict(zip(columns, row))
-                for row in rows
-            ]
-            return results
+    index = get_suggest_index()
+    if index is None:
+        return await suggest_from_database(q, limit)
+    return index.suggest(q, limit)
+
+
+@app.get('/metrics', include_in_schema=False)
+def metrics():
+    """Prometheus metrics, summed over all workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 @app.get('/')
@@ -0,0 +1,229 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+
+from fastapi.responses import JSONResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# With several uvicorn workers, PROMETHEUS_MULTIPROC_DIR must point at a directory
+# shared by them and emptied before they start (see Dockerfile.prod); /metrics then
+# reports the sum over all workers. Without it, only the answering worker is reported.
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+# How often each worker copies pool, cache and ingest counters into the metrics.
+METRICS_REFRESH_INTERVAL = float(os.getenv('METRICS_REFRESH_INTERVAL', '5'))
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being served', multiprocess_mode='livesum',
+)
+# Stages: auth_decode, pool_acquire, sql, rows_to_dicts, json_render. Work outside
+# a request (background loaders, the analytics flusher) has route="background".
+STAGE_LATENCY = Histogram(
+    'request_stage_duration_seconds', 'Time spent in one stage of request handling',
+    ['route', 'stage'], buckets=STAGE_BUCKETS,
+)
+POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled database connections by state',
+    ['state'], multiprocess_mode='livesum',
+)
+POOL_EVENTS = Counter('db_pool_events', 'Connection pool events', ['event'])
+COMPONENT_EVENTS = Counter('app_component_events', 'Cache, rate limit and ingest counters', ['component', 'event'])
+COMPONENT_LEVELS = Gauge(
+    'app_component_level', 'Cache sizes and buffer fill levels',
+    ['component', 'level'], multiprocess_mode='livesum',
+)
+
+# Keys of the components' stats() that are current levels rather than running totals.
+# Derived values that can go down (decode_seconds_saved is hits x a running
+# average) are levels too: as counters, every decrease would read as a reset.
+LEVEL_KEYS = {'entries', 'pending', 'capacity', 'decode_seconds_saved'}
+# Running totals of psycopg_pool's get_stats().
+POOL_COUNTER_KEYS = {
+    'requests_num': 'requests',
+    'requests_queued': 'queued',
+    'requests_errors': 'timeouts',
+    'connections_num': 'connects',
+    'connections_errors': 'connect_errors',
+    'connections_lost': 'lost',
+}
+
+
+@dataclass
+class RequestTimings:
+    """Per-request stage totals; the scope gives the route once routing has run."""
+
+    scope: Scope
+    stages: dict[str, float] = field(default_factory=dict)
+    # (setup statements, query, params) of the last query, for the slow-request EXPLAIN.
+    last_query: Optional[tuple[tuple[tuple[Any, Any], ...], Any, Any]] = None
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get('route')
+        return getattr(route, 'path', None) or 'unmatched'
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is None:
+        STAGE_LATENCY.labels('background', name).observe(seconds)
+        return
+    timings.stages[name] = timings.stages.get(name, 0.0) + seconds
+    STAGE_LATENCY.labels(timings.route, name).observe(seconds)
+
+
+def record_query(query: Any, params: Any, setup: tuple[tuple[Any, Any], ...] = ()) -> None:
+    """Remember the request's main query; `setup` are the (sql, params) it ran after, e.g. set_config."""
+    timings = _current.get()
+    if timings is not None:
+        timings.last_query = (setup, query, params)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose serialization is recorded as the json_render stage."""
+
+    def render(self, content: Any) -> bytes:
+        with stage('json_render'):
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """Latency per route template and in-flight count; sets up stage timing for the request."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _current.set(timings)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_LATENCY.labels(scope['method'], timings.route, str(status)).observe(
+                time.perf_counter() - started
+            )
+            _current.reset(token)
+
+
+class _TotalsTracker:
+    """Turns the running totals of a stats() dict into Counter increments."""
+
+    def __init__(self) -> None:
+        self._last: dict[tuple[str, ...], float] = {}
+
+    def add(self, counter: Counter, labels: tuple[str, ...], total: float) -> None:
+        previous = self._last.get(labels, 0.0)
+        # A total below the last one means the source was reset (cache.clear, new pool).
+        delta = total - previous if total >= previous else total
+        if delta > 0:
+            counter.labels(*labels).inc(delta)
+        self._last[labels] = total
+
+
+_totals = _TotalsTracker()
+
+
+def refresh(pool_stats: Optional[dict[str, int]], components: dict[str, Callable[[], dict[str, Any]]]) -> None:
+    if pool_stats is not None:
+        size = pool_stats.get('pool_size', 0)
+        available = pool_stats.get('pool_available', 0)
+        POOL_CONNECTIONS.labels('in_use').set(size - available)
+        POOL_CONNECTIONS.labels('idle').set(available)
+        POOL_CONNECTIONS.labels('max').set(pool_stats.get('pool_max', 0))
+        POOL_CONNECTIONS.labels('waiting').set(pool_stats.get('requests_waiting', 0))
+        for key, event in POOL_COUNTER_KEYS.items():
+            _totals.add(POOL_EVENTS, (event,), pool_stats.get(key, 0))
+        _totals.add(POOL_EVENTS, ('wait_ms',), pool_stats.get('requests_wait_ms', 0))
+
+    for component, stats in components.items():
+        for key, value in stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or key.endswith('_rate'):
+                continue
+            if key in LEVEL_KEYS:
+                COMPONENT_LEVELS.labels(component, key).set(value)
+            else:
+                _totals.add(COMPONENT_EVENTS, (component, key), value)
+
+
+def start_metrics_refresh(
+    pool_stats: Callable[[], Optional[dict[str, int]]],
+    components: dict[str, Callable[[], dict[str, Any]]]
+) -> asyncio.Task:
+    """Per-worker loop publishing pool saturation and component counters."""
+    async def loop() -> None:
+        while True:
+            try:
+                refresh(pool_stats(), components)
+            except Exception:
+                logger.warning('Refreshing metrics failed', exc_info=True)
+            await asyncio.sleep(METRICS_REFRESH_INTERVAL)
+
+    return asyncio.create_task(loop())
+
+
+def mark_worker_dead() -> None:
+    """Drop this worker's live gauges from the aggregate (multiprocess mode only)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
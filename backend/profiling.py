@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Any, Optional
+from urllib.parse import parse_qs
+
+from psycopg import sql
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from db import connection
+from metrics import RequestTimings, current_timings
+
+logger = logging.getLogger(__name__)
+slow_log = logging.getLogger('slow_requests')
+
+# Requests to these routes slower than SLOW_REQUEST_THRESHOLD_MS are written to the
+# 'slow_requests' logger as one JSON object: route, parameter sizes, stage timings
+# and, for a sample of them, the EXPLAIN (ANALYZE, BUFFERS) plan of their query.
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', '500'))
+SLOW_REQUEST_ROUTES = frozenset(
+    route.strip() for route in os.getenv('SLOW_REQUEST_ROUTES', '/recommend-average/,/search-advanced/').split(',')
+    if route.strip()
+)
+# EXPLAIN ANALYZE runs the query again, so plans are captured for a fraction of
+# slow requests and at most once per interval per worker.
+SLOW_REQUEST_EXPLAIN_SAMPLE_RATE = float(os.getenv('SLOW_REQUEST_EXPLAIN_SAMPLE_RATE', '0.1'))
+SLOW_REQUEST_EXPLAIN_INTERVAL = float(os.getenv('SLOW_REQUEST_EXPLAIN_INTERVAL', '60'))
+# `kill -USR1 <worker pid>` starts the sampling profiler in that worker, the next
+# USR1 stops it and writes collapsed stacks (flamegraph.pl / speedscope input).
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))
+PROFILER_OUTPUT_DIR = os.getenv('PROFILER_OUTPUT_DIR', tempfile.gettempdir())
+
+EXPLAIN_SQL = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}"
+
+
+def _parameter_sizes(query_string: bytes) -> dict[str, int]:
+    """Sizes rather than values: seed count, limit and query length, no user text."""
+    params = parse_qs(query_string.decode('latin-1'))
+    sizes: dict[str, int] = {}
+    if 'song_ids' in params:
+        sizes['seed_count'] = len(params['song_ids'])
+    for name in ('query', 'q'):
+        if name in params:
+            sizes['query_length'] = len(params[name][0])
+    if 'limit' in params and params['limit'][0].isdigit():
+        sizes['limit'] = int(params['limit'][0])
+    if 'exclude_artists' in params:
+        sizes['excluded_artists'] = len(params['exclude_artists'])
+    return sizes
+
+
+class SlowRequestLog:
+    def __init__(self) -> None:
+        self.logged = 0
+        self.explained = 0
+        self._last_explain = 0.0
+        self._tasks: set[asyncio.Task] = set()
+
+    def _should_explain(self) -> bool:
+        now = time.monotonic()
+        if now - self._last_explain < SLOW_REQUEST_EXPLAIN_INTERVAL:
+            return False
+        if random.random() >= SLOW_REQUEST_EXPLAIN_SAMPLE_RATE:
+            return False
+        self._last_explain = now
+        return True
+
+    def record(self, scope: Scope, timings: RequestTimings, status: int, elapsed_ms: float) -> None:
+        entry: dict[str, Any] = {
+            'route': timings.route,
+            'method': scope['method'],
+            'status': status,
+            'duration_ms': round(elapsed_ms, 2),
+            'params': _parameter_sizes(scope.get('query_string', b'')),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.stages.items()},
+            'pid': os.getpid(),
+        }
+        self.logged += 1
+        if timings.last_query is not None and self._should_explain():
+            # After the response has gone out, so the slow caller does not wait twice.
+            task = asyncio.create_task(self._explain_and_log(entry, timings.last_query))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            slow_log.warning(json.dumps(entry))
+
+    async def _explain_and_log(self, entry: dict[str, Any], last_query: tuple[Any, Any, Any]) -> None:
+        setup, query, params = last_query
+        if isinstance(query, str):
+            query = sql.SQL(query)
+        try:
+            async with connection() as conn:
+                async with conn.cursor() as cur:
+                    for statement, args in setup:
+                        await cur.execute(statement, args)
+                    await cur.execute(sql.SQL(EXPLAIN_SQL).format(query), params)
+                    row = await cur.fetchone()
+                    entry['plan'] = row[0] if row is not None else None
+                await conn.rollback()
+            self.explained += 1
+        except Exception as exc:
+            entry['plan_error'] = f'{type(exc).__name__}: {exc}'
+        slow_log.warning(json.dumps(entry, default=str))
+
+    def stats(self) -> dict[str, Any]:
+        return {'logged': self.logged, 'explained': self.explained}
+
+
+slow_requests = SlowRequestLog()
+
+
+class SlowRequestMiddleware:
+    """Times requests to SLOW_REQUEST_ROUTES; runs inside MetricsMiddleware, which provides the timings."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or SLOW_REQUEST_THRESHOLD_MS <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        await self.app(scope, receive, send_wrapper)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        timings = current_timings()
+        if elapsed_ms >= SLOW_REQUEST_THRESHOLD_MS and timings is not None and timings.route in SLOW_REQUEST_ROUTES:
+            slow_requests.record(scope, timings, status, elapsed_ms)
+
+
+class SamplingProfiler:
+    """
+    Wall-clock stack sampler: a thread snapshots every other thread's stack each
+    PROFILER_INTERVAL seconds and counts identical stacks. It only reads frames,
+    so requests are not slowed beyond the GIL time of the snapshot itself.
+    """
+
+    def __init__(self, interval: float, output_dir: str):
+        self.interval = interval
+        self.output_dir = output_dir
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._samples: Counter[str] = Counter()
+        self._started_at = 0.0
+        self._tasks: set[asyncio.Task[Any]] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        # Fresh state per run: the previous run's thread may still be writing its file.
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, args=(self._stop, self._samples), name='sampling-profiler', daemon=True
+        )
+        self._thread.start()
+        logger.warning('Sampling profiler started in worker %s (every %.1f ms)', os.getpid(), self.interval * 1000)
+
+    async def stop(self) -> Optional[str]:
+        """Stop sampling and write the collapsed stacks off the event loop; returns the file path."""
+        run = self._detach()
+        return await self._save(*run) if run is not None else None
+
+    def toggle(self) -> None:
+        """Signal handler: start, or stop at once and save the stacks in a task on the running loop."""
+        run = self._detach()
+        if run is None:
+            self.start()
+            return
+        task = asyncio.get_running_loop().create_task(self._save(*run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _detach(self) -> Optional[tuple[threading.Thread, Counter[str], str]]:
+        if self._thread is None:
+            return None
+        thread, self._thread = self._thread, None
+        self._stop.set()
+        path = os.path.join(self.output_dir, f'profile-{os.getpid()}-{int(self._started_at)}.collapsed')
+        return thread, self._samples, path
+
+    async def _save(self, thread: threading.Thread, samples: Counter[str], path: str) -> str:
+        await asyncio.to_thread(self._write, thread, samples, path)
+        logger.warning('Sampling profiler stopped in worker %s: %s samples written to %s',
+                       os.getpid(), sum(samples.values()), path)
+        return path
+
+    @staticmethod
+    def _write(thread: threading.Thread, samples: Counter[str], path: str) -> None:
+        thread.join()
+        with open(path, 'w') as handle:
+            for stack, count in samples.most_common():
+                handle.write(f'{stack} {count}\n')
+
+    def _run(self, stop: threading.Event, samples: Counter[str]) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, top in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                frame: Optional[FrameType] = top
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                samples[';'.join(reversed(stack))] += 1
+
+
+profiler = SamplingProfiler(PROFILER_INTERVAL, PROFILER_OUTPUT_DIR)
+
+
+def install_profiler_signal() -> None:
+    """SIGUSR1 toggles the profiler of the worker that receives it (call from the event loop)."""
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.toggle)
+    except (NotImplementedError, RuntimeError, AttributeError):
+        logger.info('Signals are not available here; the sampling profiler cannot be toggled')
+
@@ -0,0 +1,222 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Optional, Protocol
+
+from fastapi import HTTPException, Request, status
+
+from auth_dependencies import AccessContext
+
+logger = logging.getLogger(__name__)
+
+# Token buckets per client: anonymous requests are keyed by IP, signed-in ones by
+# user id. Each call costs one token (a batch costs one per item); buckets refill
+# at the per-minute rate up to the burst size.
+ANON_RATE_LIMIT_PER_MINUTE = float(os.getenv('ANON_RATE_LIMIT_PER_MINUTE', '30'))
+ANON_RATE_LIMIT_BURST = float(os.getenv('ANON_RATE_LIMIT_BURST', '10'))
+AUTH_RATE_LIMIT_PER_MINUTE = float(os.getenv('AUTH_RATE_LIMIT_PER_MINUTE', '120'))
+AUTH_RATE_LIMIT_BURST = float(os.getenv('AUTH_RATE_LIMIT_BURST', '30'))
+# 'shared' keeps the buckets in a memory-mapped file all workers on the host use,
+# 'redis' shares them across hosts (requires the redis package), 'none' disables.
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'shared').lower()
+RATE_LIMIT_SHARED_PATH = os.getenv(
+    'RATE_LIMIT_SHARED_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'mynewplaylist-ratelimit'),
+)
+RATE_LIMIT_SHARED_SLOTS = int(os.getenv('RATE_LIMIT_SHARED_SLOTS', '65536'))
+# Header carrying the client address set by the reverse proxy (nginx: X-Real-IP);
+# empty to use the socket peer address.
+RATE_LIMIT_CLIENT_IP_HEADER = os.getenv('RATE_LIMIT_CLIENT_IP_HEADER', 'X-Real-IP')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class BucketStore(Protocol):
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> tuple[bool, float]:
+        """Take `cost` tokens; returns (allowed, seconds until they would be available)."""
+        ...
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+class SharedMemoryStore:
+    """
+    Fixed-size open-addressing table of (key hash, tokens, updated_at) slots in a
+    memory-mapped file, guarded by an exclusive flock. Every worker process maps
+    the same file, so the limits hold per host rather than per worker. When all
+    probed slots are taken, the least recently used bucket is recycled.
+    """
+
+    slot = struct.Struct('<Qdd')
+    probes = 8
+    # Pause between attempts while another worker holds the lock for its few slot reads.
+    lock_retry = 0.001
+
+    def __init__(self, path: str, slots: int):
+        self.slots = slots
+        size = slots * self.slot.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> tuple[bool, float]:
+        # Zero marks an empty slot, so real hashes always have the low bit set.
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        await self._lock()
+        try:
+            now = time.time()
+            target: Optional[int] = None
+            tokens = burst
+            oldest_offset, oldest_at = 0, math.inf
+            for probe in range(self.probes):
+                offset = ((digest + probe) % self.slots) * self.slot.size
+                slot_hash, slot_tokens, updated_at = self.slot.unpack_from(self._map, offset)
+                if slot_hash == digest:
+                    target, tokens = offset, _refill(slot_tokens, updated_at, now, rate, burst)
+                    break
+                if slot_hash == 0:
+                    updated_at = -math.inf
+                if updated_at < oldest_at:
+                    oldest_offset, oldest_at = offset, updated_at
+            if target is None:
+                target = oldest_offset
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.slot.pack_into(self._map, target, digest, tokens, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    async def _lock(self) -> None:
+        # A blocking flock would stall this worker's event loop while another worker holds it.
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                await asyncio.sleep(self.lock_retry)
+
+
+class RedisStore:
+    """Buckets in any Redis-compatible server, updated atomically by a Lua script."""
+
+    prefix = 'mynewplaylist:ratelimit:'
+    script = """
+        local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local now, cost = tonumber(ARGV[3]), tonumber(ARGV[4])
+        local tokens = tonumber(data[1]) or burst
+        local ts = tonumber(data[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local allowed = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+            allowed = 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as exc:
+            raise RuntimeError('RATE_LIMIT_BACKEND=redis requires the redis package') from exc
+        self._client = redis_asyncio.from_url(url)
+        self._take = self._client.register_script(self.script)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> tuple[bool, float]:
+        allowed, tokens = await self._take(keys=[self.prefix + key], args=[rate, burst, time.time(), cost])
+        if allowed:
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+
+class RateLimiter:
+    """Per-plan token buckets; store failures let requests through rather than fail them."""
+
+    def __init__(self, store: Optional[BucketStore]):
+        self.store = store
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    @staticmethod
+    def client_key(request: Request, context: AccessContext) -> str:
+        if context.user is not None:
+            return f'user:{context.user.id}'
+        address = request.headers.get(RATE_LIMIT_CLIENT_IP_HEADER) if RATE_LIMIT_CLIENT_IP_HEADER else None
+        if not address and request.client is not None:
+            address = request.client.host
+        return f'ip:{address or "unknown"}'
+
+    async def enforce(self, request: Request, context: AccessContext, cost: int = 1) -> None:
+        """Raise 429 with Retry-After when the client's bucket cannot cover `cost` calls."""
+        if self.store is None:
+            return
+        if context.is_authenticated:
+            per_minute, burst = AUTH_RATE_LIMIT_PER_MINUTE, AUTH_RATE_LIMIT_BURST
+        else:
+            per_minute, burst = ANON_RATE_LIMIT_PER_MINUTE, ANON_RATE_LIMIT_BURST
+        if per_minute <= 0:
+            return
+        # A batch larger than the burst can never be covered; charge it a full bucket.
+        charge = min(float(cost), burst)
+
+        try:
+            allowed, retry_after = await self.store.take(
+                self.client_key(request, context), per_minute / 60.0, burst, charge
+            )
+        except Exception:
+            self.errors += 1
+            logger.warning('Rate limit store failed; allowing the request', exc_info=True)
+            return
+
+        if allowed:
+            self.allowed += 1
+            return
+
+        self.limited += 1
+        detail: dict[str, object] = {
+            'message': 'Too many recommendation requests, please slow down.',
+            'retry_after': math.ceil(retry_after),
+            'is_authenticated': context.is_authenticated,
+        }
+        if not context.is_authenticated:
+            detail['hint'] = 'Sign in with Google for a higher request rate.'
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+        )
+
+    def stats(self) -> dict[str, object]:
+        return {
+            'backend': RATE_LIMIT_BACKEND,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'errors': self.errors,
+        }
+
+
+def _create_store() -> Optional[BucketStore]:
+    if RATE_LIMIT_BACKEND == 'none':
+        return None
+    if RATE_LIMIT_BACKEND == 'redis':
+        return RedisStore(REDIS_URL)
+    return SharedMemoryStore(RATE_LIMIT_SHARED_PATH, RATE_LIMIT_SHARED_SLOTS)
+
+
+rate_limiter = RateLimiter(_create_store())
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Protocol, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 'memory' keeps a per-worker LRU, 'redis' shares entries across workers through
+# any Redis-compatible server (Redis, Valkey, KeyDB, ...), 'none' disables caching.
+RECOMMENDATION_CACHE_BACKEND = os.getenv('RECOMMENDATION_CACHE_BACKEND', 'memory').lower()
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', '5000'))
+RECOMMENDATION_CACHE_TTL = float(os.getenv('RECOMMENDATION_CACHE_TTL', '3600'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+Entry = dict[str, Any]
+
+
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> Optional[Entry]:
+        ...
+
+    async def set(self, key: str, entry: Entry) -> None:
+        ...
+
+    async def clear(self) -> None:
+        ...
+
+
+class MemoryBackend:
+    """Bounded in-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Entry]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[Entry]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: Entry) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Shared cache across workers. Memory is bounded by the server's maxmemory
+    with an LRU eviction policy (e.g. allkeys-lru); entries expire after the TTL.
+    """
+
+    prefix = 'mynewplaylist:recs:'
+
+    def __init__(self, url: str, ttl: float):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as exc:
+            raise RuntimeError('RECOMMENDATION_CACHE_BACKEND=redis requires the redis package') from exc
+        self.ttl = ttl
+        self._client = redis_asyncio.from_url(url)
+
+    async def get(self, key: str) -> Optional[Entry]:
+        raw = await self._client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, entry: Entry) -> None:
+        await self._client.set(self.prefix + key, json.dumps(entry), ex=max(1, int(self.ttl)))
+
+    async def clear(self) -> None:
+        async for key in self._client.scan_iter(match=self.prefix + '*', count=1000):
+            await self._client.delete(key)
+
+
+class RecommendationCache:
+    """
+    Recommendation results keyed by the canonical (sorted, de-duplicated) seed set.
+    Each entry keeps the top `depth` results so smaller limits are served by slicing.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend]):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def key(song_ids: Sequence[str], namespace: str = '') -> str:
+        canonical = '\x1f'.join(sorted(set(song_ids)))
+        digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+        return f'{namespace}:{digest}' if namespace else digest
+
+    async def get(self, song_ids: Sequence[str], limit: int, namespace: str = '') -> Optional[list[dict[str, Any]]]:
+        if self.backend is None:
+            return None
+        try:
+            entry = await self.backend.get(self.key(song_ids, namespace))
+        except Exception:
+            self.errors += 1
+            logger.warning('Recommendation cache lookup failed', exc_info=True)
+            entry = None
+
+        # A short entry computed at a smaller depth cannot answer a larger limit,
+        # unless it was short because the catalog ran out of songs.
+        if entry is None or (limit > entry['depth'] and len(entry['results']) >= entry['depth']):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry['results'][:limit]
+
+    async def set(
+        self,
+        song_ids: Sequence[str],
+        results: list[dict[str, Any]],
+        depth: int,
+        namespace: str = ''
+    ) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(self.key(song_ids, namespace), {'depth': depth, 'results': results})
+        except Exception:
+            self.errors += 1
+            logger.warning('Recommendation cache store failed', exc_info=True)
+
+    async def invalidate(self) -> None:
+        if self.backend is None:
+            return
+        await self.backend.clear()
+        logger.info('Recommendation cache invalidated')
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'backend': RECOMMENDATION_CACHE_BACKEND,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.backend) if isinstance(self.backend, MemoryBackend) else None,
+        }
+
+
+def _create_backend() -> Optional[CacheBackend]:
+    if RECOMMENDATION_CACHE_BACKEND == 'none':
+        return None
+    if RECOMMENDATION_CACHE_BACKEND == 'redis':
+        return RedisBackend(REDIS_URL, RECOMMENDATION_CACHE_TTL)
+    return MemoryBackend(RECOMMENDATION_CACHE_MAX_ENTRIES, RECOMMENDATION_CACHE_TTL)
+
+
+cache = RecommendationCache(_create_backend())
@@ -0,0 +1,288 @@
+"""
+SQL for the pgvector recommendation path. Kept free of app dependencies so the
+database scripts (recall and plan checks) run exactly the queries the API runs.
+"""
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from psycopg import sql
+
+from embedding_versions import EmbeddingVersion
+
+# Compact distance used to pick candidates before the exact re-rank. Each must
+# match an expression index on the version table (database/utils/quantized_indexes.sql).
+QUANTIZED_DISTANCES = {
+    'halfvec': '{vector}::halfvec({dims}) <-> {centroid}::halfvec({dims})',
+    'binary': 'binary_quantize({vector})::bit({dims}) <~> binary_quantize({centroid})',
+}
+
+# hnsw.ef_search bounds how many rows an HNSW scan can return (pgvector default 40).
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+SET_EF_SEARCH_SQL = "SELECT set_config('hnsw.ef_search', %s, true)"
+# pgvector >= 0.8: keep scanning the graph until LIMIT rows pass the WHERE clause
+# (at most max_scan_tuples), instead of filtering a fixed ef_search candidate set.
+SET_ITERATIVE_SCAN_SQL = """
+    SELECT set_config('hnsw.iterative_scan', %s, true),
+           set_config('hnsw.max_scan_tuples', %s, true)
+"""
+
+# {songs} is the table of the active embedding version (see embedding_versions.py).
+RECOMMEND_SQL = """
+    SELECT track_id,
+           track_name,
+           artist_name,
+           track_external_urls,
+           embedding <-> {centroid} AS distance
+    FROM {songs}
+    WHERE track_id != ALL(%(seeds)s::text[])
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+# Over-fetch candidates from the compact index, then order them by the exact distance.
+RECOMMEND_RERANK_SQL = """
+    WITH candidates AS (
+        SELECT track_id, track_name, artist_name, track_external_urls, embedding
+        FROM {songs}
+        WHERE track_id != ALL(%(seeds)s::text[])
+        ORDER BY {candidate_distance}
+        LIMIT %(fetch)s
+    )
+    SELECT track_id,
+           track_name,
+           artist_name,
+           track_external_urls,
+           embedding <-> {centroid} AS distance
+    FROM candidates
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+SEED_CENTROID_SQL = """(
+               SELECT AVG(embedding)
+               FROM {songs}
+               WHERE track_id = ANY(%(seeds)s::text[])
+           )"""
+
+# One round trip for many seed sets: seeds arrive as parallel (ordinal, track_id)
+# arrays, each centroid drives its own index-ordered LATERAL scan.
+RECOMMEND_BATCH_SQL = """
+    WITH seeds AS (
+        SELECT s.ord, s.track_id
+        FROM unnest(%(ords)s::int[], %(track_ids)s::text[]) AS s(ord, track_id)
+    ),
+    centroids AS (
+        SELECT seeds.ord, AVG(songs.embedding) AS centroid
+        FROM seeds
+        JOIN {songs} songs ON songs.track_id = seeds.track_id
+        GROUP BY seeds.ord
+    )
+    SELECT c.ord,
+           r.track_id,
+           r.track_name,
+           r.artist_name,
+           r.track_external_urls,
+           r.distance
+    FROM centroids c
+    CROSS JOIN LATERAL (
+        {lateral}
+    ) r
+    ORDER BY c.ord, r.distance
+"""
+
+BATCH_EXACT_LATERAL = """SELECT track_id,
+               track_name,
+               artist_name,
+               track_external_urls,
+               embedding <-> c.centroid AS distance
+        FROM {songs}
+        WHERE track_id != ALL(ARRAY(SELECT track_id FROM seeds WHERE seeds.ord = c.ord))
+        ORDER BY distance
+        LIMIT %(limit)s"""
+
+BATCH_RERANK_LATERAL = """SELECT track_id,
+               track_name,
+               artist_name,
+               track_external_urls,
+               embedding <-> c.centroid AS distance
+        FROM (
+            SELECT track_id, track_name, artist_name, track_external_urls, embedding
+            FROM {songs}
+            WHERE track_id != ALL(ARRAY(SELECT track_id FROM seeds WHERE seeds.ord = c.ord))
+            ORDER BY {candidate_distance}
+            LIMIT %(fetch)s
+        ) candidates
+        ORDER BY distance
+        LIMIT %(limit)s"""
+
+
+# Candidates are the seeds' precomputed neighbour lists (database/setup/build_neighbors.py),
+# re-ranked by distance to the centroid. `covered` (seeds with a list) and `found`
+# (seeds in the catalog) let the caller fall back when a list is missing.
+NEIGHBOR_RECOMMEND_SQL = """
+    WITH lists AS (
+        SELECT neighbor_ids
+        FROM b25.song_neighbors
+        WHERE version = %(version)s AND track_id = ANY(%(seeds)s::text[])
+    ),
+    candidates AS (
+        SELECT DISTINCT unnest(neighbor_ids) AS track_id
+        FROM lists
+    )
+    SELECT s.track_id,
+           s.track_name,
+           s.artist_name,
+           s.track_external_urls,
+           s.embedding <-> {centroid} AS distance,
+           (SELECT COUNT(*) FROM lists) AS covered,
+           (SELECT COUNT(*) FROM {songs} WHERE track_id = ANY(%(seeds)s::text[])) AS found
+    FROM candidates c
+    JOIN {songs} s ON s.track_id = c.track_id
+    WHERE s.track_id != ALL(%(seeds)s::text[])
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+
+# Filtered form: candidates pass the filters inside the index scan, one_per_artist
+# keeps the nearest song per artist afterwards. `scanned` is the candidate count,
+# so the caller can tell an exhausted scan from one that needs a larger fetch.
+FILTERED_RECOMMEND_SQL = """
+    WITH candidates AS MATERIALIZED (
+        SELECT track_id,
+               track_name,
+               artist_name,
+               track_external_urls,
+               embedding <-> {centroid} AS distance
+        FROM {songs}
+        WHERE track_id != ALL(%(seeds)s::text[]){conditions}
+        ORDER BY {candidate_order}
+        LIMIT %(fetch)s
+    )
+    SELECT track_id,
+           track_name,
+           artist_name,
+           track_external_urls,
+           distance,
+           (SELECT COUNT(*) FROM candidates) AS scanned
+    FROM {ranked}
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+# Songs without an artist count as their own artist.
+ONE_PER_ARTIST_SQL = """(
+        SELECT DISTINCT ON (COALESCE(artist_name, track_id)) *
+        FROM candidates
+        ORDER BY COALESCE(artist_name, track_id), distance
+    ) per_artist"""
+
+
+@dataclass(frozen=True)
+class RecommendationFilters:
+    """Constraints on recommended songs; the default instance filters nothing."""
+
+    min_relevance: Optional[int] = None
+    exclude_artists: frozenset[str] = frozenset()
+    one_per_artist: bool = False
+
+    def __bool__(self) -> bool:
+        return self.min_relevance is not None or bool(self.exclude_artists) or self.one_per_artist
+
+    def cache_namespace(self) -> str:
+        """Suffix separating cached results per filter combination ('' when unfiltered)."""
+        if not self:
+            return ''
+        canonical = '\x1f'.join([
+            str(self.min_relevance),
+            str(int(self.one_per_artist)),
+            *sorted(self.exclude_artists),
+        ])
+        return ':f' + hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+    def params(self) -> dict[str, Any]:
+        return {'min_relevance': self.min_relevance, 'exclude_artists': sorted(self.exclude_artists)}
+
+
+NO_FILTERS = RecommendationFilters()
+
+
+def _candidate_distance(quantization: str, centroid: sql.Composable, dims: int) -> sql.Composed:
+    return sql.SQL(QUANTIZED_DISTANCES[quantization]).format(
+        vector=sql.Identifier('embedding'), centroid=centroid, dims=sql.Literal(dims)
+    )
+
+
+def recommend_query(version: EmbeddingVersion, quantization: str = 'none') -> sql.Composed:
+    """Nearest songs to the seeds' centroid; params: seeds, limit (and fetch when quantized)."""
+    centroid = sql.SQL(SEED_CENTROID_SQL).format(songs=version.table)
+    if quantization not in QUANTIZED_DISTANCES:
+        return sql.SQL(RECOMMEND_SQL).format(songs=version.table, centroid=centroid)
+
+    return sql.SQL(RECOMMEND_RERANK_SQL).format(
+        songs=version.table,
+        centroid=centroid,
+        candidate_distance=_candidate_distance(quantization, centroid, version.dims),
+    )
+
+
+def recommend_batch_query(version: EmbeddingVersion, quantization: str = 'none') -> sql.Composed:
+    """Batch form; params: ords, track_ids, limit (and fetch when quantized)."""
+    if quantization not in QUANTIZED_DISTANCES:
+        lateral = sql.SQL(BATCH_EXACT_LATERAL).format(songs=version.table)
+    else:
+        lateral = sql.SQL(BATCH_RERANK_LATERAL).format(
+            songs=version.table,
+            candidate_distance=_candidate_distance(quantization, sql.SQL('c.centroid'), version.dims),
+        )
+    return sql.SQL(RECOMMEND_BATCH_SQL).format(songs=version.table, lateral=lateral)
+
+
+def neighbor_query(version: EmbeddingVersion) -> sql.Composed:
+    """Re-rank of the seeds' precomputed neighbours; params: version, seeds, limit."""
+    return sql.SQL(NEIGHBOR_RECOMMEND_SQL).format(
+        songs=version.table,
+        centroid=sql.SQL(SEED_CENTROID_SQL).format(songs=version.table),
+    )
+
+
+def _filter_conditions(filters: RecommendationFilters, partial_index_min: Optional[int]) -> sql.Composed:
+    conditions: list[sql.Composable] = []
+    if filters.min_relevance is not None:
+        if partial_index_min is not None and filters.min_relevance >= partial_index_min:
+            # Repeats the partial index predicate as a literal so the planner can
+            # prove the index applies even for a generic plan.
+            conditions.append(sql.SQL('relevance >= {}').format(sql.Literal(partial_index_min)))
+        conditions.append(sql.SQL('relevance >= %(min_relevance)s'))
+    if filters.exclude_artists:
+        conditions.append(sql.SQL("COALESCE(artist_name, '') != ALL(%(exclude_artists)s::text[])"))
+    return sql.Composed([sql.SQL('\n          AND ') + condition for condition in conditions])
+
+
+def filtered_recommend_query(
+    version: EmbeddingVersion,
+    quantization: str,
+    filters: RecommendationFilters,
+    partial_index_min: Optional[int] = None,
+) -> sql.Composed:
+    """Filtered recommendations; params: seeds, limit, fetch and filters.params()."""
+    centroid = sql.SQL(SEED_CENTROID_SQL).format(songs=version.table)
+    candidate_order: sql.Composable
+    if quantization in QUANTIZED_DISTANCES:
+        candidate_order = _candidate_distance(quantization, centroid, version.dims)
+    else:
+        candidate_order = sql.SQL('distance')
+    return sql.SQL(FILTERED_RECOMMEND_SQL).format(
+        songs=version.table,
+        centroid=centroid,
+        conditions=_filter_conditions(filters, partial_index_min),
+        candidate_order=candidate_order,
+        ranked=sql.SQL(ONE_PER_ARTIST_SQL if filters.one_per_artist else 'candidates'),
+    )
+
+
+def ef_search_for(fetch: int, minimum: int = HNSW_DEFAULT_EF_SEARCH) -> int:
+    """ef_search large enough for an HNSW scan to return `fetch` rows, and at least `minimum`."""
+    return min(max(fetch, minimum), HNSW_MAX_EF_SEARCH)
@@ -0,0 +1,355 @@
+import logging
+import os
+from typing import Any, Optional, Sequence
+
+import psycopg
+from psycopg import sql
+from starlette.concurrency import run_in_threadpool
+
+from auth_dependencies import AUTH_RECOMMENDATION_LIMIT
+from db import connection
+from embedding_versions import EmbeddingVersion, get_active_version
+from embeddings import EmbeddingIndex, get_index, start_index_load
+from metrics import record_query, stage
+from recommendation_cache import cache
+from recommendation_sql import (
+    HNSW_DEFAULT_EF_SEARCH,
+    HNSW_MAX_EF_SEARCH,
+    NO_FILTERS,
+    QUANTIZED_DISTANCES,
+    SET_EF_SEARCH_SQL,
+    SET_ITERATIVE_SCAN_SQL,
+    RecommendationFilters,
+    ef_search_for,
+    filtered_recommend_query,
+    neighbor_query,
+    recommend_batch_query,
+    recommend_query,
+)
+from singleflight import recommendation_flights
+
+logger = logging.getLogger(__name__)
+
+# 'none' orders by the full-precision HNSW index; 'halfvec' / 'binary' pick
+# RECOMMENDATION_OVERFETCH x limit candidates from a compact expression index and
+# re-rank them on the full vectors (see database/utils/quantized_indexes.sql).
+RECOMMENDATION_QUANTIZATION = os.getenv('RECOMMENDATION_QUANTIZATION', 'none').lower()
+RECOMMENDATION_OVERFETCH = int(os.getenv(
+    'RECOMMENDATION_OVERFETCH', '10' if RECOMMENDATION_QUANTIZATION == 'binary' else '3'
+))
+# Seed sets with at most this many distinct songs are answered from the lists in
+# b25.song_neighbors (database/setup/build_neighbors.py); 0 disables the lookup.
+RECOMMENDATION_NEIGHBOR_MAX_SEEDS = int(os.getenv('RECOMMENDATION_NEIGHBOR_MAX_SEEDS', '2'))
+# Filtered requests: pgvector iterative index scans ('relaxed_order' / 'strict_order',
+# pgvector >= 0.8; 'off' for older versions) bounded by max_scan_tuples, plus an
+# initial over-fetch that doubles until the limit is filled or the fetch cap is hit.
+RECOMMENDATION_ITERATIVE_SCAN = os.getenv('RECOMMENDATION_ITERATIVE_SCAN', 'relaxed_order').lower()
+RECOMMENDATION_MAX_SCAN_TUPLES = int(os.getenv('RECOMMENDATION_MAX_SCAN_TUPLES', '20000'))
+RECOMMENDATION_FILTER_OVERFETCH = int(os.getenv('RECOMMENDATION_FILTER_OVERFETCH', '4'))
+RECOMMENDATION_FILTER_MAX_FETCH = int(os.getenv('RECOMMENDATION_FILTER_MAX_FETCH', str(HNSW_MAX_EF_SEARCH)))
+# min_relevance at or above this value can use the partial HNSW index of
+# database/utils/filtered_indexes.sql; unset when that index does not exist.
+_partial_index_min = os.getenv('RECOMMENDATION_RELEVANT_INDEX_MIN')
+RECOMMENDATION_RELEVANT_INDEX_MIN = int(_partial_index_min) if _partial_index_min else None
+
+# hnsw.ef_search per request class, picked from the curves of
+# database/test/hnsw_tuning.py; unset keeps pgvector's default (40). Higher values
+# buy recall with latency. A class with its own value gets its own cache entries.
+RECOMMENDATION_EF_SEARCH = {
+    request_class: int(value) if value else None
+    for request_class, value in (
+        ('anonymous', os.getenv('RECOMMENDATION_EF_SEARCH_ANON')),
+        ('authenticated', os.getenv('RECOMMENDATION_EF_SEARCH_AUTH')),
+        ('batch', os.getenv('RECOMMENDATION_EF_SEARCH_BATCH')),
+    )
+}
+
+_neighbors_available = True
+_iterative_scan = RECOMMENDATION_ITERATIVE_SCAN if RECOMMENDATION_ITERATIVE_SCAN != 'off' else None
+
+
+def _fetch_size(limit: int) -> int:
+    if RECOMMENDATION_QUANTIZATION not in QUANTIZED_DISTANCES:
+        return limit
+    return limit * RECOMMENDATION_OVERFETCH
+
+
+async def _fetch_recommendations(
+    query: sql.Composed,
+    params: dict[str, Any],
+    fetch: int,
+    iterative_scan: Optional[str] = None,
+    ef_search: Optional[int] = None
+) -> list[tuple[Any, ...]]:
+    # Transaction-local settings (SET LOCAL), so the pooled connection goes back unchanged.
+    setup: list[tuple[str, tuple[str, ...]]] = []
+    if ef_search is not None or fetch > HNSW_DEFAULT_EF_SEARCH:
+        setup.append((SET_EF_SEARCH_SQL, (str(ef_search_for(fetch, ef_search or HNSW_DEFAULT_EF_SEARCH)),)))
+    if iterative_scan is not None:
+        setup.append((SET_ITERATIVE_SCAN_SQL, (iterative_scan, str(RECOMMENDATION_MAX_SCAN_TUPLES))))
+    record_query(query, params, tuple(setup))
+
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            for statement, args in setup:
+                await cur.execute(statement, args)
+            with stage('sql'):
+                await cur.execute(query, params)
+                return await cur.fetchall()
+
+
+def _to_dicts(rows: Sequence[tuple[Any, ...]]) -> list[dict[str, Any]]:
+    with stage('rows_to_dicts'):
+        return [
+            {
+                'track_id': r[0],
+                'track_name': r[1],
+                'artist_name': r[2],
+                'track_external_urls': r[3],
+                'distance': r[4]
+            }
+            for r in rows
+        ]
+
+
+async def recommend_sql_filtered(
+    version: EmbeddingVersion,
+    song_ids: Sequence[str],
+    limit: int,
+    filters: RecommendationFilters,
+    ef_search: Optional[int] = None
+) -> list[dict[str, Any]]:
+    """
+    pgvector path with filters. The candidate fetch grows until `limit` rows pass
+    the filters, the scan is exhausted, or RECOMMENDATION_FILTER_MAX_FETCH is reached.
+    """
+    global _iterative_scan
+    query = filtered_recommend_query(
+        version, RECOMMENDATION_QUANTIZATION, filters, RECOMMENDATION_RELEVANT_INDEX_MIN
+    )
+    params = {'seeds': list(song_ids), 'limit': limit, **filters.params()}
+    fetch = min(_fetch_size(limit) * RECOMMENDATION_FILTER_OVERFETCH, max(RECOMMENDATION_FILTER_MAX_FETCH, limit))
+    while True:
+        try:
+            rows = await _fetch_recommendations(query, {**params, 'fetch': fetch}, fetch, _iterative_scan, ef_search)
+        except (psycopg.errors.InvalidName, psycopg.errors.InvalidParameterValue, psycopg.errors.UndefinedObject):
+            if _iterative_scan is None:
+                raise
+            logger.warning('pgvector does not support hnsw.iterative_scan; filtering with over-fetch only')
+            _iterative_scan = None
+            continue
+
+        scanned = rows[0][5] if rows else 0
+        # Without iterative scans a short candidate list may just be the ef_search cap.
+        exhausted = _iterative_scan is not None and scanned < fetch
+        if len(rows) >= limit or exhausted or fetch >= RECOMMENDATION_FILTER_MAX_FETCH:
+            return _to_dicts(rows)
+        fetch = min(fetch * 2, RECOMMENDATION_FILTER_MAX_FETCH)
+
+
+async def recommend_sql(
+    version: EmbeddingVersion,
+    song_ids: Sequence[str],
+    limit: int,
+    ef_search: Optional[int] = None
+) -> list[dict[str, Any]]:
+    """pgvector path: centroid and HNSW scan both run in Postgres."""
+    fetch = _fetch_size(limit)
+    rows = await _fetch_recommendations(
+        recommend_query(version, RECOMMENDATION_QUANTIZATION),
+        {'seeds': list(song_ids), 'limit': limit, 'fetch': fetch},
+        fetch,
+        ef_search=ef_search,
+    )
+    return _to_dicts(rows)
+
+
+async def recommend_neighbors(
+    version: EmbeddingVersion,
+    song_ids: Sequence[str],
+    limit: int
+) -> Optional[list[dict[str, Any]]]:
+    """
+    Precomputed-list path: a primary-key lookup per seed and a re-rank of the
+    merged lists. None when a seed has no list yet or the lists are too short.
+    """
+    global _neighbors_available
+    query = neighbor_query(version)
+    params = {'version': version.version, 'seeds': list(song_ids), 'limit': limit}
+    record_query(query, params)
+    try:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                with stage('sql'):
+                    await cur.execute(query, params)
+                    rows = await cur.fetchall()
+    except psycopg.errors.UndefinedTable:
+        logger.info('b25.song_neighbors does not exist; disabling the neighbour-list path')
+        _neighbors_available = False
+        return None
+
+    if not rows or len(rows) < limit or rows[0][5] < rows[0][6]:
+        return None
+    return _to_dicts(rows)
+
+
+async def recommend_sql_batch(
+    version: EmbeddingVersion,
+    seed_sets: Sequence[Sequence[str]],
+    limit: int,
+    ef_search: Optional[int] = None
+) -> list[list[dict[str, Any]]]:
+    """pgvector path for many seed sets; sets without any known song yield an empty list."""
+    ords: list[int] = []
+    track_ids: list[str] = []
+    for ord_, song_ids in enumerate(seed_sets):
+        for song_id in set(song_ids):
+            ords.append(ord_)
+            track_ids.append(song_id)
+
+    fetch = _fetch_size(limit)
+    rows = await _fetch_recommendations(
+        recommend_batch_query(version, RECOMMENDATION_QUANTIZATION),
+        {'ords': ords, 'track_ids': track_ids, 'limit': limit, 'fetch': fetch},
+        fetch,
+        ef_search=ef_search,
+    )
+
+    results: list[list[dict[str, Any]]] = [[] for _ in seed_sets]
+    with stage('rows_to_dicts'):
+        for r in rows:
+            results[r[0]].append({
+                'track_id': r[1],
+                'track_name': r[2],
+                'artist_name': r[3],
+                'track_external_urls': r[4],
+                'distance': r[5]
+            })
+    return results
+
+
+def _active_index(version: EmbeddingVersion) -> Optional[EmbeddingIndex]:
+    # After an activation the in-process index still holds the previous version:
+    # serve from pgvector until the new one is loaded in the background.
+    index = get_index(version.version)
+    if index is None:
+        start_index_load(version)
+    return index
+
+
+async def _compute(
+    version: EmbeddingVersion,
+    song_ids: Sequence[str],
+    limit: int,
+    filters: RecommendationFilters = NO_FILTERS,
+    ef_search: Optional[int] = None
+) -> list[dict[str, Any]]:
+    index = _active_index(version)
+    if index is not None:
+        result = await run_in_threadpool(index.recommend, song_ids, limit, filters)
+        if result is not None:
+            return result
+        logger.debug('No seed found in the in-process index; falling back to SQL')
+
+    if filters:
+        return await recommend_sql_filtered(version, song_ids, limit, filters, ef_search)
+
+    if _neighbors_available and len(set(song_ids)) <= RECOMMENDATION_NEIGHBOR_MAX_SEEDS:
+        result = await recommend_neighbors(version, song_ids, limit)
+        if result is not None:
+            return result
+
+    return await recommend_sql(version, song_ids, limit, ef_search)
+
+
+async def _compute_many(
+    version: EmbeddingVersion,
+    seed_sets: Sequence[Sequence[str]],
+    limit: int,
+    ef_search: Optional[int] = None
+) -> list[list[dict[str, Any]]]:
+    results: list[Optional[list[dict[str, Any]]]] = [None] * len(seed_sets)
+    index = _active_index(version)
+    if index is not None:
+        results = await run_in_threadpool(index.recommend_many, seed_sets, limit)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        fallback = await recommend_sql_batch(version, [seed_sets[i] for i in missing], limit, ef_search)
+        for i, result in zip(missing, fallback):
+            results[i] = result
+    return [result or [] for result in results]
+
+
+def _ef_search_namespace(ef_search: Optional[int]) -> str:
+    return f':ef{ef_search}' if ef_search is not None else ''
+
+
+async def recommend(
+    song_ids: Sequence[str],
+    limit: int,
+    filters: RecommendationFilters = NO_FILTERS,
+    request_class: str = 'anonymous'
+) -> tuple[list[dict[str, Any]], str]:
+    """
+    Nearest songs to the average embedding of the seeds, with the embedding version used.
+    Served from the cache, then the in-process index when it is loaded, then the
+    precomputed neighbour lists for small unfiltered seed sets, otherwise pgvector
+    at the ef_search of `request_class`. Concurrent calls for the same seed set
+    share one computation.
+    """
+    version = await get_active_version()
+    ef_search = RECOMMENDATION_EF_SEARCH.get(request_class)
+    namespace = version.cache_namespace + filters.cache_namespace() + _ef_search_namespace(ef_search)
+    cached = await cache.get(song_ids, limit, namespace=namespace)
+    if cached is not None:
+        return cached, version.version
+
+    # With the cache on, compute at the largest plan limit so guests and signed-in
+    # users share one entry and one in-flight computation; each caller gets its own
+    # slice. Without it, only callers with the same limit share a computation.
+    depth = max(limit, AUTH_RECOMMENDATION_LIMIT) if cache.enabled else limit
+
+    async def compute() -> list[dict[str, Any]]:
+        result = await _compute(version, song_ids, depth, filters, ef_search)
+        await cache.set(song_ids, result, depth, namespace=namespace)
+        return result
+
+    result = await recommendation_flights.do(f'{depth}:{cache.key(song_ids, namespace)}', compute)
+    return result[:limit], version.version
+
+
+async def recommend_many(
+    seed_sets: Sequence[Sequence[str]],
+    limits: Sequence[int]
+) -> tuple[list[list[dict[str, Any]]], str]:
+    """
+    Batch form of recommend(), results in input order. Cached sets are answered
+    directly and identical seed sets in the batch are computed once. The whole
+    batch is served from one embedding version.
+    """
+    version = await get_active_version()
+    ef_search = RECOMMENDATION_EF_SEARCH.get('batch')
+    namespace = version.cache_namespace + _ef_search_namespace(ef_search)
+    results: list[Optional[list[dict[str, Any]]]] = [None] * len(seed_sets)
+    pending: dict[str, list[int]] = {}
+    for i, (song_ids, limit) in enumerate(zip(seed_sets, limits)):
+        cached = await cache.get(song_ids, limit, namespace=namespace)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(cache.key(song_ids), []).append(i)
+
+    if pending:
+        groups = list(pending.values())
+        depth = max(limits[i] for group in groups for i in group)
+        if cache.enabled:
+            depth = max(depth, AUTH_RECOMMENDATION_LIMIT)
+
+        computed = await _compute_many(version, [seed_sets[group[0]] for group in groups], depth, ef_search)
+        for group, result in zip(groups, computed):
+            await cache.set(seed_sets[group[0]], result, depth, namespace=namespace)
+            for i in group:
+                results[i] = result[:limits[i]]
+
+    return [result or [] for result in results], version.version
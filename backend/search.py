@@ -0,0 +1,229 @@
+import logging
+import os
+import re
+from typing import Any, AsyncIterator, Optional
+
+import psycopg
+
+from db import connection
+from metrics import record_query, stage
+from search_cache import RowTerms, create_search_cache, query_tokens
+from singleflight import search_flights
+from streaming import stream_ndjson
+
+logger = logging.getLogger(__name__)
+
+# Score = text rank (weighted tsvector, track name over artist) + trigram similarity
+# (typos, partial words) + catalog relevance; each term is normalised to [0, 1).
+SEARCH_TEXT_WEIGHT = float(os.getenv('SEARCH_TEXT_WEIGHT', '0.5'))
+SEARCH_TRIGRAM_WEIGHT = float(os.getenv('SEARCH_TRIGRAM_WEIGHT', '0.35'))
+SEARCH_RELEVANCE_WEIGHT = float(os.getenv('SEARCH_RELEVANCE_WEIGHT', '0.15'))
+# Candidates taken from each index branch before scoring.
+SEARCH_BRANCH_CANDIDATES = int(os.getenv('SEARCH_BRANCH_CANDIDATES', '200'))
+# Trigram-only matches below this similarity are dropped.
+SEARCH_MIN_SIMILARITY = float(os.getenv('SEARCH_MIN_SIMILARITY', '0.2'))
+# Tokens shorter than this match whole words only, so one letter does not expand
+# into a prefix scan over most of the catalog.
+SEARCH_PREFIX_MIN_CHARS = int(os.getenv('SEARCH_PREFIX_MIN_CHARS', '3'))
+# Largest limit of a regular JSON response; bulk consumers use the NDJSON stream.
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '100'))
+SEARCH_STREAM_MAX_LIMIT = int(os.getenv('SEARCH_STREAM_MAX_LIMIT', '10000'))
+
+# Each branch is an index-served top-k: the GIN index on search_vector for word
+# matches, and the GiST trigram indexes (KNN on <->) for fuzzy matches on track
+# and artist names. Only the union of those candidates is scored.
+_RANKED_SEARCH_SQL = """
+    WITH query AS (
+        SELECT to_tsquery('simple', %(tsquery)s) AS tsq
+    ),
+    candidates AS (
+        (
+            SELECT s.track_id
+            FROM b25.songs s, query
+            WHERE s.search_vector @@ query.tsq
+            ORDER BY ts_rank_cd(s.search_vector, query.tsq) DESC
+            LIMIT %(candidates)s
+        )
+        UNION
+        (
+            SELECT track_id
+            FROM b25.songs
+            ORDER BY track_name <-> %(query)s
+            LIMIT %(candidates)s
+        )
+        UNION
+        (
+            SELECT track_id
+            FROM b25.songs
+            ORDER BY artist_name <-> %(query)s
+            LIMIT %(candidates)s
+        )
+    ),
+    scored AS (
+        SELECT s.track_id,
+               s.track_name,
+               s.artist_name,
+               s.track_external_urls,
+               ts_rank_cd(s.search_vector, query.tsq, 32) AS text_rank,
+               GREATEST(
+                   similarity(COALESCE(s.track_name, ''), %(query)s),
+                   0.8 * similarity(COALESCE(s.artist_name, ''), %(query)s)
+               ) AS trigram,
+               1 - 1 / (1 + ln(1 + GREATEST(COALESCE(s.relevance, 0), 0))) AS popularity,
+               s.search_vector
+        FROM candidates c
+        JOIN b25.songs s ON s.track_id = c.track_id
+        CROSS JOIN query
+    )
+    SELECT {columns}
+    FROM scored
+    WHERE text_rank > 0 OR trigram >= %(min_similarity)s
+    ORDER BY %(text_weight)s * text_rank
+             + %(trigram_weight)s * trigram
+             + %(relevance_weight)s * popularity DESC,
+             track_name
+    LIMIT %(limit)s
+"""
+_SEARCH_COLUMNS = 'track_id, track_name, artist_name, track_external_urls'
+# Kept per row by the search cache to refine later keystrokes in memory (RowTerms).
+_REFINE_COLUMNS = ('text_rank', 'popularity', 'tsvector_to_array(search_vector) AS lexemes')
+SEARCH_SQL = _RANKED_SEARCH_SQL.format(columns=', '.join((_SEARCH_COLUMNS, *_REFINE_COLUMNS)))
+STREAM_SEARCH_SQL = _RANKED_SEARCH_SQL.format(columns=_SEARCH_COLUMNS)
+
+# Used until database/utils/search_vector.sql has added b25.songs.search_vector.
+LEGACY_SEARCH_SQL = """
+    SELECT
+        track_id,
+        track_name,
+        artist_name,
+        track_external_urls
+    FROM b25.songs
+    WHERE
+        to_tsvector('english', track_name || ' ' || artist_name) @@ plainto_tsquery('english', %(query)s)
+        OR track_name ILIKE %(pattern)s
+    ORDER BY track_name
+    LIMIT %(limit)s
+"""
+
+_search_vector_available = True
+
+_TRIGRAM_WORD = re.compile(r'[^\W_]+')
+
+
+def tsquery_for(query: str) -> str:
+    """
+    to_tsquery('simple') text matching every word of the query, the longer ones as
+    prefixes ('shape of yo' -> 'shape:* & of & yo'). Tokens are \\w+ only, so the
+    result cannot contain tsquery operators from the input.
+    """
+    terms = []
+    for token in query_tokens(query):
+        terms.append(f'{token}:*' if len(token) >= SEARCH_PREFIX_MIN_CHARS else token)
+    return ' & '.join(terms)
+
+
+def _trigrams(text: str) -> set[str]:
+    trigrams: set[str] = set()
+    for word in _TRIGRAM_WORD.findall(text.lower()):
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(word) + 1))
+    return trigrams
+
+
+def trigram_similarity(a: str, b: str) -> float:
+    """pg_trgm's similarity(): shared trigrams of the padded words over all of them."""
+    first, second = _trigrams(a), _trigrams(b)
+    union = len(first | second)
+    return len(first & second) / union if union else 0.0
+
+
+def refined_score(query: str, row: dict[str, Any], terms: RowTerms) -> float:
+    """SEARCH_SQL's ordering score of a cached row for a longer query, with the cached text rank."""
+    text_rank, popularity, _ = terms
+    trigram = max(
+        trigram_similarity(row.get('track_name') or '', query),
+        0.8 * trigram_similarity(row.get('artist_name') or '', query),
+    )
+    return SEARCH_TEXT_WEIGHT * text_rank + SEARCH_TRIGRAM_WEIGHT * trigram + SEARCH_RELEVANCE_WEIGHT * popularity
+
+
+search_cache = create_search_cache(SEARCH_PREFIX_MIN_CHARS, refined_score)
+
+
+async def search_songs(query: str, limit: int) -> list[dict[str, Any]]:
+    """
+    Songs matching `query`, best match first; repeated searches are served from
+    the cache and concurrent identical searches share one query.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    cached = await search_cache.get(query, limit)
+    if cached is not None:
+        return cached
+
+    async def compute() -> list[dict[str, Any]]:
+        rows, terms = await _search_database(query, limit)
+        await search_cache.set(query, limit, rows, terms)
+        return rows
+
+    # Same normalization as the cache key: queries the cache treats as equal coalesce.
+    return await search_flights.do(f'{limit}:{search_cache.key(query)}', compute)
+
+
+async def stream_search(query: str, limit: int) -> AsyncIterator[bytes]:
+    """search_songs() as NDJSON, streamed from a server-side cursor and never cached."""
+    query = query.strip()
+    if not query:
+        return
+    statement = STREAM_SEARCH_SQL if _search_vector_available else LEGACY_SEARCH_SQL
+    async for chunk in stream_ndjson(statement, search_params(query, limit)):
+        yield chunk
+
+
+def search_params(query: str, limit: int) -> dict[str, Any]:
+    """Parameters of SEARCH_SQL (and LEGACY_SEARCH_SQL) for a stripped query."""
+    return {
+        'query': query,
+        'tsquery': tsquery_for(query),
+        'pattern': f'%{query}%',
+        'limit': limit,
+        'candidates': max(SEARCH_BRANCH_CANDIDATES, limit),
+        'min_similarity': SEARCH_MIN_SIMILARITY,
+        'text_weight': SEARCH_TEXT_WEIGHT,
+        'trigram_weight': SEARCH_TRIGRAM_WEIGHT,
+        'relevance_weight': SEARCH_RELEVANCE_WEIGHT,
+    }
+
+
+async def _search_database(query: str, limit: int) -> tuple[list[dict[str, Any]], Optional[list[RowTerms]]]:
+    """Rows of the search, plus their RowTerms when they came from SEARCH_SQL."""
+    global _search_vector_available
+    params = search_params(query, limit)
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            with stage('sql'):
+                if _search_vector_available:
+                    try:
+                        await cur.execute(SEARCH_SQL, params)
+                    except psycopg.errors.UndefinedColumn:
+                        logger.warning('b25.songs.search_vector is missing; run database/utils/search_vector.sql')
+                        _search_vector_available = False
+                        await conn.rollback()
+                if not _search_vector_available:
+                    await cur.execute(LEGACY_SEARCH_SQL, params)
+                rows = await cur.fetchall()
+            record_query(SEARCH_SQL if _search_vector_available else LEGACY_SEARCH_SQL, params)
+
+            with stage('rows_to_dicts'):
+                columns = [column.name for column in cur.description or ()]
+                if not _search_vector_available:
+                    return [dict(zip(columns, row)) for row in rows], None
+                public = len(columns) - len(_REFINE_COLUMNS)
+                results, terms = [], []
+                for row in rows:
+                    results.append(dict(zip(columns[:public], row)))
+                    text_rank, popularity, lexemes = row[public:]
+                    terms.append((float(text_rank), float(popularity), lexemes))
+                return results, terms
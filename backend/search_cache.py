@@ -0,0 +1,150 @@
+import logging
+import os
+import re
+from typing import Any, Callable, Optional
+
+from recommendation_cache import MemoryBackend
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '20000'))
+# Short, so catalog changes show up in search without an explicit invalidation.
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+
+_TOKEN = re.compile(r'\w+')
+# Tokens the text search parser keeps whole (no '_'), so they match lexemes one to one.
+_ALNUM_TOKEN = re.compile(r'[^\W_]+')
+
+# Per cached row of a ranked search: its text rank for the cached query, its
+# popularity and the lexemes of its search_vector.
+RowTerms = tuple[float, float, list[str]]
+# Score of a row for a refined query, given the row and its RowTerms.
+RefineScore = Callable[[str, dict[str, Any], RowTerms], float]
+
+
+def query_tokens(text: str) -> list[str]:
+    """Lower-cased word tokens, as the search tsquery and the cache see a query."""
+    return _TOKEN.findall(text.lower())
+
+
+def _matches(token: str, lexemes: list[str], prefix_min_chars: int) -> bool:
+    if len(token) >= prefix_min_chars:
+        return any(lexeme.startswith(token) for lexeme in lexemes)
+    return token in lexemes
+
+
+class SearchCache:
+    """
+    Search results keyed by the normalized query (its word tokens). An entry
+    answers any limit up to the one it was computed for, and every limit when it
+    was complete (fewer rows than its limit). Zero-hit queries are cached too.
+
+    Typing produces chains like 'sha' -> 'shap' -> 'shape'. A complete entry of
+    the ranked search holds every text match of its query (its text branch was
+    not cut off), so for a query that only narrows it the text matches are
+    exactly the cached rows whose stored lexemes match every token, as the
+    tsquery would. Those are re-scored with `score` and returned without a
+    database round trip. Fuzzy matches of the longer query that are not text
+    matches are not found this way; when no text match is left the database is
+    asked instead. The text rank is the cached query's, so the order of refined
+    rows can differ slightly from a fresh search.
+    """
+
+    def __init__(self, backend: Optional[MemoryBackend], prefix_min_chars: int, score: RefineScore):
+        self.backend = backend
+        self.prefix_min_chars = prefix_min_chars
+        self.score = score
+        self.hits = 0
+        self.refinements = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str) -> str:
+        return ' '.join(query_tokens(query))
+
+    @staticmethod
+    def _answers(entry: Optional[dict[str, Any]], limit: int) -> bool:
+        return entry is not None and (entry['complete'] or entry['limit'] >= limit)
+
+    def _narrows(self, shorter: list[str], longer: list[str]) -> bool:
+        """Whether every text match of `longer` is also a text match of `shorter`."""
+        if not shorter or len(longer) < len(shorter) or longer[:len(shorter) - 1] != shorter[:-1]:
+            return False
+        last, extended = shorter[-1], longer[len(shorter) - 1]
+        # A short token matches whole words only, so extending it widens the match.
+        return extended == last or (extended.startswith(last) and len(last) >= self.prefix_min_chars)
+
+    def _refine(self, query: str, tokens: list[str], entry: dict[str, Any], limit: int) -> list[dict[str, Any]]:
+        scored = []
+        for row, terms in zip(entry['rows'], entry['terms']):
+            if all(_matches(token, terms[2], self.prefix_min_chars) for token in tokens):
+                scored.append((-self.score(query, row, terms), row.get('track_name') or '', row))
+        scored.sort(key=lambda item: item[:2])
+        return [row for _, _, row in scored[:limit]]
+
+    async def get(self, query: str, limit: int) -> Optional[list[dict[str, Any]]]:
+        if self.backend is None:
+            return None
+        key = self.key(query)
+        entry = await self.backend.get(key)
+        if entry is not None and self._answers(entry, limit):
+            if entry['rows']:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return entry['rows'][:limit]
+
+        tokens = key.split(' ')
+        if all(_ALNUM_TOKEN.fullmatch(token) for token in tokens):
+            # Longest cached prefix of the typed text first.
+            for end in range(len(key) - 1, 0, -1):
+                shorter = key[:end].rstrip()
+                if len(shorter) != end:
+                    continue
+                entry = await self.backend.get(shorter)
+                if (entry is None or not entry['complete'] or entry['terms'] is None
+                        or not self._narrows(shorter.split(' '), tokens)):
+                    continue
+                refined = self._refine(query, tokens, entry, limit)
+                if refined:
+                    self.refinements += 1
+                    return refined
+                break
+
+        self.misses += 1
+        return None
+
+    async def set(
+        self, query: str, limit: int, rows: list[dict[str, Any]], terms: Optional[list[RowTerms]] = None
+    ) -> None:
+        """Store a result; `terms` (one per row, ranked search only) make it refinable."""
+        if self.backend is None:
+            return
+        key = self.key(query)
+        # A concurrent search with a larger limit may have stored a better entry meanwhile.
+        if self._answers(await self.backend.get(key), limit):
+            return
+        await self.backend.set(key, {'limit': limit, 'rows': rows, 'complete': len(rows) < limit, 'terms': terms})
+
+    async def invalidate(self) -> None:
+        if self.backend is not None:
+            await self.backend.clear()
+
+    def stats(self) -> dict[str, Any]:
+        answered = self.hits + self.refinements + self.negative_hits
+        lookups = answered + self.misses
+        return {
+            'hits': self.hits,
+            'refinements': self.refinements,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': answered / lookups if lookups else 0.0,
+            'entries': len(self.backend) if self.backend is not None else None,
+        }
+
+
+def create_search_cache(prefix_min_chars: int, score: RefineScore) -> SearchCache:
+    backend = MemoryBackend(SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL) if SEARCH_CACHE_ENABLED else None
+    return SearchCache(backend, prefix_min_chars, score)
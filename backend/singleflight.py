@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Coroutine, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Concurrent identical requests (a shared playlist link opened by many clients at
+# once) wait for one computation instead of each querying the database.
+REQUEST_COALESCING_ENABLED = os.getenv('REQUEST_COALESCING_ENABLED', 'true').lower() == 'true'
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Per-worker in-flight deduplication: the first caller of a key starts the
+    computation, callers arriving before it finishes await the same result.
+    Nothing is kept afterwards, so results are never stale.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._calls: dict[str, asyncio.Task[Any]] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, compute: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        if not self.enabled:
+            return await compute()
+
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            # A task of its own, so a disconnecting caller does not cancel it for the others.
+            task = asyncio.create_task(compute())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieved here too, in case every caller went away before it finished.
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug('Coalesced computation for %s failed', key, exc_info=task.exception())
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'leaders': self.leaders,
+            'shared': self.shared,
+            'pending': len(self._calls),
+        }
+
+
+recommendation_flights = SingleFlight(REQUEST_COALESCING_ENABLED)
+search_flights = SingleFlight(REQUEST_COALESCING_ENABLED)
@@ -0,0 +1,76 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Mapping
+
+import orjson
+from fastapi.responses import StreamingResponse
+from psycopg.abc import Query
+from starlette.types import Receive, Scope, Send
+
+from db import connection
+
+# Rows fetched per round trip from the server-side cursor; also the size of each
+# chunk written to the client.
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+# Each stream holds a pooled connection until the client has read it all, so only
+# this many run at once per worker; further requests get a 503.
+STREAM_MAX_CONCURRENT = int(os.getenv('STREAM_MAX_CONCURRENT', '2'))
+
+EXPORT_SONGS_SQL = """
+    SELECT track_id, track_name, artist_name, track_external_urls, relevance
+    FROM b25.songs
+    ORDER BY track_id
+"""
+
+stream_slots = asyncio.Semaphore(STREAM_MAX_CONCURRENT)
+
+
+async def try_acquire_stream_slot() -> bool:
+    """Take a stream slot without waiting; False when all are in use."""
+    if stream_slots.locked():
+        return False
+    # acquire() does not suspend while a slot is free, so nothing can take it in between.
+    await stream_slots.acquire()
+    return True
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    Streams an NDJSON body holding a slot taken with try_acquire_stream_slot();
+    the slot is released however the response ends, even if the body never starts.
+    """
+
+    media_type = 'application/x-ndjson'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            stream_slots.release()
+
+
+async def stream_ndjson(
+    query: Query,
+    params: Mapping[str, Any]
+) -> AsyncIterator[bytes]:
+    """
+    Rows of `query` as NDJSON chunks, read through a server-side cursor so memory
+    stays flat however many rows there are. The first line is the array of column
+    names, every further line one row as an array in that order: the row tuples
+    are serialized as they come, without building a dict per row. The first
+    chunk is sent as soon as the first batch arrives.
+    """
+    async with connection() as conn:
+        # A named cursor is a server-side cursor; it lives in the pool connection's transaction.
+        async with conn.cursor(name='ndjson_stream') as cur:
+            await cur.execute(query, params)
+            yield orjson.dumps([column.name for column in cur.description or ()]) + b'\n'
+            while True:
+                rows = await cur.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                yield b''.join(orjson.dumps(row) + b'\n' for row in rows)
+
+
+def export_songs() -> AsyncIterator[bytes]:
+    return stream_ndjson(EXPORT_SONGS_SQL, {})
@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import Any, Optional
+
+import numpy as np
+
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_INDEX_ENABLED = os.getenv('SUGGEST_INDEX_ENABLED', 'true').lower() == 'true'
+# Seconds between checks whether b25.songs changed; a change triggers a rebuild.
+SUGGEST_REFRESH_INTERVAL = float(os.getenv('SUGGEST_REFRESH_INTERVAL', '300'))
+SUGGEST_MAX_LIMIT = int(os.getenv('SUGGEST_MAX_LIMIT', '20'))
+# Prefix ranges up to this many keys are ranked on the fly; larger ones (short
+# prefixes) are ranked once and memoized.
+SUGGEST_SCAN_CAP = int(os.getenv('SUGGEST_SCAN_CAP', '4096'))
+# Word-start keys per track name ('shape of you' -> 'of you', 'you').
+SUGGEST_MAX_WORD_KEYS = int(os.getenv('SUGGEST_MAX_WORD_KEYS', '3'))
+SUGGEST_LOAD_BATCH = int(os.getenv('SUGGEST_LOAD_BATCH', '50000'))
+
+LOAD_CATALOG_SQL = """
+    SELECT track_id, track_name, artist_name, track_external_urls, relevance
+    FROM b25.songs
+"""
+
+# Used while the index is loading or disabled: the whole track or artist name
+# starting with the typed text, served by the trigram indexes of search_vector.sql.
+FALLBACK_SUGGEST_SQL = """
+    SELECT track_id, track_name, artist_name, track_external_urls
+    FROM b25.songs
+    WHERE track_name ILIKE %(pattern)s OR artist_name ILIKE %(pattern)s
+    ORDER BY relevance DESC NULLS LAST, track_id
+    LIMIT %(limit)s
+"""
+
+# Cheap change detector: row counters move on every insert, update and delete.
+CATALOG_SIGNATURE_SQL = """
+    SELECT n_tup_ins, n_tup_upd, n_tup_del, n_live_tup
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'b25' AND relname = 'songs'
+"""
+
+_NON_ALNUM = re.compile(r'[\W_]+')
+_LIKE_SPECIAL = re.compile(r'[\\%_]')
+
+
+def normalize(text: Optional[str]) -> str:
+    """Accent-folded, case-folded text with punctuation collapsed to single spaces."""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text)
+    folded = ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return _NON_ALNUM.sub(' ', folded).strip()
+
+
+class _Keys:
+    """Sorted UTF-8 keys stored in one buffer; indexable so bisect can search it."""
+
+    def __init__(self, blob: bytes, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]]
+
+
+class SuggestIndex:
+    """
+    Sorted normalized keys (track names, their word starts and artist names), each
+    pointing at a song row. A prefix is a contiguous key range found by binary
+    search; the range is ranked by relevance.
+    """
+
+    def __init__(self, rows: list[tuple[Any, ...]]):
+        self.track_ids: list[str] = []
+        self.track_names: list[Optional[str]] = []
+        self.artist_names: list[Optional[str]] = []
+        self.track_external_urls: list[Optional[str]] = []
+        relevance: list[int] = []
+        entries: list[tuple[bytes, int]] = []
+
+        for track_id, track_name, artist_name, url, song_relevance in rows:
+            song = len(self.track_ids)
+            self.track_ids.append(track_id)
+            self.track_names.append(track_name)
+            self.artist_names.append(artist_name)
+            self.track_external_urls.append(url)
+            relevance.append(-1 if song_relevance is None else song_relevance)
+
+            name = normalize(track_name)
+            keys = {name, normalize(artist_name)}
+            words = name.split(' ')
+            for start in range(1, min(len(words), SUGGEST_MAX_WORD_KEYS + 1)):
+                keys.add(' '.join(words[start:]))
+            entries.extend((key.encode('utf-8'), song) for key in keys if key)
+
+        entries.sort()
+        offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(key) for key, _ in entries], out=offsets[1:])
+        self.keys = _Keys(b''.join(key for key, _ in entries), offsets)
+        self.songs = np.fromiter((song for _, song in entries), dtype=np.int32, count=len(entries))
+        self.key_relevance = np.asarray(relevance, dtype=np.int64)[self.songs]
+        self._ranked: dict[bytes, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def _range(self, prefix: bytes) -> tuple[int, int]:
+        # 0xFF never occurs in UTF-8, so prefix + 0xFF sorts after every key with the prefix.
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + b'\xff')
+
+    def _top_songs(self, lo: int, hi: int, k: int) -> np.ndarray:
+        """Song rows of the k most relevant keys in [lo, hi), most relevant first, de-duplicated."""
+        fetch = min(k * SUGGEST_MAX_WORD_KEYS + k, hi - lo)
+        if fetch <= 0:
+            return np.empty(0, dtype=np.int32)
+        scores = -self.key_relevance[lo:hi]
+        top = np.argpartition(scores, fetch - 1)[:fetch] if fetch < hi - lo else np.arange(hi - lo)
+        top = top[np.lexsort((top, scores[top]))]
+        songs = self.songs[lo + top]
+        _, first = np.unique(songs, return_index=True)
+        return songs[np.sort(first)][:k]
+
+    def suggest(self, query: str, limit: int) -> list[dict[str, Any]]:
+        prefix = normalize(query).encode('utf-8')
+        if not prefix:
+            return []
+        limit = min(limit, SUGGEST_MAX_LIMIT)
+        lo, hi = self._range(prefix)
+        if hi - lo > SUGGEST_SCAN_CAP:
+            ranked = self._ranked.get(prefix)
+            if ranked is None:
+                ranked = self._ranked[prefix] = self._top_songs(lo, hi, SUGGEST_MAX_LIMIT)
+            songs = ranked[:limit]
+        else:
+            songs = self._top_songs(lo, hi, limit)
+
+        return [
+            {
+                'track_id': self.track_ids[song],
+                'track_name': self.track_names[song],
+                'artist_name': self.artist_names[song],
+                'track_external_urls': self.track_external_urls[song],
+            }
+            for song in songs.tolist()
+        ]
+
+
+_index: Optional[SuggestIndex] = None
+_signature: Optional[tuple[Any, ...]] = None
+
+
+def get_suggest_index() -> Optional[SuggestIndex]:
+    """The loaded prefix index, or None while loading / when disabled."""
+    return _index
+
+
+def like_prefix(query: str) -> str:
+    """ILIKE pattern matching text that starts with `query` literally."""
+    return _LIKE_SPECIAL.sub(lambda match: '\\' + match.group(0), query) + '%'
+
+
+async def suggest_from_database(query: str, limit: int) -> list[dict[str, Any]]:
+    """
+    Prefix suggestions straight from b25.songs, in the shape of
+    SuggestIndex.suggest(). Case- but not accent-insensitive, and whole names
+    only: word starts inside a track name are not matched.
+    """
+    prefix = query.strip()
+    if not prefix:
+        return []
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                FALLBACK_SUGGEST_SQL, {'pattern': like_prefix(prefix), 'limit': min(limit, SUGGEST_MAX_LIMIT)}
+            )
+            rows = await cur.fetchall()
+            columns = [column.name for column in cur.description or ()]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+async def _catalog_signature() -> Optional[tuple[Any, ...]]:
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(CATALOG_SIGNATURE_SQL)
+            return await cur.fetchone()
+
+
+async def load_suggest_index() -> Optional[SuggestIndex]:
+    """(Re)build the prefix index from b25.songs; failures keep the previous index."""
+    global _index, _signature
+    started = time.perf_counter()
+    try:
+        signature = await _catalog_signature()
+        rows: list[tuple[Any, ...]] = []
+        async with connection() as conn:
+            async with conn.cursor(name='suggest_index_load') as cur:
+                await cur.execute(LOAD_CATALOG_SQL)
+                while True:
+                    batch = await cur.fetchmany(SUGGEST_LOAD_BATCH)
+                    if not batch:
+                        break
+                    rows.extend(batch)
+        index = await asyncio.to_thread(SuggestIndex, rows)
+    except Exception:
+        logger.exception('Failed to build the suggest index')
+        return None
+
+    _index = index
+    _signature = signature
+    logger.info(
+        'Built the suggest index: %s songs, %s keys in %.1fs',
+        len(index), len(index.keys), time.perf_counter() - started
+    )
+    return index
+
+
+async def refresh_suggest_index() -> None:
+    """Rebuild when the catalog changed since the last build; runs until cancelled."""
+    while True:
+        await asyncio.sleep(SUGGEST_REFRESH_INTERVAL)
+        try:
+            signature = await _catalog_signature()
+        except Exception:
+            logger.warning('Could not check b25.songs for changes', exc_info=True)
+            continue
+        if _index is None or signature != _signature:
+            await load_suggest_index()
+
+
+def start_suggest_index() -> Optional[asyncio.Task[None]]:
+    """Build the index in the background and keep it fresh; None when disabled."""
+    if not SUGGEST_INDEX_ENABLED:
+        return None
+
+    async def run() -> None:
+        await load_suggest_index()
+        await refresh_suggest_index()
+
+    return asyncio.create_task(run())
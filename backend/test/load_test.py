@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Load test for the public API
+
+Drives /recommend-average/, /search-advanced/ and the analytics POSTs with a
+weighted mix, either at a fixed concurrency (closed loop: each worker sends its
+next request when the previous one returns) or at a fixed arrival rate (open
+loop: Poisson arrivals, so slow responses show up as queueing instead of as
+fewer requests). Prints one JSON document with throughput, p50/p95/p99 latency,
+error rate and, when --database-url is given, database time from
+pg_stat_statements, so runs can be compared across commits.
+
+    python database/test/generate_catalog.py --rows 1000000 --truncate
+    RATE_LIMIT_BACKEND=none uvicorn main:app --workers 4
+    python backend/test/load_test.py --concurrency 32 --duration 60 --output run.json
+
+The server should run with RATE_LIMIT_BACKEND=none, otherwise most of the run
+measures 429s.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+# Used to find songs through the API when no --database-url is given.
+BOOTSTRAP_QUERIES = ['love', 'night', 'you', 'heart', 'dance', 'baby', 'summer', 'girl', 'fire', 'home']
+
+SAMPLE_SONGS_SQL = """
+    SELECT track_id, track_name
+    FROM b25.songs TABLESAMPLE SYSTEM (%s)
+    WHERE track_name IS NOT NULL
+    LIMIT %s
+"""
+CATALOG_SIZE_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = 'b25.songs'::regclass"
+DB_TIME_SQL = """
+    SELECT COALESCE(sum(calls), 0), COALESCE(sum(total_exec_time), 0)
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+
+
+class Workload:
+    def __init__(self, track_ids, words, args):
+        self.track_ids = track_ids
+        self.words = words
+        self.args = args
+        self.sessions = []
+        self.rng = random.Random(args.seed)
+
+    def recommend_params(self):
+        seeds = self.rng.sample(self.track_ids, min(self.args.seed_songs, len(self.track_ids)))
+        return {'song_ids': ','.join(seeds), 'limit': self.args.limit}
+
+    def search_params(self):
+        # Mostly partial words, the way the search box sends them while typing.
+        word = self.rng.choice(self.words)
+        if len(word) > 3 and self.rng.random() < 0.6:
+            word = word[:self.rng.randint(3, len(word))]
+        return {'query': word, 'limit': self.args.limit}
+
+    def analytics_body(self):
+        session_id = self.rng.choice(self.sessions)
+        return {'events': [
+            {'type': 'pageview', 'session_id': session_id, 'page_path': '/'},
+            {'type': 'search_query', 'session_id': session_id, 'query_text': self.rng.choice(self.words),
+             'results_count': self.args.limit},
+            {'type': 'song_interaction', 'session_id': session_id, 'track_id': self.rng.choice(self.track_ids),
+             'interaction_type': 'add'},
+        ]}
+
+
+class Recorder:
+    def __init__(self, scenarios):
+        self.latencies = {name: [] for name in scenarios}
+        self.statuses = {name: {} for name in scenarios}
+        self.errors = {name: 0 for name in scenarios}
+        self.dropped = 0
+        self.recording = False
+        self.started = None
+        self.db_before = None
+
+    def add(self, scenario, seconds, status):
+        if not self.recording:
+            return
+        self.latencies[scenario].append(seconds)
+        self.statuses[scenario][status] = self.statuses[scenario].get(status, 0) + 1
+        if not (isinstance(status, int) and status < 400):
+            self.errors[scenario] += 1
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, statuses, errors, duration):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    return {
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count else 0.0,
+        'throughput_rps': count / duration if duration else 0.0,
+        'latency_ms': {
+            'p50': ms(percentile(ordered, 0.50)),
+            'p95': ms(percentile(ordered, 0.95)),
+            'p99': ms(percentile(ordered, 0.99)),
+            'mean': ms(sum(ordered) / count) if count else None,
+            'max': ms(ordered[-1]) if count else None,
+        },
+        'status_codes': {str(code): n for code, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+    }
+
+
+async def call(client, workload, recorder, scenario):
+    started = time.perf_counter()
+    try:
+        if scenario == 'recommend':
+            response = await client.get('/recommend-average/', params=workload.recommend_params())
+        elif scenario == 'search':
+            response = await client.get('/search-advanced/', params=workload.search_params())
+        else:
+            response = await client.post('/analytics/events', json=workload.analytics_body())
+        status = response.status_code
+    except httpx.HTTPError as exc:
+        status = type(exc).__name__
+    recorder.add(scenario, time.perf_counter() - started, status)
+
+
+def pick(workload, mix):
+    return workload.rng.choices(list(mix), weights=list(mix.values()))[0]
+
+
+async def closed_loop(client, workload, recorder, mix, concurrency, deadline):
+    async def worker():
+        while time.perf_counter() < deadline:
+            await call(client, workload, recorder, pick(workload, mix))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(client, workload, recorder, mix, rate, max_in_flight, deadline):
+    in_flight = set()
+    next_at = time.perf_counter()
+    while next_at < deadline:
+        next_at += workload.rng.expovariate(rate)
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if len(in_flight) >= max_in_flight:
+            # The server is not keeping up; count it instead of queueing without bound.
+            if recorder.recording:
+                recorder.dropped += 1
+            continue
+        task = asyncio.create_task(call(client, workload, recorder, pick(workload, mix)))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+def load_workload_from_database(database_url, args):
+    import psycopg
+
+    with psycopg.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute(CATALOG_SIZE_SQL)
+            catalog_size = cur.fetchone()[0]
+            percent = min(100.0, max(0.01, 100.0 * args.sample_songs * 4 / max(catalog_size, 1)))
+            cur.execute(SAMPLE_SONGS_SQL, (percent, args.sample_songs))
+            rows = cur.fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows], catalog_size
+
+
+async def load_workload_from_api(client, args):
+    track_ids, names = [], []
+    for query in BOOTSTRAP_QUERIES:
+        response = await client.get('/search-advanced/', params={'query': query, 'limit': 100})
+        response.raise_for_status()
+        for song in response.json():
+            track_ids.append(song['track_id'])
+            names.append(song['track_name'])
+    return track_ids, names, None
+
+
+def db_time(database_url):
+    """(calls, total_exec_time ms) for this database, or None without pg_stat_statements."""
+    import psycopg
+
+    try:
+        with psycopg.connect(database_url) as conn:
+            with conn.cursor() as cur:
+                cur.execute(DB_TIME_SQL)
+                calls, total = cur.fetchone()
+                return int(calls), float(total)
+    except psycopg.Error:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('recommend', 'search', 'analytics'):
+            raise argparse.ArgumentTypeError(f"unknown scenario '{name}'")
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+async def run(args):
+    mix = args.mix
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_in_flight))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        if args.database_url:
+            track_ids, names, catalog_size = load_workload_from_database(args.database_url, args)
+        else:
+            track_ids, names, catalog_size = await load_workload_from_api(client, args)
+        words = sorted({word.lower() for name in names for word in name.split() if len(word) >= 2})
+        if not track_ids or not words:
+            print("❌ No songs found to build the workload from; load a catalog first", file=sys.stderr)
+            sys.exit(1)
+
+        workload = Workload(track_ids, words, args)
+        if 'analytics' in mix:
+            for _ in range(args.sessions):
+                response = await client.post('/analytics/session/start', json={'user_agent': 'load-test'})
+                response.raise_for_status()
+                workload.sessions.append(response.json()['session_id'])
+
+        recorder = Recorder(mix)
+        print(f"🚀 {args.base_url}: {', '.join(f'{k}={v:g}' for k, v in mix.items())}, "
+              f"{f'{args.rate:g} req/s' if args.rate else f'concurrency {args.concurrency}'}, "
+              f"{args.warmup:g}s warmup + {args.duration:g}s", file=sys.stderr)
+
+        started = time.perf_counter()
+        deadline = started + args.warmup + args.duration
+
+        async def start_recording():
+            await asyncio.sleep(args.warmup)
+            recorder.db_before = db_time(args.database_url) if args.database_url else None
+            recorder.recording = True
+            recorder.started = time.perf_counter()
+
+        recording_task = asyncio.create_task(start_recording())
+        if args.rate:
+            await open_loop(client, workload, recorder, mix, args.rate, args.max_in_flight, deadline)
+        else:
+            await closed_loop(client, workload, recorder, mix, args.concurrency, deadline)
+        await recording_task
+        duration = time.perf_counter() - recorder.started
+        db_after = db_time(args.database_url) if args.database_url else None
+
+    scenarios = {
+        name: summarize(recorder.latencies[name], recorder.statuses[name], recorder.errors[name], duration)
+        for name in mix
+    }
+    all_latencies = [value for name in mix for value in recorder.latencies[name]]
+    all_statuses = {}
+    for name in mix:
+        for code, count in recorder.statuses[name].items():
+            all_statuses[code] = all_statuses.get(code, 0) + count
+    total = summarize(all_latencies, all_statuses, sum(recorder.errors.values()), duration)
+    total['dropped'] = recorder.dropped
+
+    database = None
+    if recorder.db_before and db_after:
+        calls = db_after[0] - recorder.db_before[0]
+        exec_ms = db_after[1] - recorder.db_before[1]
+        database = {
+            'statements': calls,
+            'exec_time_ms': round(exec_ms, 3),
+            # Includes other clients of the database and the analytics flusher.
+            'exec_time_ms_per_request': round(exec_ms / total['requests'], 3) if total['requests'] else None,
+        }
+    elif args.database_url:
+        database = {'unavailable': 'pg_stat_statements is not installed in this database'}
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'base_url': args.base_url,
+            'mode': 'open' if args.rate else 'closed',
+            'concurrency': None if args.rate else args.concurrency,
+            'rate': args.rate,
+            'max_in_flight': args.max_in_flight if args.rate else None,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'mix': mix,
+            'limit': args.limit,
+            'seed_songs': args.seed_songs,
+            'seed': args.seed,
+        },
+        'catalog_size': catalog_size,
+        'workload': {'songs': len(track_ids), 'words': len(words)},
+        'duration': round(duration, 3),
+        'total': total,
+        'scenarios': scenarios,
+        'database': database,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /recommend-average/, /search-advanced/ and analytics")
+    parser.add_argument("--base-url", default=os.environ.get("API_URL", "http://localhost:8000"))
+    parser.add_argument("--database-url", default=None,
+                        help="sample the workload from b25.songs and report DB time from pg_stat_statements")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("recommend=6,search=3,analytics=1"),
+                        help="scenario weights (default: recommend=6,search=3,analytics=1)")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed loop: concurrent clients")
+    parser.add_argument("--rate", type=float, default=None, help="open loop: requests per second instead")
+    parser.add_argument("--max-in-flight", type=int, default=512, help="open loop: requests beyond this are dropped")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds first (default: 5)")
+    parser.add_argument("--limit", type=int, default=10, help="limit sent with each request")
+    parser.add_argument("--seed-songs", type=int, default=3, help="songs per recommendation request")
+    parser.add_argument("--sample-songs", type=int, default=5000, help="songs sampled for the workload")
+    parser.add_argument("--sessions", type=int, default=32, help="analytics sessions to spread events over")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if not args.mix:
+        parser.error("--mix needs at least one scenario with a positive weight")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+        print(f"✅ Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    total = report['total']
+    print(f"📊 {total['requests']:,} requests, {total['throughput_rps']:,.1f} req/s, "
+          f"p50 {total['latency_ms']['p50']} ms, p99 {total['latency_ms']['p99']} ms, "
+          f"errors {total['error_rate']:.2%}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+
+# The backend modules read DATABASE_URL at import time; unit tests never connect.
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/test')
+# Tests build their own stores instead of mapping the host-wide bucket file.
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'none')
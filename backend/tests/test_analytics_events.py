@@ -0,0 +1,53 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import analytics
+from analytics_ingest import AnalyticsBuffer
+
+SESSION_ID = '00000000-0000-0000-0000-000000000001'
+
+
+@pytest.fixture
+def buffer(monkeypatch: pytest.MonkeyPatch) -> AnalyticsBuffer:
+    # Never started, so nothing is flushed: submitted rows stay pending.
+    buffer = AnalyticsBuffer()
+    monkeypatch.setattr(analytics, 'ingest_buffer', buffer)
+    return buffer
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(analytics.router)
+    return TestClient(app)
+
+
+def test_each_event_is_accepted_or_rejected_on_its_own(client: TestClient, buffer: AnalyticsBuffer) -> None:
+    response = client.post('/analytics/events', json={'events': [
+        {'type': 'pageview', 'session_id': SESSION_ID, 'page_path': '/'},
+        {'type': 'pageview', 'session_id': SESSION_ID},
+        {'type': 'performance', 'metric_name': 'lcp', 'metric_value': 812.5},
+        {'type': 'search_query', 'session_id': 'not-a-uuid', 'query_text': 'shape'},
+        {'type': 'unknown'},
+        {'type': 'session_end', 'session_id': SESSION_ID},
+    ]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body['accepted'], body['rejected']) == (3, 3)
+    assert [result['status'] for result in body['results']] == [
+        'accepted', 'rejected', 'accepted', 'rejected', 'rejected', 'accepted'
+    ]
+    assert body['results'][1]['errors'][0]['loc'] == ['pageview', 'page_path']
+    assert body['results'][3]['errors'] == [{'msg': 'Invalid session_id: expected a UUID'}]
+    # Accepted items only: two rows plus the page view and end of the session.
+    assert buffer.pending == 4
+
+
+def test_batch_size_is_bounded(client: TestClient, buffer: AnalyticsBuffer) -> None:
+    assert client.post('/analytics/events', json={'events': []}).status_code == 422
+    events = [{'type': 'performance', 'metric_name': 'lcp', 'metric_value': 1.0}]
+    too_many = events * (analytics.ANALYTICS_EVENTS_MAX_BATCH + 1)
+    assert client.post('/analytics/events', json={'events': too_many}).status_code == 422
+    assert buffer.pending == 0
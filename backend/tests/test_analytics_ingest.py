@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import re
+from typing import Any, AsyncIterator
+
+import psycopg
+import pytest
+
+import analytics_ingest
+from analytics import PageViewData, SessionData, pageview_writes, session_end_writes, session_start_writes
+from analytics_ingest import PARENT_KEYS, SESSION_UPDATE_SQL, TABLES, AnalyticsBuffer
+
+TABLE_NAME = re.compile(r'"analytics"\."(\w+)"')
+
+
+def table_of(statement: str) -> str:
+    match = TABLE_NAME.search(statement)
+    assert match is not None, statement
+    return match.group(1)
+
+
+class FakeDatabase:
+    """Just enough of the analytics schema for the buffer: tables, foreign keys, session updates."""
+
+    def __init__(self) -> None:
+        self.tables: dict[str, list[tuple[Any, ...]]] = {table: [] for table in TABLES}
+        self.session_updates: dict[Any, dict[str, Any]] = {}
+
+    def keys(self, table: str) -> set[Any]:
+        index = TABLES[table].columns.index(PARENT_KEYS[table])
+        return {row[index] for row in self.tables[table]}
+
+    def insert(self, table: str, rows: list[tuple[Any, ...]]) -> None:
+        for row in rows:
+            for index, parent in TABLES[table].parent_columns():
+                if row[index] is not None and row[index] not in self.keys(parent):
+                    raise psycopg.errors.ForeignKeyViolation(f'{table} references a missing {parent} row')
+        self.tables[table].extend(rows)
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator['FakeConnection']:
+        yield FakeConnection(self)
+
+
+class FakeCopy:
+    def __init__(self, database: FakeDatabase, table: str):
+        self.database = database
+        self.table = table
+        self.rows: list[tuple[Any, ...]] = []
+
+    def set_types(self, types: list[str]) -> None:
+        pass
+
+    async def write_row(self, row: tuple[Any, ...]) -> None:
+        self.rows.append(row)
+
+
+class FakeCursor:
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+        self.result: list[tuple[Any, ...]] = []
+
+    async def __aenter__(self) -> 'FakeCursor':
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        pass
+
+    async def execute(self, query: Any, params: Any) -> None:
+        if query == SESSION_UPDATE_SQL:
+            sessions = self.database.keys('user_sessions')
+            self.result = []
+            for session_id, page_views, _, ended_at in zip(*params):
+                if session_id in sessions:
+                    update = self.database.session_updates.setdefault(session_id, {'page_views': 0})
+                    update['page_views'] += page_views
+                    update['ended'] = update.get('ended') or ended_at is not None
+                    self.result.append((session_id,))
+            return
+
+        text = query.as_string(None)
+        table = table_of(text)
+        if text.startswith('SELECT'):
+            self.result = [(key,) for key in params[0] if key in self.database.keys(table)]
+        elif text.startswith('INSERT'):
+            self.database.insert(table, [tuple(params)])
+
+    async def fetchall(self) -> list[tuple[Any, ...]]:
+        return self.result
+
+    @contextlib.asynccontextmanager
+    async def copy(self, statement: Any) -> AsyncIterator[FakeCopy]:
+        copy = FakeCopy(self.database, table_of(statement.as_string(None)))
+        yield copy
+        self.database.insert(copy.table, copy.rows)
+
+
+class FakeConnection:
+    def __init__(self, database: FakeDatabase):
+        self.database = database
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        yield
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.database)
+
+
+@pytest.fixture
+def database(monkeypatch: pytest.MonkeyPatch) -> FakeDatabase:
+    database = FakeDatabase()
+    monkeypatch.setattr(analytics_ingest, 'connection', database.connection)
+    return database
+
+
+async def start_session(worker: AnalyticsBuffer) -> str:
+    writes, response = session_start_writes(SessionData(), '127.0.0.1', 'pytest')
+    await worker.submit(writes)
+    return str(response['session_id'])
+
+
+async def page_view(worker: AnalyticsBuffer, session_id: str, ended: bool = False) -> None:
+    writes, _ = pageview_writes(PageViewData(session_id=session_id, page_path='/'))
+    if ended:
+        writes.extend(session_end_writes(session_id)[0])
+    await worker.submit(writes)
+
+
+def test_rows_wait_for_a_session_buffered_by_another_worker(database: FakeDatabase) -> None:
+    worker_a, worker_b = AnalyticsBuffer(), AnalyticsBuffer()
+
+    async def scenario() -> None:
+        session_id = await start_session(worker_a)
+        await page_view(worker_b, session_id, ended=True)
+
+        # Worker B flushes first: its session is still in worker A's buffer.
+        await worker_b.flush()
+        assert database.tables['page_views'] == []
+        assert worker_b.pending == 2
+
+        await worker_a.flush()
+        await worker_b.flush()
+
+    asyncio.run(scenario())
+    assert len(database.tables['page_views']) == 1
+    update = database.session_updates[database.tables['user_sessions'][0][0]]
+    assert update == {'page_views': 1, 'ended': True}
+    assert worker_b.pending == 0
+    assert worker_b.stats()['dropped_rows'] == 0
+    assert worker_b.stats()['unmatched_sessions'] == 0
+
+
+def test_rows_of_a_session_that_never_arrives_are_dropped(
+    database: FakeDatabase, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(analytics_ingest, 'ANALYTICS_ORPHAN_TIMEOUT', 0.0)
+    worker = AnalyticsBuffer()
+
+    async def scenario() -> None:
+        await page_view(worker, '00000000-0000-0000-0000-000000000001')
+        await worker.flush()
+        assert worker.pending == 2
+        await worker.flush()
+
+    asyncio.run(scenario())
+    stats = worker.stats()
+    assert worker.pending == 0
+    assert database.tables['page_views'] == []
+    assert (stats['orphaned_rows'], stats['unmatched_sessions']) == (1, 1)
+
+
+def test_rows_of_a_flushed_session_are_written_directly(database: FakeDatabase) -> None:
+    worker = AnalyticsBuffer()
+
+    async def scenario() -> None:
+        session_id = await start_session(worker)
+        await page_view(worker, session_id)
+        await worker.flush()
+
+    asyncio.run(scenario())
+    assert len(database.tables['page_views']) == 1
+    assert worker.pending == 0
+    assert worker.stats()['flushed_events'] == 3
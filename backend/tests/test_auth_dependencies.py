@@ -0,0 +1,80 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+import auth_dependencies
+from auth_dependencies import ANONYMOUS_CONTEXT, AuthenticatedUser, TokenCache, _verify, _VerifiedToken
+
+SECRET = 'test-secret-that-is-long-enough-for-hs256'
+
+
+def verified(user_id: str, expires_at: float) -> _VerifiedToken:
+    user = AuthenticatedUser(id=user_id, claims={'sub': user_id})
+    return _VerifiedToken(user=user, context=ANONYMOUS_CONTEXT, expires_at=expires_at)
+
+
+@pytest.fixture
+def cache(monkeypatch: pytest.MonkeyPatch) -> TokenCache:
+    cache = TokenCache(10, 300)
+    monkeypatch.setattr(auth_dependencies, 'token_cache', cache)
+    monkeypatch.setattr(auth_dependencies, 'SUPABASE_JWT_SECRET', SECRET)
+    monkeypatch.setattr(auth_dependencies, 'SUPABASE_JWT_AUDIENCE', '')
+    return cache
+
+
+def test_key_depends_on_the_secret() -> None:
+    assert TokenCache.key('a', 'token') == TokenCache.key('a', 'token')
+    assert TokenCache.key('a', 'token') != TokenCache.key('b', 'token')
+
+
+def test_expired_entries_are_misses() -> None:
+    cache = TokenCache(10, 300)
+    cache.set(b'live', verified('1', time.time() + 60), 0.001)
+    cache.set(b'old', verified('2', time.time() - 1), 0.001)
+
+    assert cache.get(b'live') is not None
+    assert cache.get(b'old') is None
+    assert cache.stats()['expired'] == 1
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    cache = TokenCache(2, 300)
+    expires_at = time.time() + 60
+    cache.set(b'a', verified('a', expires_at), 0.0)
+    cache.set(b'b', verified('b', expires_at), 0.0)
+    cache.get(b'a')
+    cache.set(b'c', verified('c', expires_at), 0.0)
+
+    assert cache.get(b'b') is None
+    assert cache.get(b'a') is not None and cache.get(b'c') is not None
+
+
+def test_verified_token_is_cached_until_its_exp(cache: TokenCache) -> None:
+    exp = int(time.time()) + 30
+    token = jwt.encode({'sub': 'user-1', 'exp': exp}, SECRET, algorithm='HS256')
+
+    first = _verify(f'Bearer {token}')
+    second = _verify(f'Bearer {token}')
+
+    assert first is not None and first is second
+    assert first.user.id == 'user-1'
+    assert first.expires_at == exp
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_invalid_token_is_rejected_and_not_cached(cache: TokenCache) -> None:
+    token = jwt.encode({'sub': 'user-1'}, 'another-secret-that-is-long-enough-for-hs256', algorithm='HS256')
+
+    with pytest.raises(HTTPException) as error:
+        _verify(f'Bearer {token}')
+
+    assert error.value.status_code == 401
+    assert cache.stats()['entries'] == 0
+
+
+def test_missing_header_is_anonymous(cache: TokenCache) -> None:
+    assert _verify(None) is None
+    assert cache.misses == 0
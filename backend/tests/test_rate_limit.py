@@ -0,0 +1,96 @@
+import asyncio
+import fcntl
+import os
+from pathlib import Path
+
+import pytest
+
+import rate_limit
+from rate_limit import SharedMemoryStore
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    return str(tmp_path / 'buckets')
+
+
+def test_burst_then_retry_after(clock: Clock, path: str) -> None:
+    store = SharedMemoryStore(path, 64)
+
+    async def scenario() -> list[tuple[bool, float]]:
+        return [await store.take('ip:1', 1.0, 2.0, 1.0) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [(True, 0.0), (True, 0.0), (False, 1.0)]
+
+
+def test_bucket_refills_up_to_the_burst(clock: Clock, path: str) -> None:
+    store = SharedMemoryStore(path, 64)
+
+    async def scenario() -> tuple[bool, float]:
+        await store.take('ip:1', 1.0, 2.0, 2.0)
+        clock.now += 60
+        await store.take('ip:1', 1.0, 2.0, 2.0)
+        return await store.take('ip:1', 1.0, 2.0, 1.0)
+
+    assert asyncio.run(scenario()) == (False, 1.0)
+
+
+def test_workers_share_buckets_but_not_keys(clock: Clock, path: str) -> None:
+    worker_a, worker_b = SharedMemoryStore(path, 64), SharedMemoryStore(path, 64)
+
+    async def scenario() -> tuple[bool, bool]:
+        await worker_a.take('ip:1', 1.0, 1.0, 1.0)
+        same_key, _ = await worker_b.take('ip:1', 1.0, 1.0, 1.0)
+        other_key, _ = await worker_b.take('ip:2', 1.0, 1.0, 1.0)
+        return same_key, other_key
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_full_probe_window_recycles_the_oldest_bucket(clock: Clock, path: str) -> None:
+    # One slot: every key probes the same one, so a new key takes over the bucket.
+    store = SharedMemoryStore(path, 1)
+
+    async def scenario() -> tuple[bool, bool]:
+        await store.take('ip:1', 1.0, 1.0, 1.0)
+        await store.take('ip:2', 1.0, 1.0, 1.0)
+        first, _ = await store.take('ip:1', 1.0, 1.0, 1.0)
+        second, _ = await store.take('ip:1', 1.0, 1.0, 1.0)
+        return first, second
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_waiting_for_the_lock_does_not_block_the_event_loop(path: str) -> None:
+    store = SharedMemoryStore(path, 64)
+
+    async def scenario() -> bool:
+        # Another open file description, as another worker process would hold.
+        other = os.open(path, os.O_RDWR)
+        try:
+            fcntl.flock(other, fcntl.LOCK_EX)
+            take = asyncio.create_task(store.take('ip:1', 1.0, 1.0, 1.0))
+            await asyncio.sleep(0.02)
+            assert not take.done()
+            fcntl.flock(other, fcntl.LOCK_UN)
+            allowed, _ = await asyncio.wait_for(take, 1.0)
+            return allowed
+        finally:
+            os.close(other)
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,92 @@
+import asyncio
+from typing import Any, Optional
+
+import pytest
+
+import recommendation_cache
+from embedding_versions import EmbeddingVersion
+from recommendation_cache import MemoryBackend, RecommendationCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(recommendation_cache.time, 'monotonic', clock)
+    return clock
+
+
+def songs(count: int) -> list[dict[str, Any]]:
+    return [{'track_id': str(i)} for i in range(count)]
+
+
+def test_memory_backend_evicts_the_least_recently_used(clock: Clock) -> None:
+    backend = MemoryBackend(2, 60)
+
+    async def scenario() -> list[Optional[dict[str, Any]]]:
+        await backend.set('a', {'n': 1})
+        await backend.set('b', {'n': 2})
+        await backend.get('a')
+        await backend.set('c', {'n': 3})
+        return [await backend.get(key) for key in ('a', 'b', 'c')]
+
+    assert asyncio.run(scenario()) == [{'n': 1}, None, {'n': 3}]
+    assert len(backend) == 2
+
+
+def test_memory_backend_expires_entries(clock: Clock) -> None:
+    backend = MemoryBackend(10, 60)
+
+    async def scenario() -> tuple[Optional[dict[str, Any]], Optional[dict[str, Any]]]:
+        await backend.set('a', {'n': 1})
+        clock.now += 59
+        fresh = await backend.get('a')
+        clock.now += 1
+        return fresh, await backend.get('a')
+
+    assert asyncio.run(scenario()) == ({'n': 1}, None)
+    assert len(backend) == 0
+
+
+def test_key_is_the_canonical_seed_set() -> None:
+    assert RecommendationCache.key(['b', 'a', 'a']) == RecommendationCache.key(['a', 'b'])
+    assert RecommendationCache.key(['a'], 'v1') != RecommendationCache.key(['a'], 'v2')
+
+
+def test_entry_answers_limits_up_to_its_depth(clock: Clock) -> None:
+    cache = RecommendationCache(MemoryBackend(10, 60))
+
+    async def scenario() -> tuple[Optional[list[dict[str, Any]]], Optional[list[dict[str, Any]]]]:
+        await cache.set(['a'], songs(25), 25)
+        return await cache.get(['a'], 10), await cache.get(['a'], 30)
+
+    smaller, larger = asyncio.run(scenario())
+    assert smaller == songs(10)
+    assert larger is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_short_entry_answers_every_limit(clock: Clock) -> None:
+    # Fewer results than the depth: the catalog ran out, a larger limit finds no more.
+    cache = RecommendationCache(MemoryBackend(10, 60))
+
+    async def scenario() -> Optional[list[dict[str, Any]]]:
+        await cache.set(['a'], songs(3), 25)
+        return await cache.get(['a'], 50)
+
+    assert asyncio.run(scenario()) == songs(3)
+
+
+def test_namespace_follows_the_data_generation() -> None:
+    loaded = EmbeddingVersion('v1', 'songs', 256, generation='10.4')
+    reloaded = EmbeddingVersion('v1', 'songs', 256, generation='20.4')
+    assert loaded == reloaded
+    assert loaded.cache_namespace != reloaded.cache_namespace
+    assert EmbeddingVersion('v1', 'songs').cache_namespace == 'v1'
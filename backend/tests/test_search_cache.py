@@ -0,0 +1,88 @@
+import asyncio
+from typing import Any, Optional
+
+from recommendation_cache import MemoryBackend
+from search import refined_score, trigram_similarity
+from search_cache import RowTerms, SearchCache
+
+SHAPE_OF_YOU = {'track_id': '1', 'track_name': 'Shape of You', 'artist_name': 'Ed Sheeran'}
+SHALLOW = {'track_id': '2', 'track_name': 'Shallow', 'artist_name': 'Lady Gaga'}
+SHAPES = {'track_id': '3', 'track_name': 'Shapes', 'artist_name': 'Shape Shifters'}
+
+TERMS: dict[str, RowTerms] = {
+    '1': (0.1, 0.9, ['ed', 'of', 'shape', 'sheeran', 'you']),
+    '2': (0.1, 0.5, ['gaga', 'lady', 'shallow']),
+    '3': (0.2, 0.1, ['shape', 'shapes', 'shifters']),
+}
+
+
+def cache() -> SearchCache:
+    return SearchCache(MemoryBackend(100, 60), prefix_min_chars=3, score=refined_score)
+
+
+def lookup(
+    query: str, limit: int, stored: str, rows: list[dict[str, Any]], stored_limit: int = 10, ranked: bool = True
+) -> tuple[Optional[list[dict[str, Any]]], SearchCache]:
+    search_cache = cache()
+
+    async def scenario() -> Optional[list[dict[str, Any]]]:
+        terms = [TERMS[row['track_id']] for row in rows] if ranked else None
+        await search_cache.set(stored, stored_limit, rows, terms)
+        return await search_cache.get(query, limit)
+
+    return asyncio.run(scenario()), search_cache
+
+
+def test_trigram_similarity_matches_pg_trgm() -> None:
+    # Example from the pg_trgm documentation.
+    assert round(trigram_similarity('word', 'two words'), 6) == 0.363636
+    assert trigram_similarity('', '') == 0.0
+
+
+def test_complete_result_is_refined_for_a_longer_query() -> None:
+    rows, search_cache = lookup('Shape', 10, 'sha', [SHAPE_OF_YOU, SHALLOW, SHAPES])
+    assert rows is not None
+    assert {row['track_id'] for row in rows} == {'1', '3'}
+    assert rows == sorted(rows, key=lambda row: -refined_score('Shape', row, TERMS[row['track_id']]))
+    assert search_cache.stats()['refinements'] == 1
+
+
+def test_refinement_adds_whole_word_tokens() -> None:
+    rows, _ = lookup('shape of', 10, 'shape', [SHAPE_OF_YOU, SHAPES])
+    assert rows == [SHAPE_OF_YOU]
+
+
+def test_refinement_respects_the_limit() -> None:
+    rows, _ = lookup('shap', 1, 'sha', [SHAPE_OF_YOU, SHALLOW, SHAPES])
+    assert rows is not None and len(rows) == 1
+
+
+def test_incomplete_result_is_not_refined() -> None:
+    rows, search_cache = lookup('shape', 10, 'sha', [SHAPE_OF_YOU, SHALLOW, SHAPES], stored_limit=3)
+    assert rows is None
+    assert search_cache.stats()['misses'] == 1
+
+
+def test_short_token_does_not_narrow() -> None:
+    # 'sh' matches the whole word only, so 'sha' may match rows 'sh' did not.
+    rows, _ = lookup('sha', 10, 'sh', [SHAPE_OF_YOU])
+    assert rows is None
+
+
+def test_no_text_match_left_asks_the_database() -> None:
+    # Fuzzy matches of 'shallot' can only come from the trigram branches.
+    rows, _ = lookup('shallot', 10, 'sha', [SHAPE_OF_YOU, SHAPES])
+    assert rows is None
+
+
+def test_legacy_result_is_not_refined() -> None:
+    rows, _ = lookup('shape', 10, 'sha', [SHAPE_OF_YOU, SHAPES], ranked=False)
+    assert rows is None
+
+
+def test_exact_entry_answers_smaller_limits_and_zero_hits() -> None:
+    rows, search_cache = lookup('Shape  of', 1, 'shape of', [SHAPE_OF_YOU, SHAPES], stored_limit=2)
+    assert rows == [SHAPE_OF_YOU]
+    rows, search_cache = lookup('zzz', 10, 'zzz', [])
+    assert rows == []
+    assert search_cache.stats()['negative_hits'] == 1
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+SETUP_DIR = Path(__file__).resolve().parents[2] / 'database' / 'setup'
+sys.path.insert(0, str(SETUP_DIR))
+
+from setup_analytics import split_sql_statements  # type: ignore[import-not-found]  # noqa: E402
+
+
+def test_splits_on_top_level_semicolons() -> None:
+    assert split_sql_statements('SELECT 1;\nSELECT 2 ;\n\n;') == ['SELECT 1', 'SELECT 2']
+
+
+def test_keeps_dollar_quoted_bodies_whole() -> None:
+    script = """
+        CREATE FUNCTION f() RETURNS void AS $$
+        BEGIN
+            PERFORM 1; PERFORM 2;
+        END;
+        $$ LANGUAGE plpgsql;
+        DO $body$ BEGIN RAISE NOTICE 'a;b'; END $body$;
+        SELECT 3
+    """
+    statements = split_sql_statements(script)
+    assert len(statements) == 3
+    assert statements[0].startswith('CREATE FUNCTION') and statements[0].endswith('LANGUAGE plpgsql')
+    assert 'PERFORM 1; PERFORM 2;' in statements[0]
+    assert statements[1] == "DO $body$ BEGIN RAISE NOTICE 'a;b'; END $body$"
+    assert statements[2] == 'SELECT 3'
+
+
+def test_keeps_quoted_strings_and_drops_comments() -> None:
+    script = "-- setup; comment\nINSERT INTO t VALUES ('it''s; fine');\nSELECT '$$';"
+    assert split_sql_statements(script) == ["INSERT INTO t VALUES ('it''s; fine')", "SELECT '$$'"]
+
+
+def test_analytics_ddl_splits_into_whole_statements() -> None:
+    statements = split_sql_statements((SETUP_DIR / 'analytics_tables.ddl').read_text())
+    assert statements
+    for statement in statements:
+        assert statement.split(None, 1)[0].upper() in {
+            'CREATE', 'ALTER', 'INSERT', 'DROP', 'COMMENT', 'SELECT', 'DO', 'GRANT', 'UPDATE', 'WITH',
+        }, statement[:80]
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation() -> None:
+    flights = SingleFlight(enabled=True)
+    calls = 0
+
+    async def compute() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def scenario() -> list[int]:
+        return list(await asyncio.gather(*(flights.do('k', compute) for _ in range(5))))
+
+    assert asyncio.run(scenario()) == [1] * 5
+    assert flights.stats() == {'enabled': True, 'leaders': 1, 'shared': 4, 'pending': 0}
+
+
+def test_nothing_is_kept_after_the_computation() -> None:
+    flights = SingleFlight(enabled=True)
+    calls = 0
+
+    async def compute() -> int:
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def scenario() -> list[int]:
+        return [await flights.do('k', compute), await flights.do('k', compute)]
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_disabled_computes_for_every_caller() -> None:
+    flights = SingleFlight(enabled=False)
+    calls = 0
+
+    async def compute() -> int:
+        nonlocal calls
+        calls += 1
+        call = calls
+        await asyncio.sleep(0.01)
+        return call
+
+    async def scenario() -> list[int]:
+        return list(await asyncio.gather(*(flights.do('k', compute) for _ in range(3))))
+
+    assert sorted(asyncio.run(scenario())) == [1, 2, 3]
+    assert flights.leaders == 0
+
+
+def test_failure_reaches_every_waiter() -> None:
+    flights = SingleFlight(enabled=True)
+
+    async def compute() -> int:
+        await asyncio.sleep(0.01)
+        raise ValueError('database down')
+
+    async def scenario() -> list[object]:
+        return list(await asyncio.gather(*(flights.do('k', compute) for _ in range(3)), return_exceptions=True))
+
+    errors = asyncio.run(scenario())
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flights.stats()['pending'] == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_others() -> None:
+    flights = SingleFlight(enabled=True)
+
+    async def compute() -> str:
+        await asyncio.sleep(0.02)
+        return 'done'
+
+    async def scenario() -> str:
+        first = asyncio.create_task(flights.do('k', compute))
+        second = asyncio.create_task(flights.do('k', compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == 'done'
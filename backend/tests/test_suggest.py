@@ -0,0 +1,59 @@
+import pytest
+
+import suggest
+from suggest import SuggestIndex, like_prefix, normalize
+
+CATALOG = [
+    ('1', 'Shape of You', 'Ed Sheeran', 'url1', 90),
+    ('2', 'Shallow', 'Lady Gaga', 'url2', 80),
+    ('3', 'Café del Mar', 'Energy 52', 'url3', 40),
+    ('4', 'Perfect', 'Ed Sheeran', 'url4', None),
+    ('5', 'You Belong With Me', 'Taylor Swift', 'url5', 70),
+]
+
+
+def ids(rows: list[dict[str, str]]) -> list[str]:
+    return [row['track_id'] for row in rows]
+
+
+@pytest.fixture
+def index() -> SuggestIndex:
+    return SuggestIndex(CATALOG)
+
+
+def test_normalize_folds_case_accents_and_punctuation() -> None:
+    assert normalize("  Café-Del_Mar!! ") == 'cafe del mar'
+    assert normalize(None) == ''
+
+
+def test_track_and_artist_prefixes_by_relevance(index: SuggestIndex) -> None:
+    assert ids(index.suggest('sha', 10)) == ['1', '2']
+    assert ids(index.suggest('ed', 10)) == ['1', '4']
+
+
+def test_word_starts_inside_track_names(index: SuggestIndex) -> None:
+    # 'you' starts 'You Belong With Me' and the last word of 'Shape of You'.
+    assert ids(index.suggest('you', 10)) == ['1', '5']
+
+
+def test_accents_and_case_are_ignored(index: SuggestIndex) -> None:
+    assert ids(index.suggest('CAFE D', 10)) == ['3']
+
+
+def test_result_shape_and_limit(index: SuggestIndex) -> None:
+    assert index.suggest('sha', 1) == [
+        {'track_id': '1', 'track_name': 'Shape of You', 'artist_name': 'Ed Sheeran', 'track_external_urls': 'url1'}
+    ]
+    assert index.suggest('zzz', 10) == []
+    assert index.suggest('  ', 10) == []
+
+
+def test_large_prefix_ranges_are_memoized(index: SuggestIndex, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(suggest, 'SUGGEST_SCAN_CAP', 1)
+    assert ids(index.suggest('s', 1)) == ['1']
+    assert b's' in index._ranked
+    assert ids(index.suggest('s', 3)) == ['1', '2']
+
+
+def test_like_prefix_escapes_wildcards() -> None:
+    assert like_prefix('50%_off\\') == '50\\%\\_off\\\\%'
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Precomputed nearest-neighbour lists for MyNewPlaylist
+
+Computes the top-N neighbours (L2, like pgvector's <->) of every track of an
+embedding version with blocked matrix products, and stores them in
+b25.song_neighbors. The backend serves one- and two-seed recommendations from
+these lists instead of running an HNSW traversal per request.
+
+Rebuilds are incremental: each row keeps a hash of its track's embedding, and
+only tracks whose embedding changed, whose list references a changed or removed
+track, or that a changed track now belongs to are recomputed.
+
+    DATABASE_URL=... python database/setup/build_neighbors.py --neighbors 100
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+from psycopg import sql
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS b25.song_neighbors (
+        version TEXT NOT NULL,
+        track_id TEXT NOT NULL,
+        neighbor_ids TEXT[] NOT NULL,
+        distances REAL[] NOT NULL,
+        embedding_hash BYTEA NOT NULL,
+        PRIMARY KEY (version, track_id)
+    )
+"""
+
+NEIGHBOR_COLUMNS = ['version', 'track_id', 'neighbor_ids', 'distances', 'embedding_hash']
+NEIGHBOR_TYPES = ['text', 'text', 'text[]', 'float4[]', 'bytea']
+
+UPSERT_SQL = """
+    INSERT INTO b25.song_neighbors AS n
+    SELECT * FROM song_neighbors_batch
+    ON CONFLICT (version, track_id) DO UPDATE
+    SET neighbor_ids = EXCLUDED.neighbor_ids,
+        distances = EXCLUDED.distances,
+        embedding_hash = EXCLUDED.embedding_hash
+"""
+
+
+def resolve_version(conn, requested):
+    """(version, table_name) of the requested or the active embedding version"""
+    with conn.cursor() as cur:
+        if requested:
+            cur.execute("SELECT version, table_name FROM b25.embedding_versions WHERE version = %s", (requested,))
+        else:
+            cur.execute("SELECT version, table_name FROM b25.embedding_versions WHERE active")
+        row = cur.fetchone()
+    if row is None:
+        print(f"❌ Embedding version {requested or '(active)'} not found in b25.embedding_versions")
+        sys.exit(1)
+    return row
+
+
+def fetch_embeddings(conn, table_name, batch_size):
+    track_ids, chunks = [], []
+    with conn.cursor(name='neighbor_embeddings') as cur:
+        cur.execute(sql.SQL("SELECT track_id, embedding FROM {} WHERE embedding IS NOT NULL").format(
+            sql.Identifier('b25', table_name)
+        ))
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            track_ids.extend(row[0] for row in batch)
+            chunks.append(np.stack([row[1] for row in batch]).astype(np.float32, copy=False))
+    conn.commit()
+    matrix = np.ascontiguousarray(np.concatenate(chunks)) if chunks else np.empty((0, 0), dtype=np.float32)
+    return track_ids, matrix
+
+
+def embedding_hashes(matrix):
+    return [hashlib.blake2b(row.tobytes(), digest_size=8).digest() for row in matrix]
+
+
+def fetch_state(conn, version):
+    """track_id -> (embedding hash, distance of the last stored neighbour)"""
+    with conn.cursor(name='neighbor_state') as cur:
+        cur.execute("""
+            SELECT track_id, embedding_hash, distances[array_length(distances, 1)]
+            FROM b25.song_neighbors
+            WHERE version = %s
+        """, (version,))
+        state = {track_id: (bytes(digest), kth) for track_id, digest, kth in cur}
+    conn.commit()
+    return state
+
+
+def block_rows(total, budget_bytes):
+    """Query rows per block so one (block x catalog) float32 score matrix stays within the budget"""
+    return max(1, budget_bytes // (4 * max(total, 1)))
+
+
+def top_neighbors(matrix, sq_norms, rows, n, block):
+    """Yield (rows, neighbour indices, exact distances) per block, nearest first, self excluded"""
+    total = len(matrix)
+    k = min(n, total - 1)
+    for start in range(0, len(rows), block):
+        query_rows = rows[start:start + block]
+        queries = matrix[query_rows]
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2; the matmul runs on all BLAS threads.
+        scores = sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+        scores[np.arange(len(query_rows)), query_rows] = np.inf
+        candidates = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        # Exact distances for the survivors, then order by them.
+        distances = np.linalg.norm(matrix[candidates] - queries[:, None, :], axis=2)
+        order = np.argsort(distances, axis=1, kind='stable')
+        yield (
+            query_rows,
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(distances, order, axis=1),
+        )
+
+
+def affected_by(matrix, sq_norms, changed_rows, kth, block):
+    """Unchanged rows whose top-N a changed row now enters (distance below their stored N-th)"""
+    if len(changed_rows) == 0:
+        return np.empty(0, dtype=np.intp)
+    changed = matrix[changed_rows]
+    changed_norms = sq_norms[changed_rows]
+    hits = []
+    for start in range(0, len(matrix), block):
+        part = slice(start, start + block)
+        # Squared distances of this block of rows to every changed row.
+        d2 = sq_norms[part, None] - 2.0 * (matrix[part] @ changed.T) + changed_norms[None, :]
+        nearest = np.sqrt(np.maximum(d2.min(axis=1), 0))
+        hits.append(np.nonzero(nearest < kth[part])[0] + start)
+    return np.concatenate(hits)
+
+
+def write_neighbors(conn, version, track_ids, hashes, results):
+    written = 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE song_neighbors_batch
+            (LIKE b25.song_neighbors INCLUDING DEFAULTS) ON COMMIT DROP
+        """)
+        copy_sql = sql.SQL("COPY song_neighbors_batch ({}) FROM STDIN (FORMAT BINARY)").format(
+            sql.SQL(', ').join(map(sql.Identifier, NEIGHBOR_COLUMNS))
+        )
+        with cur.copy(copy_sql) as copy:
+            copy.set_types(NEIGHBOR_TYPES)
+            for rows, neighbors, distances in results:
+                for row, row_neighbors, row_distances in zip(rows.tolist(), neighbors.tolist(), distances.tolist()):
+                    copy.write_row((
+                        version,
+                        track_ids[row],
+                        [track_ids[i] for i in row_neighbors],
+                        row_distances,
+                        hashes[row],
+                    ))
+                    written += 1
+                print(f"  {written:>10,} neighbour lists computed", flush=True)
+        cur.execute(UPSERT_SQL)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute top-N neighbour lists into b25.song_neighbors")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="defaults to the DATABASE_URL environment variable")
+    parser.add_argument("--version", help="embedding version (default: the active one)")
+    parser.add_argument("--neighbors", type=int, default=100, help="neighbours per track (default: 100)")
+    parser.add_argument("--block-memory-mb", type=int, default=512,
+                        help="memory for one block of scores (default: 512)")
+    parser.add_argument("--full", action="store_true", help="recompute every track instead of only changed ones")
+    parser.add_argument("--full-threshold", type=float, default=0.2,
+                        help="fraction of changed tracks above which a full rebuild is done (default: 0.2)")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    with psycopg.connect(args.database_url) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            cur.execute(CREATE_TABLE_SQL)
+        conn.commit()
+
+        version, table_name = resolve_version(conn, args.version)
+        track_ids, matrix = fetch_embeddings(conn, table_name, 20_000)
+        if len(track_ids) < 2:
+            print(f"❌ Not enough embeddings in b25.{table_name}")
+            sys.exit(1)
+        print(f"✅ Loaded {len(track_ids):,} embeddings of {version} ({matrix.shape[1]} dims)")
+
+        hashes = embedding_hashes(matrix)
+        sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+        block = block_rows(len(matrix), args.block_memory_mb * 2**20)
+        state = {} if args.full else fetch_state(conn, version)
+
+        positions = {track_id: row for row, track_id in enumerate(track_ids)}
+        removed = [track_id for track_id in state if track_id not in positions]
+        changed = np.array(
+            [row for row, track_id in enumerate(track_ids)
+             if state.get(track_id, (None,))[0] != hashes[row]],
+            dtype=np.intp,
+        )
+
+        if not state or len(changed) > args.full_threshold * len(track_ids):
+            dirty = np.arange(len(track_ids), dtype=np.intp)
+            print(f"🔧 Full build: {len(dirty):,} tracks")
+        else:
+            stale_ids = [track_ids[row] for row in changed.tolist()] + removed
+            with conn.cursor() as cur:
+                # Lists that contain a changed or removed track
+                cur.execute("""
+                    SELECT track_id FROM b25.song_neighbors
+                    WHERE version = %s AND neighbor_ids && %s::text[]
+                """, (version, stale_ids))
+                referencing = [positions[row[0]] for row in cur.fetchall() if row[0] in positions]
+            conn.commit()
+
+            kth = np.array(
+                [state[track_id][1] if track_id in state else np.inf for track_id in track_ids],
+                dtype=np.float32,
+            )
+            entered = affected_by(matrix, sq_norms, changed, kth, block)
+            dirty = np.unique(np.concatenate([changed, np.array(referencing, dtype=np.intp), entered]))
+            print(f"🔧 Incremental build: {len(changed):,} changed, {len(removed):,} removed, "
+                  f"{len(dirty):,} tracks to recompute")
+
+        if len(dirty):
+            results = top_neighbors(matrix, sq_norms, dirty, args.neighbors, block)
+            written = write_neighbors(conn, version, track_ids, hashes, results)
+        else:
+            written = 0
+        if removed:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM b25.song_neighbors WHERE version = %s AND track_id = ANY(%s::text[])",
+                    (version, removed)
+                )
+        conn.commit()
+
+    print(f"🎵 {written:,} neighbour lists written, {len(removed):,} removed "
+          f"in {time.perf_counter() - started:,.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Embedding version management for MyNewPlaylist
+
+Every embedding model version lives in its own b25 table; b25.embedding_versions
+marks the one the backend serves. Activation flips that pointer in a single
+transaction, so switching (or rolling back) is instant and every backend worker
+follows within EMBEDDING_VERSION_TTL seconds.
+
+    python database/setup/embedding_versions.py list
+    python database/setup/embedding_versions.py activate b25-CBOW-256-5-150v5
+    python database/setup/embedding_versions.py rollback
+    python database/setup/embedding_versions.py drop b25-CBOW-256-5-150v3
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import psycopg
+from psycopg import sql
+
+
+def version_table_name(version):
+    """b25 table for a version, e.g. 'b25-CBOW-256-5-150v5' -> 'songs_b25_cbow_256_5_150v5'"""
+    return 'songs_' + re.sub(r'[^a-z0-9]+', '_', version.lower()).strip('_')
+
+
+def activate_version(conn, version):
+    """Make `version` the active one; readers see either the old or the new pointer"""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute("SELECT table_name FROM b25.embedding_versions WHERE version = %s FOR UPDATE", (version,))
+            if cur.fetchone() is None:
+                raise ValueError(f"Unknown embedding version {version!r}")
+            cur.execute("UPDATE b25.embedding_versions SET active = FALSE WHERE active")
+            cur.execute(
+                "UPDATE b25.embedding_versions SET active = TRUE, activated_at = NOW() WHERE version = %s",
+                (version,)
+            )
+    print(f"✅ Activated embedding version {version}")
+
+
+def previous_version(conn):
+    """The version that was active before the current one"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT version
+            FROM b25.embedding_versions
+            WHERE NOT active AND activated_at IS NOT NULL
+            ORDER BY activated_at DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def list_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT version, table_name, dims, song_count, created_at, activated_at, active
+            FROM b25.embedding_versions
+            ORDER BY created_at
+        """)
+        rows = cur.fetchall()
+    for version, table_name, dims, song_count, created_at, activated_at, active in rows:
+        marker = "▶" if active else " "
+        activated = f"{activated_at:%Y-%m-%d %H:%M}" if activated_at else "never"
+        print(f"{marker} {version:<32} b25.{table_name:<40} {dims or '?':>4} dims "
+              f"{song_count or 0:>10,} songs  activated: {activated}")
+
+
+def drop_version(conn, version):
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT table_name, active FROM b25.embedding_versions WHERE version = %s FOR UPDATE",
+                (version,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                raise ValueError(f"Unknown embedding version {version!r}")
+            table_name, active = row
+            if active:
+                raise ValueError(f"{version} is active; activate another version first")
+            if table_name == 'songs':
+                raise ValueError("b25.songs holds the catalog itself and cannot be dropped")
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier('b25', table_name)))
+            cur.execute("SELECT to_regclass('b25.song_neighbors') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute("DELETE FROM b25.song_neighbors WHERE version = %s", (version,))
+            cur.execute("DELETE FROM b25.embedding_versions WHERE version = %s", (version,))
+    print(f"🗑️  Dropped embedding version {version} (b25.{table_name})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage embedding model versions")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="defaults to the DATABASE_URL environment variable")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show all versions")
+    commands.add_parser("activate", help="serve recommendations from VERSION").add_argument("version")
+    commands.add_parser("rollback", help="re-activate the previously active version")
+    commands.add_parser("drop", help="drop an inactive version and its table").add_argument("version")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    with psycopg.connect(args.database_url) as conn:
+        try:
+            if args.command == "list":
+                list_versions(conn)
+            elif args.command == "activate":
+                activate_version(conn, args.version)
+            elif args.command == "rollback":
+                version = previous_version(conn)
+                if version is None:
+                    print("❌ No previously active version to roll back to")
+                    sys.exit(1)
+                activate_version(conn, version)
+            elif args.command == "drop":
+                drop_version(conn, args.version)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
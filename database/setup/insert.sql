@@ -1,3 +1,7 @@
+-- manual CSV path; load_embeddings.py streams the model and songs CSV straight
+-- into b25.songs with binary COPY and rebuilds the indexes after the load:
+-- python database/setup/load_embeddings.py --model <model> --songs <songs.csv>
+
 -- need to insert the data into the container first
 -- docker cp /home/lipka/mynewplaylist.com/database/setup/combined_csvsongs_with_embeddings_v3.csv vector-db-prod:/tmp/songs.csv
 -- docker exec -it vector-db-prod psql -U postgres -d vectordemo
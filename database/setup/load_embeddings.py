@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Streaming catalog loader for MyNewPlaylist
+
+Reads the songs CSV in chunks, looks up each track's vector in the Word2Vec
+KeyedVectors and writes the rows into b25.songs with binary COPY (pgvector's
+binary format), so no per-float string formatting and no intermediate CSV.
+Secondary indexes are dropped for the load and rebuilt afterwards, with the
+HNSW build given more maintenance memory and parallel workers.
+
+With --version the model is loaded into its own shadow table instead; its HNSW
+index is built and warmed while the current version keeps serving, then it is
+registered in b25.embedding_versions (and switched to with --activate).
+
+    python database/setup/load_embeddings.py \
+        --model b25-CBOW-256-5-150v4.model --songs songs3.csv
+    python database/setup/load_embeddings.py \
+        --model b25-CBOW-256-5-150v5.model --songs songs3.csv --version b25-CBOW-256-5-150v5 --activate
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+import psycopg
+from gensim.models import KeyedVectors, Word2Vec
+from pgvector.psycopg import register_vector
+from psycopg import sql
+
+from embedding_versions import activate_version, version_table_name
+
+SONG_COLUMNS = ['track_id', 'track_name', 'artist_name', 'track_external_urls', 'relevance', 'embedding']
+SONG_TYPES = ['text', 'text', 'text', 'text', 'int4', 'vector']
+
+SECONDARY_INDEXES_SQL = """
+    SELECT i.indexname, i.indexdef
+    FROM pg_indexes i
+    JOIN pg_class c ON c.relname = i.indexname
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+    JOIN pg_index x ON x.indexrelid = c.oid
+    WHERE i.schemaname = 'b25' AND i.tablename = 'songs' AND NOT x.indisprimary
+"""
+
+# Existing rows are updated in place (analytics tables reference b25.songs), and
+# songs missing from the new model lose their embedding: vectors from different
+# models must never be compared.
+MERGE_STAGING_SQL = """
+    INSERT INTO b25.songs (track_id, track_name, artist_name, track_external_urls, relevance, embedding)
+    SELECT track_id, track_name, artist_name, track_external_urls, relevance, embedding
+    FROM b25.songs_staging
+    ON CONFLICT (track_id) DO UPDATE
+    SET track_name = EXCLUDED.track_name,
+        artist_name = EXCLUDED.artist_name,
+        track_external_urls = EXCLUDED.track_external_urls,
+        relevance = EXCLUDED.relevance,
+        embedding = EXCLUDED.embedding
+"""
+
+# Shadow loads keep b25.songs (search, analytics foreign keys) in sync with the
+# new catalog; only rows whose metadata changed are rewritten.
+SYNC_METADATA_SQL = sql.SQL("""
+    INSERT INTO b25.songs AS s (track_id, track_name, artist_name, track_external_urls, relevance)
+    SELECT track_id, track_name, artist_name, track_external_urls, relevance
+    FROM {shadow}
+    ON CONFLICT (track_id) DO UPDATE
+    SET track_name = EXCLUDED.track_name,
+        artist_name = EXCLUDED.artist_name,
+        track_external_urls = EXCLUDED.track_external_urls,
+        relevance = EXCLUDED.relevance
+    WHERE (s.track_name, s.artist_name, s.track_external_urls, s.relevance)
+          IS DISTINCT FROM (EXCLUDED.track_name, EXCLUDED.artist_name, EXCLUDED.track_external_urls, EXCLUDED.relevance)
+""")
+
+CLEAR_STALE_SQL = """
+    UPDATE b25.songs s
+    SET embedding = NULL
+    WHERE s.embedding IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM b25.songs_staging g WHERE g.track_id = s.track_id)
+"""
+
+
+def load_vectors(path):
+    """KeyedVectors from a full Word2Vec model or a saved .kv file, memory-mapped when possible"""
+    try:
+        return Word2Vec.load(path, mmap='r').wv
+    except Exception:
+        return KeyedVectors.load(path, mmap='r')
+
+
+def iter_rows(vectors, songs_csv, chunk_size, stats):
+    """Yield (track_id, track_name, artist_name, url, relevance, vector) per known track"""
+    seen = set()
+    key_to_index = vectors.key_to_index
+    chunks = pd.read_csv(
+        songs_csv,
+        usecols=['track_id', 'track_name', 'track_external_urls', 'artist_name', 'relevance'],
+        dtype={'track_id': str, 'track_name': str, 'artist_name': str, 'track_external_urls': str},
+        chunksize=chunk_size,
+        encoding='utf-8',
+        encoding_errors='ignore',
+        keep_default_na=False,
+        na_values={'relevance': ['']},
+    )
+    for chunk in chunks:
+        stats['read'] += len(chunk)
+        positions = chunk['track_id'].map(key_to_index)
+        chunk = chunk[positions.notna()]
+        positions = positions[positions.notna()].astype('int64')
+        block = vectors.vectors[positions.to_numpy()]
+
+        for offset, row in enumerate(chunk.itertuples(index=False)):
+            if row.track_id in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(row.track_id)
+            relevance = None if pd.isna(row.relevance) else int(row.relevance)
+            yield (
+                row.track_id,
+                row.track_name or None,
+                row.artist_name or None,
+                row.track_external_urls or None,
+                relevance,
+                block[offset],
+            )
+
+
+def copy_rows(conn, table, rows, stats, progress_every):
+    started = time.perf_counter()
+    copy_sql = sql.SQL('COPY {} ({}) FROM STDIN (FORMAT BINARY)').format(
+        table, sql.SQL(', ').join(map(sql.Identifier, SONG_COLUMNS))
+    )
+    with conn.cursor() as cur:
+        with cur.copy(copy_sql) as copy:
+            copy.set_types(SONG_TYPES)
+            for row in rows:
+                copy.write_row(row)
+                stats['written'] += 1
+                if stats['written'] % progress_every == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"  {stats['written']:>10,} rows written "
+                          f"({stats['read']:,} read, {stats['written'] / elapsed:,.0f} rows/s)", flush=True)
+
+
+def drop_secondary_indexes(conn):
+    with conn.cursor() as cur:
+        cur.execute(SECONDARY_INDEXES_SQL)
+        indexes = cur.fetchall()
+        for name, _ in indexes:
+            cur.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier('b25', name)))
+            print(f"🗑️  Dropped index b25.{name} for the load")
+    return indexes
+
+
+def build_indexes(conn, indexes, maintenance_work_mem, parallel_workers):
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+        cur.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false)", (str(parallel_workers),))
+        for name, definition in indexes:
+            started = time.perf_counter()
+            print(f"🔧 Building index b25.{name}...", flush=True)
+            cur.execute(definition)
+            conn.commit()
+            print(f"✅ Built b25.{name} in {time.perf_counter() - started:,.1f}s", flush=True)
+
+
+# HNSW index definitions per --index kind; quantized ones are expression indexes
+# matching the backend's candidate ordering (backend/recommendation_sql.py).
+HNSW_INDEXES = {
+    'full': "embedding vector_l2_ops",
+    'halfvec': "(embedding::halfvec({dims})) halfvec_l2_ops",
+    'binary': "(binary_quantize(embedding)::bit({dims})) bit_hamming_ops",
+}
+
+
+def warm_table(conn, table_name, index_names):
+    """Pull the shadow table and its HNSW graphs into shared buffers before traffic hits them"""
+    try:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+                for relation in (table_name, *index_names):
+                    cur.execute("SELECT pg_prewarm(%s)", (f"b25.{relation}",))
+                    print(f"🔥 Prewarmed b25.{relation}: {cur.fetchone()[0]:,} blocks")
+    except psycopg.Error as e:
+        print(f"⚠️  Could not prewarm b25.{table_name}: {e}")
+
+
+def load_version(conn, args, vectors, stats):
+    """Load the model into b25.songs_<version>, index and warm it, then register it"""
+    table_name = version_table_name(args.version)
+    shadow = sql.Identifier('b25', table_name)
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM b25.embedding_versions WHERE version = %s", (args.version,))
+        if cur.fetchone():
+            print(f"❌ Embedding version {args.version} already exists; drop it first")
+            sys.exit(1)
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(shadow))
+        cur.execute(sql.SQL("CREATE TABLE {} (LIKE b25.songs INCLUDING DEFAULTS)").format(shadow))
+        cur.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN embedding TYPE vector({})").format(
+            shadow, sql.Literal(vectors.vector_size)
+        ))
+
+    copy_rows(conn, shadow, iter_rows(vectors, args.songs, args.chunk_size, stats), stats, args.progress_every)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (track_id)").format(shadow))
+        cur.execute(SYNC_METADATA_SQL.format(shadow=shadow))
+        print(f"  {cur.rowcount:,} b25.songs rows added or updated")
+    conn.commit()
+    print(f"✅ Loaded {stats['written']:,} songs into b25.{table_name} ({stats['read']:,} CSV rows, "
+          f"{stats['duplicates']:,} duplicates skipped)", flush=True)
+
+    indexes = []
+    for kind in args.index or ['full']:
+        index_name = f"{table_name}_embedding_idx" if kind == 'full' else f"{table_name}_embedding_{kind}_idx"
+        indexes.append((index_name, sql.SQL(
+            "CREATE INDEX {} ON {} USING hnsw (" + HNSW_INDEXES[kind] + ") WITH (m = {}, ef_construction = {})"
+        ).format(
+            sql.Identifier(index_name), shadow, sql.Literal(args.hnsw_m), sql.Literal(args.hnsw_ef_construction),
+            dims=sql.Literal(vectors.vector_size),
+        )))
+    build_indexes(conn, indexes, args.maintenance_work_mem, args.parallel_workers)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("ANALYZE {}").format(shadow))
+    conn.commit()
+    warm_table(conn, table_name, [name for name, _ in indexes])
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO b25.embedding_versions (version, table_name, dims, song_count)
+            VALUES (%s, %s, %s, %s)
+        """, (args.version, table_name, vectors.vector_size, stats['written']))
+    conn.commit()
+    print(f"✅ Registered embedding version {args.version}")
+
+    if args.activate:
+        activate_version(conn, args.version)
+    else:
+        print(f"   Activate with: python database/setup/embedding_versions.py activate {args.version}")
+
+
+def load_in_place(conn, args, vectors, stats):
+    """Load the model into b25.songs itself (initial load or legacy single-version setups)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM b25.songs)")
+        replacing = cur.fetchone()[0]
+
+    rows = iter_rows(vectors, args.songs, args.chunk_size, stats)
+
+    if replacing:
+        # Existing catalog: load into an unlogged staging table, then merge.
+        # Indexes are only dropped for the merge, so search keeps working during the COPY.
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS b25.songs_staging")
+            cur.execute("CREATE UNLOGGED TABLE b25.songs_staging (LIKE b25.songs INCLUDING DEFAULTS)")
+        copy_rows(conn, sql.Identifier('b25', 'songs_staging'), rows, stats, args.progress_every)
+        indexes = [] if args.keep_indexes else drop_secondary_indexes(conn)
+        print("🔧 Merging staged rows into b25.songs...", flush=True)
+        with conn.cursor() as cur:
+            cur.execute("CREATE UNIQUE INDEX ON b25.songs_staging (track_id)")
+            cur.execute(MERGE_STAGING_SQL)
+            cur.execute(CLEAR_STALE_SQL)
+            print(f"  {cur.rowcount:,} songs not in the model had their embedding cleared")
+            cur.execute("DROP TABLE b25.songs_staging")
+    else:
+        indexes = [] if args.keep_indexes else drop_secondary_indexes(conn)
+        copy_rows(conn, sql.Identifier('b25', 'songs'), rows, stats, args.progress_every)
+    conn.commit()
+    print(f"✅ Loaded {stats['written']:,} songs ({stats['read']:,} CSV rows, "
+          f"{stats['duplicates']:,} duplicates skipped)", flush=True)
+
+    build_indexes(conn, indexes, args.maintenance_work_mem, args.parallel_workers)
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE b25.songs")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream Word2Vec embeddings and song metadata into b25.songs")
+    parser.add_argument("--model", required=True, help="Word2Vec .model or KeyedVectors .kv file")
+    parser.add_argument("--songs", required=True, help="songs CSV (track_id, track_name, track_external_urls, artist_name, relevance)")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="defaults to the DATABASE_URL environment variable")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="CSV rows per chunk (default: 50000)")
+    parser.add_argument("--progress-every", type=int, default=100_000, help="report every N rows (default: 100000)")
+    parser.add_argument("--maintenance-work-mem", default="2GB",
+                        help="maintenance_work_mem for the index builds; the HNSW graph should fit (default: 2GB)")
+    parser.add_argument("--parallel-workers", type=int, default=4,
+                        help="max_parallel_maintenance_workers for the index builds (default: 4)")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="keep secondary indexes during the load (slower, but searchable throughout)")
+    parser.add_argument("--version",
+                        help="load into a shadow table for this embedding version instead of b25.songs")
+    parser.add_argument("--activate", action="store_true",
+                        help="with --version, switch the backend to the new version once it is ready")
+    parser.add_argument("--index", action="append", choices=sorted(HNSW_INDEXES),
+                        help="HNSW index(es) to build on a shadow table; repeat for several "
+                             "(default: full; add halfvec/binary for RECOMMENDATION_QUANTIZATION)")
+    parser.add_argument("--hnsw-m", type=int, default=16, help="HNSW m for a shadow table (default: 16)")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=200,
+                        help="HNSW ef_construction for a shadow table (default: 200)")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    vectors = load_vectors(args.model)
+    print(f"✅ Model loaded: {len(vectors.key_to_index):,} vectors, {vectors.vector_size} dims")
+
+    stats = {'read': 0, 'written': 0, 'duplicates': 0}
+    with psycopg.connect(args.database_url) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+        if args.version:
+            load_version(conn, args, vectors, stats)
+        else:
+            load_in_place(conn, args, vectors, stats)
+
+    print(f"🎵 Catalog load finished in {time.perf_counter() - started:,.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,54 @@ This script sets up the analytics database schema and provides
 initial configuration for the analytics system.
 """
 
+import argparse
 import os
+import re
 import sys
 import psycopg
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from psycopg import sql
+
+PARTITIONED_TABLES = ('page_views', 'song_interactions', 'search_queries', 'errors', 'performance')
+
+DOLLAR_QUOTE = re.compile(r"\$[A-Za-z_0-9]*\$")
+
+def split_sql_statements(script):
+    """Split a SQL script on top-level semicolons, keeping quoted and $$-bodies intact"""
+    statements = []
+    current = []
+    i = 0
+    while i < len(script):
+        char = script[i]
+        if script.startswith('--', i):
+            end = script.find('\n', i)
+            i = len(script) if end == -1 else end + 1
+            continue
+        if char == "'":
+            end = script.find("'", i + 1)
+            while end != -1 and script.startswith("''", end):
+                end = script.find("'", end + 2)
+            end = len(script) if end == -1 else end + 1
+            current.append(script[i:end])
+            i = end
+            continue
+        if char == '$':
+            match = DOLLAR_QUOTE.match(script, i)
+            if match:
+                end = script.find(match.group(), match.end())
+                end = len(script) if end == -1 else end + len(match.group())
+                current.append(script[i:end])
+                i = end
+                continue
+        if char == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
 
 def get_database_connection():
     """Get database connection from environment variables"""
@@ -41,18 +85,17 @@ def setup_analytics_schema(conn):
             with open(ddl_file, 'r') as f:
                 ddl_content = f.read()
             
-            # Split and execute DDL statements
-            statements = ddl_content.split(';')
-            for statement in statements:
-                statement = statement.strip()
-                if statement and not statement.startswith('--'):
-                    try:
+            # Split and execute DDL statements, each in its own savepoint so an
+            # "already exists" error does not abort the rest of the script
+            for statement in split_sql_statements(ddl_content):
+                try:
+                    with conn.transaction():
                         cur.execute(statement)
-                        print(f"✅ Executed: {statement[:50]}...")
-                    except Exception as e:
-                        if "already exists" not in str(e).lower():
-                            print(f"⚠️  Warning executing statement: {e}")
-                            print(f"Statement: {statement[:100]}...")
+                    print(f"✅ Executed: {statement[:50]}...")
+                except Exception as e:
+                    if "already exists" not in str(e).lower():
+                        print(f"⚠️  Warning executing statement: {e}")
+                        print(f"Statement: {statement[:100]}...")
             
             conn.commit()
             print("✅ Analytics schema setup completed successfully!")
@@ -90,7 +133,17 @@ def verify_analytics_setup(conn):
                 'recommendations',
                 'user_engagement',
                 'errors',
-                'performance'
+                'performance',
+                'rollup_state',
+                'hourly_activity',
+                'daily_activity',
+                'daily_song_interactions',
+                'song_interaction_totals',
+                'daily_search_queries',
+                'search_query_totals',
+                'daily_errors',
+                'daily_performance',
+                'partition_config'
             ]
             
             for table in required_tables:
@@ -213,6 +266,181 @@ def create_sample_data(conn):
         conn.rollback()
         return False
 
+def refresh_rollups(conn, lookback_minutes):
+    """Bring the analytics rollup tables up to date (safe to run from cron)"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT analytics.refresh_rollups(make_interval(mins => %s))",
+                (lookback_minutes,)
+            )
+            refreshed = cur.fetchone()[0]
+        conn.commit()
+        if refreshed:
+            print("✅ Analytics rollups refreshed")
+        else:
+            print("⏭️  Another refresh is running, skipped")
+        return True
+    except Exception as e:
+        print(f"❌ Error refreshing analytics rollups: {e}")
+        conn.rollback()
+        return False
+
+def partition_floor(moment, granularity):
+    """Start (UTC) of the day or month containing `moment`"""
+    moment = moment.astimezone(timezone.utc)
+    if granularity == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def partition_step(start, granularity):
+    """Start of the partition following the one that starts at `start`"""
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+def list_partitions(cur, table):
+    """(name, lower, upper) for each range partition of analytics.<table>, oldest first"""
+    cur.execute("""
+        SELECT c.relname,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = 'analytics' AND p.relname = %s
+          AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+        ORDER BY 2
+    """, (table,))
+    return cur.fetchall()
+
+def create_partition(conn, table, start, end, granularity):
+    """
+    Create analytics.<table>_p<start> for [start, end). Rows of that range sitting in
+    the default partition are moved into it first, so ATTACH always succeeds.
+    """
+    suffix = start.strftime('%Y%m%d' if granularity == 'day' else '%Y%m')
+    name = f"{table}_p{suffix}"
+    parent = sql.Identifier('analytics', table)
+    partition = sql.Identifier('analytics', name)
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL(
+                "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            ).format(partition, parent))
+            cur.execute(sql.SQL("""
+                WITH moved AS (
+                    DELETE FROM {} WHERE created_at >= %s AND created_at < %s RETURNING *
+                )
+                INSERT INTO {} SELECT * FROM moved
+            """).format(sql.Identifier('analytics', f"{table}_default"), partition), (start, end))
+            moved = cur.rowcount
+            cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})").format(
+                parent, partition, sql.Literal(start), sql.Literal(end)
+            ))
+    print(f"✅ Created partition analytics.{name}" + (f" ({moved} rows moved from default)" if moved else ""))
+
+def ensure_partitions(conn, table, granularity, premake):
+    """Create missing partitions from the oldest default-partition row up to `premake` ahead"""
+    with conn.cursor() as cur:
+        existing = list_partitions(cur, table)
+        cur.execute(sql.SQL("SELECT MIN(created_at) FROM {}").format(
+            sql.Identifier('analytics', f"{table}_default")
+        ))
+        oldest_default = cur.fetchone()[0]
+    # Each partition is created in its own transaction to keep locks short
+    conn.commit()
+
+    now = datetime.now(timezone.utc)
+    start = partition_floor(min(oldest_default or now, now), granularity)
+    horizon = partition_floor(now, granularity)
+    for _ in range(premake):
+        horizon = partition_step(horizon, granularity)
+
+    while start <= horizon:
+        end = partition_step(start, granularity)
+        overlapping = [p for p in existing if p[1] < end and p[2] > start]
+        if overlapping:
+            # e.g. after a month -> day switch, skip ranges an older partition covers
+            start = max(end, max(p[2] for p in overlapping))
+            continue
+        create_partition(conn, table, start, end, granularity)
+        existing.append((None, start, end))
+        start = end
+
+def drop_expired_partitions(conn, table, retention, safe_before, detach_only):
+    """
+    Detach (and drop) partitions entirely older than the retention window. Partitions
+    not yet summarized into the rollups (upper bound after `safe_before`) are kept.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT now() - %s::interval", (retention,))
+        cutoff = cur.fetchone()[0]
+        partitions = list_partitions(cur, table)
+    conn.commit()
+
+    for name, lower, upper in partitions:
+        if upper > cutoff:
+            break
+        if safe_before is None or upper > safe_before:
+            print(f"⏭️  Keeping expired analytics.{name}: rollups have not covered it yet")
+            break
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+                    sql.Identifier('analytics', table), sql.Identifier('analytics', name)
+                ))
+                if not detach_only:
+                    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier('analytics', name)))
+        print(f"🗑️  {'Detached' if detach_only else 'Dropped'} analytics.{name} ({lower:%Y-%m-%d} - {upper:%Y-%m-%d})")
+
+def rollups_safe_before(conn, lookback_minutes):
+    """Start of the oldest UTC day refresh_rollups() may still recompute"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT (((refreshed_through - make_interval(mins => %s)) AT TIME ZONE 'UTC')::date)::timestamp
+                   AT TIME ZONE 'UTC'
+            FROM analytics.rollup_state
+            WHERE rollup = 'activity'
+        """, (lookback_minutes,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+def maintain_partitions(conn, lookback_minutes, detach_only=False):
+    """
+    Partition maintenance (safe to run from cron): create upcoming partitions,
+    summarize recent data into the rollups, then retire expired partitions.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT table_name, granularity, premake, retention
+                FROM analytics.partition_config
+                WHERE table_name = ANY(%s)
+            """, (list(PARTITIONED_TABLES),))
+            config = cur.fetchall()
+
+        for table, granularity, premake, _ in config:
+            ensure_partitions(conn, table, granularity, premake)
+
+        if not refresh_rollups(conn, lookback_minutes):
+            return False
+
+        safe_before = rollups_safe_before(conn, lookback_minutes)
+        for table, _, _, retention in config:
+            drop_expired_partitions(conn, table, retention, safe_before, detach_only)
+
+        conn.commit()
+        print("✅ Analytics partition maintenance completed")
+        return True
+    except Exception as e:
+        print(f"❌ Error maintaining analytics partitions: {e}")
+        conn.rollback()
+        return False
+
 def show_analytics_info():
     """Display information about the analytics system"""
     print("\n" + "="*60)
@@ -227,7 +455,7 @@ def show_analytics_info():
     print("✅ Recommendation tracking")
     print("✅ Performance monitoring")
     print("✅ Error tracking")
-    print("✅ Analytics dashboard views")
+    print("✅ Analytics rollup tables and dashboard views")
     
     print("\n🔧 Next steps:")
     print("1. Restart your FastAPI backend to include analytics endpoints")
@@ -246,16 +474,43 @@ def show_analytics_info():
     print("- POST /analytics/playlist/create - Track playlists")
     print("- POST /analytics/song/interaction - Track song actions")
     print("- GET /analytics/dashboard/* - View analytics data")
+
+    print("\n⏱️  Keep rollups fresh between backend flushes with a scheduled job, e.g.:")
+    print("   */5 * * * * python database/setup/setup_analytics.py --refresh-rollups")
+    print("   Create partitions and apply retention (analytics.partition_config) daily:")
+    print("   15 3 * * * python database/setup/setup_analytics.py --maintain")
     
     print("\n" + "="*60)
 
 def main():
     """Main setup function"""
-    print("🚀 Setting up MyNewPlaylist Analytics System...")
-    print("="*60)
-    
+    parser = argparse.ArgumentParser(description="Set up and maintain the MyNewPlaylist analytics schema")
+    parser.add_argument("--refresh-rollups", action="store_true",
+                        help="only refresh the rollup tables (for a scheduled job)")
+    parser.add_argument("--maintain", action="store_true",
+                        help="only run partition maintenance: create upcoming partitions, "
+                             "refresh rollups and retire expired partitions (for a scheduled job)")
+    parser.add_argument("--detach-only", action="store_true",
+                        help="with --maintain, detach expired partitions instead of dropping them")
+    parser.add_argument("--lookback-minutes", type=int, default=60,
+                        help="re-aggregate buckets this far behind the last refresh (default: 60)")
+    args = parser.parse_args()
+
     # Get database connection
     conn = get_database_connection()
+
+    if args.refresh_rollups or args.maintain:
+        try:
+            if args.maintain:
+                ok = maintain_partitions(conn, args.lookback_minutes, args.detach_only)
+            else:
+                ok = refresh_rollups(conn, args.lookback_minutes)
+        finally:
+            conn.close()
+        sys.exit(0 if ok else 1)
+
+    print("🚀 Setting up MyNewPlaylist Analytics System...")
+    print("="*60)
     
     try:
         # Setup analytics schema
@@ -268,8 +523,14 @@ def main():
             print("❌ Analytics setup verification failed")
             return
         
+        # Create partitions before any rows land in the default partitions
+        if not maintain_partitions(conn, args.lookback_minutes):
+            print("❌ Analytics partition maintenance failed")
+            return
+        
         # Create sample data
         create_sample_data(conn)
+        refresh_rollups(conn, args.lookback_minutes)
         
         # Show completion info
         show_analytics_info()
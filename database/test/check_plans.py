@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression checks
+
+Runs the SQL the API issues (backend/recommendation_sql.py, backend/search.py)
+under EXPLAIN (ANALYZE, BUFFERS) and fails when a plan loses its index:
+  - recommendations must scan an HNSW index,
+  - search must use the GIN index on search_vector and the trigram GiST indexes,
+  - no query may sequentially scan the songs table,
+  - each query must stay under --max-buffers shared buffers.
+Exits 1 on any failure, so it can gate schema and query changes in CI.
+
+    DATABASE_URL=... python database/test/check_plans.py
+    DATABASE_URL=... python database/test/check_plans.py --generate --rows 200000   # scratch database only
+
+--generate first replaces b25.songs with a synthetic catalog
+(generate_catalog.py); without it the checks run against the data present.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+
+from generate_catalog import add_catalog_arguments, load_catalog
+from quantization_recall import active_version, sample_seed_sets
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from recommendation_sql import (  # noqa: E402
+    QUANTIZED_DISTANCES,
+    SET_EF_SEARCH_SQL,
+    SET_ITERATIVE_SCAN_SQL,
+    RecommendationFilters,
+    ef_search_for,
+    filtered_recommend_query,
+    neighbor_query,
+    recommend_batch_query,
+    recommend_query,
+)
+from search import SEARCH_SQL, search_params  # noqa: E402
+
+INDEX_METHODS_SQL = """
+    SELECT c.relname, am.amname
+    FROM pg_class c
+    JOIN pg_am am ON am.oid = c.relam
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'b25' AND c.relkind = 'i'
+"""
+SEARCH_WORDS_SQL = """
+    SELECT lower(w) FROM (
+        SELECT regexp_split_to_table(track_name, '\\s+') AS w
+        FROM b25.songs
+        LIMIT 2000
+    ) words
+    WHERE length(w) >= 4 AND w ~ '^\\w+$'
+    GROUP BY 1 ORDER BY count(*) DESC LIMIT 1
+"""
+
+
+def explain(conn, query, params, setup=()):
+    """The JSON plan of `query`, run with the same transaction-local settings as the API."""
+    if isinstance(query, str):
+        query = sql.SQL(query)
+    with conn.transaction(force_rollback=True):
+        with conn.cursor() as cur:
+            for statement, args in setup:
+                cur.execute(statement, args)
+            cur.execute(sql.SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {}").format(query), params)
+            return cur.fetchone()[0][0]
+
+
+def nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from nodes(child)
+
+
+class Check:
+    def __init__(self, name, query, params, setup=(), index_methods=(), tables=()):
+        self.name = name
+        self.query = query
+        self.params = params
+        self.setup = setup
+        # Index access methods the plan must use on b25 tables (e.g. 'hnsw', 'gin').
+        self.index_methods = index_methods
+        # Tables that must never be read with a sequential scan.
+        self.tables = tables
+
+    def run(self, conn, index_methods, max_buffers):
+        plan = explain(conn, self.query, self.params, self.setup)
+        root = plan['Plan']
+        failures = []
+
+        used = {index_methods.get(node['Index Name']) for node in nodes(root) if 'Index Name' in node}
+        for method in self.index_methods:
+            if method not in used:
+                failures.append(f"no {method} index scan")
+
+        for node in nodes(root):
+            if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in self.tables:
+                failures.append(f"sequential scan on b25.{node['Relation Name']}")
+
+        buffers = root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+        if buffers > max_buffers:
+            failures.append(f"{buffers:,} shared buffers > {max_buffers:,}")
+
+        return {
+            'name': self.name,
+            'ok': not failures,
+            'failures': failures,
+            'buffers': buffers,
+            'shared_read_blocks': root.get('Shared Read Blocks', 0),
+            'execution_ms': plan.get('Execution Time'),
+            'indexes': sorted(node['Index Name'] for node in nodes(root) if 'Index Name' in node),
+            'plan': plan,
+        }
+
+
+def table_exists(conn, name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        return cur.fetchone()[0]
+
+
+def build_checks(conn, version, seeds, search_word, args):
+    songs = {version.table_name, 'songs'}
+    limit, fetch = args.limit, args.limit
+    ef_setup = ((SET_EF_SEARCH_SQL, (str(ef_search_for(fetch)),)),)
+    checks = [
+        Check('recommend', recommend_query(version, 'none'),
+              {'seeds': seeds, 'limit': limit, 'fetch': fetch}, ef_setup, ('hnsw',), songs),
+        Check('recommend-batch', recommend_batch_query(version, 'none'),
+              {'ords': [0] * len(seeds) + [1], 'track_ids': seeds + seeds[:1], 'limit': limit, 'fetch': fetch},
+              ef_setup, ('hnsw',), songs),
+    ]
+
+    filters = RecommendationFilters(min_relevance=1, exclude_artists=frozenset({'Unknown Artist'}))
+    filtered_fetch = limit * args.filter_overfetch
+    filtered_setup = ((SET_EF_SEARCH_SQL, (str(ef_search_for(filtered_fetch)),)),)
+    if args.iterative_scan != 'off':
+        filtered_setup += ((SET_ITERATIVE_SCAN_SQL, (args.iterative_scan, str(args.max_scan_tuples))),)
+    checks.append(Check(
+        'recommend-filtered', filtered_recommend_query(version, 'none', filters),
+        {'seeds': seeds, 'limit': limit, 'fetch': filtered_fetch, **filters.params()},
+        filtered_setup, ('hnsw',), songs,
+    ))
+
+    for mode in args.quantization or []:
+        quantized_fetch = limit * args.overfetch
+        checks.append(Check(
+            f'recommend-{mode}', recommend_query(version, mode),
+            {'seeds': seeds, 'limit': limit, 'fetch': quantized_fetch},
+            ((SET_EF_SEARCH_SQL, (str(ef_search_for(quantized_fetch)),)),), ('hnsw',), songs,
+        ))
+
+    if table_exists(conn, 'b25.song_neighbors'):
+        checks.append(Check(
+            'recommend-neighbors', neighbor_query(version),
+            {'version': version.version, 'seeds': seeds[:2], 'limit': limit},
+            tables=songs | {'song_neighbors'},
+        ))
+
+    if search_word:
+        checks.append(Check('search-word', SEARCH_SQL, search_params(search_word, args.limit),
+                            index_methods=('gin', 'gist'), tables={'songs'}))
+        prefix = search_word[:3]
+        checks.append(Check('search-prefix', SEARCH_SQL, search_params(prefix, args.limit),
+                            index_methods=('gin', 'gist'), tables={'songs'}))
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when API queries stop using their indexes")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--generate", action="store_true",
+                        help="replace b25.songs with a synthetic catalog first (TRUNCATE ... CASCADE; "
+                             "scratch databases only)")
+    add_catalog_arguments(parser)
+    parser.add_argument("--limit", type=int, default=25, help="limit used in the queries (default: 25)")
+    parser.add_argument("--max-buffers", type=int, default=20_000,
+                        help="shared buffers (hit + read) allowed per query (default: 20000)")
+    parser.add_argument("--quantization", action="append", choices=sorted(QUANTIZED_DISTANCES),
+                        help="also check the quantized candidate query of these modes")
+    parser.add_argument("--overfetch", type=int, default=int(os.getenv('RECOMMENDATION_OVERFETCH', '3')))
+    parser.add_argument("--filter-overfetch", type=int,
+                        default=int(os.getenv('RECOMMENDATION_FILTER_OVERFETCH', '4')))
+    parser.add_argument("--iterative-scan", default=os.getenv('RECOMMENDATION_ITERATIVE_SCAN', 'relaxed_order'))
+    parser.add_argument("--max-scan-tuples", type=int,
+                        default=int(os.getenv('RECOMMENDATION_MAX_SCAN_TUPLES', '20000')))
+    parser.add_argument("--output", help="write results and plans as JSON")
+    parser.set_defaults(truncate=True, skip_indexes=False)
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    random.seed(args.seed)
+    with psycopg.connect(args.database_url) as conn:
+        if args.generate:
+            load_catalog(conn, args)
+
+        version = active_version(conn)
+        seeds = sample_seed_sets(conn, version, 1, 3)[0]
+        with conn.cursor() as cur:
+            cur.execute(INDEX_METHODS_SQL)
+            index_methods = dict(cur.fetchall())
+            cur.execute(SEARCH_WORDS_SQL)
+            row = cur.fetchone()
+        conn.commit()
+        search_word = row[0] if row else None
+
+        print(f"🔎 Checking plans on {version.version} (b25.{version.table_name}), "
+              f"seeds {seeds}, search word {search_word!r}\n")
+        results = []
+        for check in build_checks(conn, version, seeds, search_word, args):
+            try:
+                result = check.run(conn, index_methods, args.max_buffers)
+            except psycopg.Error as exc:
+                result = {'name': check.name, 'ok': False, 'failures': [f"{type(exc).__name__}: {exc}"]}
+            results.append(result)
+            if result['ok']:
+                print(f"✅ {check.name:<22} {result['buffers']:>7,} buffers  {result['execution_ms']:8.2f} ms  "
+                      f"{', '.join(result['indexes'])}")
+            else:
+                print(f"❌ {check.name:<22} {'; '.join(result['failures'])}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+    failed = [result['name'] for result in results if not result['ok']]
+    if failed:
+        print(f"\n❌ {len(failed)} of {len(results)} plan checks failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"\n✅ All {len(results)} plan checks passed")
+
+
+if __name__ == '__main__':
+    main()
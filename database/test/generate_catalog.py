@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Synthetic b25.songs catalog for benchmarks
+
+Fills a local database with a reproducible catalog of any size: clustered random
+embeddings (so HNSW behaves like on real data rather than on uniform noise),
+pronounceable track and artist names with a skewed word and artist distribution,
+and long-tailed relevance values. Loaded with binary COPY; secondary indexes are
+dropped for the load and rebuilt afterwards, as database/setup/load_embeddings.py
+does for real catalogs.
+
+    DATABASE_URL=... python database/test/generate_catalog.py --rows 1000000 --truncate
+
+Then drive the API with backend/test/load_test.py.
+"""
+
+import argparse
+import os
+import string
+import sys
+import time
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+from psycopg import sql
+
+SONG_COLUMNS = ['track_id', 'track_name', 'artist_name', 'track_external_urls', 'relevance', 'embedding']
+SONG_TYPES = ['text', 'text', 'text', 'text', 'int4', 'vector']
+
+SECONDARY_INDEXES_SQL = """
+    SELECT i.indexname, i.indexdef
+    FROM pg_indexes i
+    JOIN pg_class c ON c.relname = i.indexname
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+    JOIN pg_index x ON x.indexrelid = c.oid
+    WHERE i.schemaname = 'b25' AND i.tablename = 'songs' AND NOT x.indisprimary
+"""
+
+ONSETS = ['', 'b', 'br', 'c', 'ch', 'd', 'dr', 'f', 'g', 'gr', 'h', 'j', 'k', 'l', 'm', 'n',
+          'p', 'r', 's', 'sh', 'st', 't', 'th', 'tr', 'v', 'w', 'y', 'z']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ai', 'ea', 'ou', 'é', 'ö', 'y']
+CODAS = ['', '', 'n', 'r', 's', 'l', 'x', 'ng', 'ck', 'st', 'm']
+# Frequent real words, so searches for common terms hit large result sets.
+COMMON_WORDS = ['love', 'night', 'you', 'me', 'the', 'of', 'heart', 'dance', 'fire', 'baby',
+                'summer', 'blue', 'home', 'dream', 'light', 'girl', 'rain', 'forever', 'wild', 'gold']
+BASE62 = string.digits + string.ascii_letters
+
+
+def make_words(rng, count):
+    words = set(COMMON_WORDS)
+    while len(words) < count:
+        syllables = rng.integers(1, 4)
+        words.add(''.join(
+            ONSETS[rng.integers(len(ONSETS))] + VOWELS[rng.integers(len(VOWELS))] + CODAS[rng.integers(len(CODAS))]
+            for _ in range(syllables)
+        ))
+    # Common words first: they get the highest Zipf weights below.
+    return COMMON_WORDS + sorted(words - set(COMMON_WORDS))
+
+
+def zipf_weights(count, exponent):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def make_names(rng, words, weights, count, min_words, max_words):
+    lengths = rng.integers(min_words, max_words + 1, size=count)
+    picks = rng.choice(len(words), size=int(lengths.sum()), p=weights)
+    names, position = [], 0
+    for length in lengths.tolist():
+        names.append(' '.join(words[i] for i in picks[position:position + length]).title())
+        position += length
+    return names
+
+
+def track_ids(rng, count):
+    digits = rng.integers(0, len(BASE62), size=(count, 22))
+    alphabet = np.array(list(BASE62))
+    return [''.join(row) for row in alphabet[digits]]
+
+
+def generate_rows(args):
+    rng = np.random.default_rng(args.seed)
+    words = make_words(rng, args.vocabulary)
+    word_weights = zipf_weights(len(words), 1.05)
+    artist_count = max(1, args.rows // args.songs_per_artist)
+    artists = make_names(rng, words, word_weights, artist_count, 1, 3)
+    artist_weights = zipf_weights(artist_count, 0.9)
+
+    clusters = max(16, args.rows // args.cluster_size)
+    centers = rng.standard_normal((clusters, args.dims)).astype(np.float32)
+    seen = set()
+
+    for start in range(0, args.rows, args.chunk_size):
+        count = min(args.chunk_size, args.rows - start)
+        ids = track_ids(rng, count)
+        names = make_names(rng, words, word_weights, count, 1, 4)
+        artist_picks = rng.choice(artist_count, size=count, p=artist_weights)
+        relevance = np.minimum(rng.pareto(1.2, size=count) * 10, 1_000_000).astype(np.int64)
+        assignment = rng.integers(0, clusters, size=count)
+        vectors = centers[assignment] + args.spread * rng.standard_normal((count, args.dims)).astype(np.float32)
+
+        for offset in range(count):
+            track_id = ids[offset]
+            if track_id in seen:
+                continue
+            seen.add(track_id)
+            yield (
+                track_id,
+                names[offset],
+                artists[artist_picks[offset]],
+                f"https://open.spotify.com/track/{track_id}",
+                int(relevance[offset]),
+                vectors[offset],
+            )
+
+
+def copy_songs(conn, rows, stats):
+    started = time.perf_counter()
+    copy_sql = sql.SQL('COPY b25.songs ({}) FROM STDIN (FORMAT BINARY)').format(
+        sql.SQL(', ').join(map(sql.Identifier, SONG_COLUMNS))
+    )
+    with conn.cursor() as cur:
+        with cur.copy(copy_sql) as copy:
+            copy.set_types(SONG_TYPES)
+            for row in rows:
+                copy.write_row(row)
+                stats['written'] += 1
+                if stats['written'] % 100_000 == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"  {stats['written']:>10,} rows written ({stats['written'] / elapsed:,.0f} rows/s)",
+                          flush=True)
+
+
+def drop_secondary_indexes(conn):
+    with conn.cursor() as cur:
+        cur.execute(SECONDARY_INDEXES_SQL)
+        indexes = cur.fetchall()
+        for name, _ in indexes:
+            cur.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier('b25', name)))
+            print(f"🗑️  Dropped index b25.{name} for the load")
+    return indexes
+
+
+def build_indexes(conn, indexes, maintenance_work_mem, parallel_workers):
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+        cur.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false)", (str(parallel_workers),))
+        for name, definition in indexes:
+            started = time.perf_counter()
+            print(f"🔧 Building index b25.{name}...", flush=True)
+            cur.execute(definition)
+            conn.commit()
+            print(f"✅ Built b25.{name} in {time.perf_counter() - started:,.1f}s", flush=True)
+
+
+def load_catalog(conn, args):
+    """Replace b25.songs with a generated catalog; also used by check_plans.py."""
+    started = time.perf_counter()
+    stats = {'written': 0}
+    register_vector(conn)
+    with conn.cursor() as cur:
+        if args.truncate:
+            cur.execute("TRUNCATE b25.songs CASCADE")
+            print("🗑️  Emptied b25.songs")
+        cur.execute("SELECT EXISTS (SELECT 1 FROM b25.songs)")
+        if cur.fetchone()[0]:
+            print("❌ b25.songs is not empty; pass --truncate on a benchmark database")
+            sys.exit(1)
+
+    indexes = drop_secondary_indexes(conn)
+    print(f"🎲 Generating {args.rows:,} songs (seed {args.seed}, {args.dims} dims)")
+    copy_songs(conn, generate_rows(args), stats)
+    conn.commit()
+    print(f"✅ Wrote {stats['written']:,} songs in {time.perf_counter() - started:,.1f}s")
+
+    if not args.skip_indexes:
+        build_indexes(conn, indexes, args.maintenance_work_mem, args.parallel_workers)
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE b25.songs")
+    conn.commit()
+    print(f"🎵 Synthetic catalog ready in {time.perf_counter() - started:,.1f}s")
+
+
+def add_catalog_arguments(parser):
+    parser.add_argument("--rows", type=int, default=100_000, help="songs to generate (default: 100000)")
+    parser.add_argument("--dims", type=int, default=256, help="embedding dimensions (must match the column)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed; same seed, same catalog")
+    parser.add_argument("--vocabulary", type=int, default=20_000, help="distinct words in names")
+    parser.add_argument("--songs-per-artist", type=int, default=12)
+    parser.add_argument("--cluster-size", type=int, default=2_000, help="average songs per embedding cluster")
+    parser.add_argument("--spread", type=float, default=0.35, help="noise around each cluster center")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--maintenance-work-mem", default="2GB")
+    parser.add_argument("--parallel-workers", type=int, default=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic b25.songs catalog")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="defaults to the DATABASE_URL environment variable")
+    add_catalog_arguments(parser)
+    parser.add_argument("--truncate", action="store_true",
+                        help="empty b25.songs first (TRUNCATE ... CASCADE also empties the analytics "
+                             "tables referencing it; only use on a benchmark database)")
+    parser.add_argument("--skip-indexes", action="store_true", help="do not rebuild secondary indexes")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    with psycopg.connect(args.database_url) as conn:
+        load_catalog(conn, args)
+
+
+if __name__ == '__main__':
+    main()
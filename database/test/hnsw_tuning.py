@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Recall/latency curves of the HNSW recommendation index
+
+Samples seed sets from the active embedding version, computes the exact top-k of
+each by brute force in NumPy (the table is streamed once, so any catalog size
+fits in memory), then runs the API's recommendation query
+(backend/recommendation_sql.py) at every hnsw.ef_search value and reports
+recall@k against that ground truth next to the query latency.
+
+--build m:ef_construction sweeps index build parameters as well: the version
+table is copied into an unlogged scratch table once and the index is rebuilt on
+it for each pair, leaving the live table and its index untouched.
+
+    DATABASE_URL=... python database/test/hnsw_tuning.py --k 10 --build 16:64 --build 32:200 --output hnsw.json
+
+Pick RECOMMENDATION_EF_SEARCH_ANON / _AUTH / _BATCH from the curves.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+from psycopg import sql
+
+from quantization_recall import active_version, recall, sample_seed_sets
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from embedding_versions import EmbeddingVersion  # noqa: E402
+from recommendation_sql import SET_EF_SEARCH_SQL, recommend_query  # noqa: E402
+
+SCRATCH_TABLE = 'hnsw_tuning'
+DEFAULT_EF_SEARCH = [10, 20, 40, 64, 100, 150, 200, 300, 400]
+
+
+def exact_top_k(conn, version, seed_sets, k, chunk_size):
+    """Exact top-k track ids for the centroid of each seed set, seeds excluded, like RECOMMEND_SQL."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "SELECT track_id, embedding FROM {} WHERE track_id = ANY(%s) AND embedding IS NOT NULL"
+        ).format(version.table), (sorted({s for seeds in seed_sets for s in seeds}),))
+        seed_vectors = {track_id: np.asarray(embedding, dtype=np.float32) for track_id, embedding in cur}
+
+    centroids = np.stack([
+        np.mean([seed_vectors[s] for s in seeds if s in seed_vectors], axis=0) for seeds in seed_sets
+    ]).astype(np.float32)
+    centroid_norms = (centroids ** 2).sum(axis=1, keepdims=True)
+    best_distances = np.full((len(seed_sets), k), np.inf, dtype=np.float32)
+    best_ids = np.full((len(seed_sets), k), None, dtype=object)
+    excluded = [set(seeds) for seeds in seed_sets]
+
+    with conn.cursor(name='hnsw_tuning_scan') as cur:
+        cur.itersize = chunk_size
+        cur.execute(sql.SQL("SELECT track_id, embedding FROM {} WHERE embedding IS NOT NULL").format(version.table))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            ids = np.array([row[0] for row in rows], dtype=object)
+            vectors = np.stack([np.asarray(row[1], dtype=np.float32) for row in rows])
+            distances = centroid_norms - 2 * centroids @ vectors.T + (vectors ** 2).sum(axis=1)
+            positions = {track_id: i for i, track_id in enumerate(ids)}
+            for q, seeds in enumerate(excluded):
+                for seed in seeds:
+                    if seed in positions:
+                        distances[q, positions[seed]] = np.inf
+
+            merged_distances = np.concatenate([best_distances, distances], axis=1)
+            merged_ids = np.concatenate([best_ids, np.broadcast_to(ids, distances.shape)], axis=1)
+            keep = np.argpartition(merged_distances, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(merged_distances, keep, axis=1)
+            best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+
+    order = np.argsort(best_distances, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    best_distances = np.take_along_axis(best_distances, order, axis=1)
+    return [[track_id for track_id, d in zip(ids, dists) if np.isfinite(d)]
+            for ids, dists in zip(best_ids, best_distances)]
+
+
+def run(conn, query, params, ef_search):
+    """Track ids in rank order and the query latency in ms"""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(SET_EF_SEARCH_SQL, (str(ef_search),))
+            started = time.perf_counter()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            elapsed = (time.perf_counter() - started) * 1000
+    return [row[0] for row in rows], elapsed
+
+
+def sweep(conn, version, seed_sets, exact, k, ef_values, warmup):
+    query = recommend_query(version, 'none')
+    for seeds in seed_sets[:warmup]:
+        run(conn, query, {'seeds': seeds, 'limit': k}, max(ef_values))
+
+    points = []
+    for ef_search in ef_values:
+        recalls, latencies = [], []
+        for seeds, expected in zip(seed_sets, exact):
+            ids, elapsed = run(conn, query, {'seeds': seeds, 'limit': k}, ef_search)
+            recalls.append(recall(ids, expected))
+            latencies.append(elapsed)
+        latencies.sort()
+        point = {
+            'ef_search': ef_search,
+            'recall': statistics.mean(recalls),
+            'recall_min': min(recalls),
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        }
+        points.append(point)
+        print(f"  ef_search {ef_search:>5}   recall@{k} {point['recall']:6.3f} (min {point['recall_min']:4.2f})   "
+              f"p50 {point['p50_ms']:7.2f} ms  p95 {point['p95_ms']:7.2f} ms  p99 {point['p99_ms']:7.2f} ms",
+              flush=True)
+    return points
+
+
+def operating_point(points, target):
+    """Smallest ef_search reaching the target mean recall, if any."""
+    for point in points:
+        if point['recall'] >= target:
+            return point['ef_search']
+    return None
+
+
+def current_index(conn, version):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT indexdef FROM pg_indexes
+            WHERE schemaname = 'b25' AND tablename = %s AND indexdef LIKE '%%USING hnsw (embedding %%'
+        """, (version.table_name,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def create_scratch_table(conn, version):
+    scratch = sql.Identifier('b25', SCRATCH_TABLE)
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(scratch))
+        cur.execute(sql.SQL("CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(scratch, version.table))
+        cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(scratch, version.table))
+        cur.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (track_id)").format(scratch))
+    conn.commit()
+    print(f"📋 Copied b25.{version.table_name} to b25.{SCRATCH_TABLE} in {time.perf_counter() - started:,.1f}s")
+    return EmbeddingVersion(version.version, SCRATCH_TABLE, version.dims)
+
+
+def build_index(conn, scratch, m, ef_construction, maintenance_work_mem, parallel_workers):
+    index = sql.Identifier(f'{SCRATCH_TABLE}_embedding_idx')
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP INDEX IF EXISTS b25.{}").format(index))
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false)", (maintenance_work_mem,))
+        cur.execute("SELECT set_config('max_parallel_maintenance_workers', %s, false)", (str(parallel_workers),))
+        started = time.perf_counter()
+        cur.execute(sql.SQL(
+            "CREATE INDEX {} ON {} USING hnsw (embedding vector_l2_ops) WITH (m = {}, ef_construction = {})"
+        ).format(index, scratch.table, sql.Literal(m), sql.Literal(ef_construction)))
+        build_seconds = time.perf_counter() - started
+        cur.execute(sql.SQL("ANALYZE {}").format(scratch.table))
+        cur.execute("SELECT pg_relation_size(%s::regclass)", (f'b25.{SCRATCH_TABLE}_embedding_idx',))
+        size = cur.fetchone()[0]
+    conn.commit()
+    return build_seconds, size
+
+
+def parse_build(value):
+    try:
+        m, ef_construction = (int(part) for part in value.split(':'))
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("expected m:ef_construction, e.g. 16:200") from exc
+    return m, ef_construction
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of the HNSW index over ef_search")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--samples", type=int, default=200, help="seed sets to evaluate (default: 200)")
+    parser.add_argument("--max-seeds", type=int, default=5, help="songs per seed set, 1..N (default: 5)")
+    parser.add_argument("--k", type=int, default=10, help="recommendations per query (default: 10)")
+    parser.add_argument("--ef-search", action="append", type=int,
+                        help=f"ef_search value(s) to test (default: {' '.join(map(str, DEFAULT_EF_SEARCH))})")
+    parser.add_argument("--build", action="append", type=parse_build, metavar="M:EF_CONSTRUCTION",
+                        help="also build the index with these parameters on a scratch copy")
+    parser.add_argument("--skip-current", action="store_true", help="do not measure the live index")
+    parser.add_argument("--keep-scratch", action="store_true", help=f"keep b25.{SCRATCH_TABLE} afterwards")
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="report the smallest ef_search reaching this recall (default: 0.95)")
+    parser.add_argument("--warmup", type=int, default=20, help="queries run before timing (default: 20)")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="rows per brute-force block")
+    parser.add_argument("--maintenance-work-mem", default="2GB")
+    parser.add_argument("--parallel-workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42, help="random seed for sampling")
+    parser.add_argument("--output", help="write the curves as JSON")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    random.seed(args.seed)
+    ef_values = sorted(set(args.ef_search or DEFAULT_EF_SEARCH))
+    report = {'k': args.k, 'samples': args.samples, 'target_recall': args.target_recall, 'indexes': []}
+
+    with psycopg.connect(args.database_url) as conn:
+        register_vector(conn)
+        version = active_version(conn)
+        seed_sets = sample_seed_sets(conn, version, args.samples, args.max_seeds)
+        report['version'] = version.version
+        print(f"📏 {len(seed_sets)} seed sets from {version.version} (b25.{version.table_name}), k={args.k}")
+
+        started = time.perf_counter()
+        exact = exact_top_k(conn, version, seed_sets, args.k, args.chunk_size)
+        conn.commit()
+        print(f"🎯 Exact ground truth in {time.perf_counter() - started:,.1f}s\n")
+
+        if not args.skip_current:
+            definition = current_index(conn, version)
+            print(f"📈 Live index: {definition or 'none found'}")
+            points = sweep(conn, version, seed_sets, exact, args.k, ef_values, args.warmup)
+            report['indexes'].append({'index': 'live', 'definition': definition, 'points': points,
+                                      'ef_search_for_target': operating_point(points, args.target_recall)})
+
+        if args.build:
+            scratch = create_scratch_table(conn, version)
+            try:
+                for m, ef_construction in args.build:
+                    build_seconds, size = build_index(conn, scratch, m, ef_construction,
+                                                      args.maintenance_work_mem, args.parallel_workers)
+                    print(f"\n📈 m={m}, ef_construction={ef_construction}: built in {build_seconds:,.1f}s, "
+                          f"{size / 1024 ** 2:,.0f} MB")
+                    points = sweep(conn, scratch, seed_sets, exact, args.k, ef_values, args.warmup)
+                    report['indexes'].append({
+                        'index': 'scratch', 'm': m, 'ef_construction': ef_construction,
+                        'build_seconds': build_seconds, 'size_bytes': size, 'points': points,
+                        'ef_search_for_target': operating_point(points, args.target_recall),
+                    })
+            finally:
+                if not args.keep_scratch:
+                    conn.rollback()
+                    with conn.cursor() as cur:
+                        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(scratch.table))
+                    conn.commit()
+
+    print(f"\n🎚️  Smallest ef_search with recall@{args.k} >= {args.target_recall}:")
+    for entry in report['indexes']:
+        label = 'live index' if entry['index'] == 'live' else f"m={entry['m']}, ef_construction={entry['ef_construction']}"
+        print(f"  {label:<32} {entry['ef_search_for_target'] or 'not reached'}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"✅ Curves written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
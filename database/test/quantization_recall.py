@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Recall of the quantized two-stage recommendation path
+
+Samples random seed sets from the active embedding version and compares the
+top-k of each RECOMMENDATION_QUANTIZATION mode against
+  - exact:   brute force over the full vectors (index scans disabled)
+  - current: the full-precision HNSW query the API serves today
+using the same SQL as the backend (backend/recommendation_sql.py).
+
+    DATABASE_URL=... python database/test/quantization_recall.py --k 10 --overfetch 3 --overfetch 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from embedding_versions import LEGACY_VERSION, EmbeddingVersion  # noqa: E402
+from recommendation_sql import (  # noqa: E402
+    QUANTIZED_DISTANCES,
+    SET_EF_SEARCH_SQL,
+    ef_search_for,
+    recommend_query,
+)
+
+
+def active_version(conn):
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT version, table_name, COALESCE(dims, %s) FROM b25.embedding_versions WHERE active",
+                        (LEGACY_VERSION.dims,))
+            row = cur.fetchone()
+        except psycopg.errors.UndefinedTable:
+            conn.rollback()
+            row = None
+    return EmbeddingVersion(*row) if row else LEGACY_VERSION
+
+
+def sample_seed_sets(conn, version, samples, max_seeds):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(
+            "SELECT track_id FROM {} WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s"
+        ).format(version.table), (samples * max_seeds,))
+        pool = [row[0] for row in cur.fetchall()]
+    return [random.sample(pool, random.randint(1, max_seeds)) for _ in range(samples)]
+
+
+def run(conn, query, params, fetch, exact=False):
+    """Track ids in rank order and the query latency in ms"""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            if exact:
+                cur.execute("SET LOCAL enable_indexscan = off")
+            cur.execute(SET_EF_SEARCH_SQL, (str(ef_search_for(fetch)),))
+            started = time.perf_counter()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            elapsed = (time.perf_counter() - started) * 1000
+    return [row[0] for row in rows], elapsed
+
+
+def recall(found, expected):
+    return len(set(found) & set(expected)) / len(expected) if expected else 1.0
+
+
+def summarize(name, recalls_exact, recalls_current, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<22} recall@k vs exact {statistics.mean(recalls_exact):6.3f}   "
+          f"vs current {statistics.mean(recalls_current):6.3f}   "
+          f"latency p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k of quantized candidate search with exact re-rank")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--samples", type=int, default=200, help="seed sets to evaluate (default: 200)")
+    parser.add_argument("--max-seeds", type=int, default=5, help="songs per seed set, 1..N (default: 5)")
+    parser.add_argument("--k", type=int, default=10, help="recommendations per query (default: 10)")
+    parser.add_argument("--mode", action="append", choices=sorted(QUANTIZED_DISTANCES),
+                        help="quantization mode(s) to test (default: all)")
+    parser.add_argument("--overfetch", action="append", type=int,
+                        help="candidate over-fetch factor(s) to test (default: 3 and 10)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for sampling")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("❌ Error: DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    random.seed(args.seed)
+    modes = args.mode or sorted(QUANTIZED_DISTANCES)
+    overfetch = args.overfetch or [3, 10]
+
+    with psycopg.connect(args.database_url) as conn:
+        version = active_version(conn)
+        seed_sets = sample_seed_sets(conn, version, args.samples, args.max_seeds)
+        print(f"📏 {len(seed_sets)} seed sets from {version.version} (b25.{version.table_name}), k={args.k}\n")
+
+        exact_query = recommend_query(version, 'none')
+        exact, current, current_ms = [], [], []
+        for seeds in seed_sets:
+            params = {'seeds': seeds, 'limit': args.k, 'fetch': args.k}
+            exact.append(run(conn, exact_query, params, args.k, exact=True)[0])
+            ids, elapsed = run(conn, exact_query, params, args.k)
+            current.append(ids)
+            current_ms.append(elapsed)
+
+        summarize("current (full HNSW)",
+                  [recall(c, e) for c, e in zip(current, exact)], [1.0] * len(current), current_ms)
+
+        for mode in modes:
+            query = recommend_query(version, mode)
+            for factor in overfetch:
+                fetch = args.k * factor
+                found, latencies = [], []
+                for seeds in seed_sets:
+                    ids, elapsed = run(conn, query, {'seeds': seeds, 'limit': args.k, 'fetch': fetch}, fetch)
+                    found.append(ids)
+                    latencies.append(elapsed)
+                summarize(f"{mode} x{factor}",
+                          [recall(f, e) for f, e in zip(found, exact)],
+                          [recall(f, c) for f, c in zip(found, current)],
+                          latencies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+-- adding the embedding version pointer table to an existing database
+-- registers the current b25.songs embeddings as the active version
+
+CREATE TABLE IF NOT EXISTS b25.embedding_versions (
+    version TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL UNIQUE,
+    dims INTEGER,
+    song_count INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    activated_at TIMESTAMP WITH TIME ZONE,
+    active BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE UNIQUE INDEX IF NOT EXISTS embedding_versions_active_idx ON b25.embedding_versions (active) WHERE active;
+
+INSERT INTO b25.embedding_versions (version, table_name, dims, song_count, active, activated_at)
+SELECT 'b25-CBOW-256-5-150v4', 'songs', 256, COUNT(embedding), TRUE, NOW()
+FROM b25.songs
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,20 @@
+-- partial HNSW index for filtered recommendations on high-relevance songs
+-- (/recommend-average/?min_relevance=...); the backend repeats the predicate as a
+-- literal when min_relevance >= RECOMMENDATION_RELEVANT_INDEX_MIN, so set that to
+-- the threshold below after creating the index:
+--   RECOMMENDATION_RELEVANT_INDEX_MIN=50
+-- with pgvector >= 0.8 the scan continues until enough rows pass the remaining
+-- filters (RECOMMENDATION_ITERATIVE_SCAN); older versions rely on over-fetch only
+
+SET maintenance_work_mem = '2GB';
+SET max_parallel_maintenance_workers = 4;
+
+CREATE INDEX IF NOT EXISTS songs_embedding_relevant_idx ON b25.songs
+USING hnsw (embedding vector_l2_ops)
+WITH (m = 16, ef_construction = 200)
+WHERE relevance >= 50;
+
+-- share of the catalog the partial index covers
+SELECT COUNT(*) FILTER (WHERE relevance >= 50) AS relevant_songs,
+       COUNT(*) AS all_songs
+FROM b25.songs;
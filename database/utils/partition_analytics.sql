@@ -0,0 +1,91 @@
+-- converting existing analytics event tables to time-partitioned tables
+-- the current table becomes the DEFAULT partition, so this only rewrites catalog entries
+-- afterwards run `python database/setup/setup_analytics.py`: it creates the rollup and
+-- config tables, moves the old rows into day/month partitions and applies retention
+
+BEGIN;
+
+-- page_views
+ALTER TABLE analytics.page_views RENAME TO page_views_default;
+ALTER INDEX analytics.idx_page_views_session_id RENAME TO page_views_default_session_id_idx;
+ALTER INDEX analytics.idx_page_views_created_at RENAME TO page_views_default_created_at_idx;
+ALTER INDEX analytics.idx_page_views_page_path RENAME TO page_views_default_page_path_idx;
+ALTER TABLE analytics.page_views_default DROP CONSTRAINT page_views_pkey;
+UPDATE analytics.page_views_default SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE analytics.page_views_default ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE analytics.page_views_default ADD PRIMARY KEY (view_id, created_at);
+CREATE TABLE analytics.page_views (LIKE analytics.page_views_default INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+ALTER TABLE analytics.page_views ADD PRIMARY KEY (view_id, created_at);
+ALTER TABLE analytics.page_views ADD FOREIGN KEY (session_id) REFERENCES analytics.user_sessions(session_id) ON DELETE CASCADE;
+CREATE INDEX idx_page_views_session_id ON analytics.page_views(session_id);
+CREATE INDEX idx_page_views_created_at ON analytics.page_views(created_at);
+CREATE INDEX idx_page_views_page_path ON analytics.page_views(page_path);
+ALTER TABLE analytics.page_views ATTACH PARTITION analytics.page_views_default DEFAULT;
+
+-- song_interactions
+ALTER TABLE analytics.song_interactions RENAME TO song_interactions_default;
+ALTER INDEX analytics.idx_song_interactions_session_id RENAME TO song_interactions_default_session_id_idx;
+ALTER INDEX analytics.idx_song_interactions_track_id RENAME TO song_interactions_default_track_id_idx;
+ALTER INDEX analytics.idx_song_interactions_created_at RENAME TO song_interactions_default_created_at_idx;
+ALTER TABLE analytics.song_interactions_default DROP CONSTRAINT song_interactions_pkey;
+UPDATE analytics.song_interactions_default SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE analytics.song_interactions_default ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE analytics.song_interactions_default ADD PRIMARY KEY (interaction_id, created_at);
+CREATE TABLE analytics.song_interactions (LIKE analytics.song_interactions_default INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+ALTER TABLE analytics.song_interactions ADD PRIMARY KEY (interaction_id, created_at);
+ALTER TABLE analytics.song_interactions ADD FOREIGN KEY (session_id) REFERENCES analytics.user_sessions(session_id) ON DELETE CASCADE;
+ALTER TABLE analytics.song_interactions ADD FOREIGN KEY (playlist_id) REFERENCES analytics.playlists(playlist_id) ON DELETE CASCADE;
+ALTER TABLE analytics.song_interactions ADD FOREIGN KEY (track_id) REFERENCES b25.songs(track_id);
+CREATE INDEX idx_song_interactions_session_id ON analytics.song_interactions(session_id);
+CREATE INDEX idx_song_interactions_track_id ON analytics.song_interactions(track_id);
+CREATE INDEX idx_song_interactions_created_at ON analytics.song_interactions(created_at);
+ALTER TABLE analytics.song_interactions ATTACH PARTITION analytics.song_interactions_default DEFAULT;
+
+-- search_queries
+ALTER TABLE analytics.search_queries RENAME TO search_queries_default;
+ALTER INDEX analytics.idx_search_queries_session_id RENAME TO search_queries_default_session_id_idx;
+ALTER INDEX analytics.idx_search_queries_query_text RENAME TO search_queries_default_query_text_idx;
+ALTER INDEX analytics.idx_search_queries_created_at RENAME TO search_queries_default_created_at_idx;
+ALTER TABLE analytics.search_queries_default DROP CONSTRAINT search_queries_pkey;
+UPDATE analytics.search_queries_default SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE analytics.search_queries_default ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE analytics.search_queries_default ADD PRIMARY KEY (search_id, created_at);
+CREATE TABLE analytics.search_queries (LIKE analytics.search_queries_default INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+ALTER TABLE analytics.search_queries ADD PRIMARY KEY (search_id, created_at);
+ALTER TABLE analytics.search_queries ADD FOREIGN KEY (session_id) REFERENCES analytics.user_sessions(session_id) ON DELETE CASCADE;
+ALTER TABLE analytics.search_queries ADD FOREIGN KEY (clicked_song_id) REFERENCES b25.songs(track_id);
+CREATE INDEX idx_search_queries_session_id ON analytics.search_queries(session_id);
+CREATE INDEX idx_search_queries_query_text ON analytics.search_queries(query_text);
+CREATE INDEX idx_search_queries_created_at ON analytics.search_queries(created_at);
+ALTER TABLE analytics.search_queries ATTACH PARTITION analytics.search_queries_default DEFAULT;
+
+-- errors
+ALTER TABLE analytics.errors RENAME TO errors_default;
+ALTER TABLE analytics.errors_default DROP CONSTRAINT errors_pkey;
+UPDATE analytics.errors_default SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE analytics.errors_default ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE analytics.errors_default ADD PRIMARY KEY (error_id, created_at);
+CREATE TABLE analytics.errors (LIKE analytics.errors_default INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+ALTER TABLE analytics.errors ADD PRIMARY KEY (error_id, created_at);
+ALTER TABLE analytics.errors ADD FOREIGN KEY (session_id) REFERENCES analytics.user_sessions(session_id) ON DELETE SET NULL;
+CREATE INDEX idx_errors_created_at ON analytics.errors(created_at);
+ALTER TABLE analytics.errors ATTACH PARTITION analytics.errors_default DEFAULT;
+
+-- performance
+ALTER TABLE analytics.performance RENAME TO performance_default;
+ALTER TABLE analytics.performance_default DROP CONSTRAINT performance_pkey;
+UPDATE analytics.performance_default SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE analytics.performance_default ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE analytics.performance_default ADD PRIMARY KEY (performance_id, created_at);
+CREATE TABLE analytics.performance (LIKE analytics.performance_default INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_at);
+ALTER TABLE analytics.performance ADD PRIMARY KEY (performance_id, created_at);
+ALTER TABLE analytics.performance ADD FOREIGN KEY (session_id) REFERENCES analytics.user_sessions(session_id) ON DELETE SET NULL;
+CREATE INDEX idx_performance_created_at ON analytics.performance(created_at);
+ALTER TABLE analytics.performance ATTACH PARTITION analytics.performance_default DEFAULT;
+
+COMMIT;
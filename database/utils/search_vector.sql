@@ -0,0 +1,24 @@
+-- ranked search for /search-advanced/ (backend/search.py) on an existing catalog
+-- adds the weighted, stored search_vector column and the indexes the search
+-- branches are served from; the ADD COLUMN rewrites b25.songs once
+-- until this has run, the backend keeps using the previous ILIKE / to_tsvector query
+
+ALTER TABLE b25.songs
+ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', COALESCE(track_name, '')), 'A') ||
+    setweight(to_tsvector('simple', COALESCE(artist_name, '')), 'B')
+) STORED;
+
+SET maintenance_work_mem = '1GB';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS songs_search_vector_idx ON b25.songs USING gin (search_vector);
+-- GiST (unlike GIN) can return the k nearest names by <-> directly
+CREATE INDEX CONCURRENTLY IF NOT EXISTS songs_track_name_trgm_gist_idx ON b25.songs USING gist (track_name gist_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS songs_artist_name_trgm_gist_idx ON b25.songs USING gist (artist_name gist_trgm_ops);
+
+ANALYZE b25.songs;
+
+-- the old expression and GIN trigram indexes are unused by the new query:
+-- DROP INDEX CONCURRENTLY b25.songs_textsearch_idx;
+-- DROP INDEX CONCURRENTLY b25.songs_track_name_trgm_idx;
+-- DROP INDEX CONCURRENTLY b25.songs_artist_name_trgm_idx;
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import { SearchResult } from '../types';
-import { searchSongs } from '../services/api';
+import { suggestSongs } from '../services/api';
 import SongCard from './SongCard';
 
 interface SearchBarProps {
@@ -16,7 +16,7 @@ const SearchBar: React.FC<SearchBarProps> = ({ onAddToPlaylist }) => {
   const performSearch = useCallback(async () => {
     setIsLoading(true);
     try {
-      const searchResults = await searchSongs(query, 10);
+      const searchResults = await suggestSongs(query, 10);
       setResults(searchResults);
       setShowResults(true);
     } catch (error) {
@@ -35,7 +35,7 @@ const SearchBar: React.FC<SearchBarProps> = ({ onAddToPlaylist }) => {
         setResults([]);
         setShowResults(false);
       }
-    }, 300);
+    }, 120);
 
     return () => clearTimeout(searchTimeout);
   }, [query, performSearch]);
@@ -1,4 +1,5 @@
 import { Song } from '../types';
+import { getLastEmbeddingVersion } from './api';
 
 // Analytics service for tracking user behavior
 class AnalyticsService {
@@ -6,6 +7,12 @@ class AnalyticsService {
   private sessionStartTime: number = 0;
   private pageViewStartTime: number = 0;
   private currentPage: string = '';
+  private eventQueue: Record<string, unknown>[] = [];
+  private flushTimer: number | null = null;
+
+  // Events are sent in batches to /analytics/events
+  private static readonly FLUSH_INTERVAL_MS = 5000;
+  private static readonly MAX_BATCH_SIZE = 50;
 
   constructor() {
     this.init();
@@ -65,19 +72,50 @@ class AnalyticsService {
     }
   }
 
-  private async endSession() {
+  private endSession() {
     if (!this.sessionId) return;
-    
-    try {
-      await fetch('/analytics/session/end', {
+
+    this.enqueueEvent({ type: 'session_end', session_id: this.sessionId });
+  }
+
+  private enqueueEvent(event: Record<string, unknown>) {
+    this.eventQueue.push(event);
+
+    if (this.eventQueue.length >= AnalyticsService.MAX_BATCH_SIZE) {
+      this.flushEvents();
+    } else if (this.flushTimer === null) {
+      this.flushTimer = window.setTimeout(() => this.flushEvents(), AnalyticsService.FLUSH_INTERVAL_MS);
+    }
+  }
+
+  // Send queued events; on page hide/unload use sendBeacon so the batch survives navigation
+  private flushEvents(useBeacon: boolean = false) {
+    if (this.flushTimer !== null) {
+      window.clearTimeout(this.flushTimer);
+      this.flushTimer = null;
+    }
+
+    while (this.eventQueue.length > 0) {
+      const events = this.eventQueue.splice(0, AnalyticsService.MAX_BATCH_SIZE);
+      const body = JSON.stringify({ events });
+
+      if (useBeacon && typeof navigator.sendBeacon === 'function') {
+        const blob = new Blob([body], { type: 'application/json' });
+        if (navigator.sendBeacon('/analytics/events', blob)) {
+          continue;
+        }
+      }
+
+      fetch('/analytics/events', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ session_id: this.sessionId }),
+        body,
+        keepalive: useBeacon,
+      }).catch(error => {
+        console.warn('Failed to send analytics events:', error);
       });
-    } catch (error) {
-      console.warn('Failed to end analytics session:', error);
     }
   }
 
@@ -103,8 +141,9 @@ class AnalyticsService {
     if (hidden && visibilityChange) {
       document.addEventListener(visibilityChange, () => {
         if (document[hidden as keyof Document]) {
-          // Page hidden, track view duration
+          // Page hidden, track view duration and send pending events
           this.trackPageViewDuration();
+          this.flushEvents(true);
         } else {
           // Page visible, start new page view timer
           this.pageViewStartTime = Date.now();
@@ -117,6 +156,7 @@ class AnalyticsService {
     window.addEventListener('beforeunload', () => {
       this.trackPageViewDuration();
       this.endSession();
+      this.flushEvents(true);
     });
   }
 
@@ -135,25 +175,16 @@ class AnalyticsService {
     this.sendPageView(pagePath, pageTitle);
   }
 
-  private async sendPageView(pagePath: string, pageTitle?: string) {
+  private sendPageView(pagePath: string, pageTitle?: string) {
     if (!this.sessionId) return;
-    
-    try {
-      await fetch('/analytics/pageview', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          session_id: this.sessionId,
-          page_path: pagePath,
-          page_title: pageTitle || document.title,
-          referrer: document.referrer,
-        }),
-      });
-    } catch (error) {
-      console.warn('Failed to track pageview:', error);
-    }
+
+    this.enqueueEvent({
+      type: 'pageview',
+      session_id: this.sessionId,
+      page_path: pagePath,
+      page_title: pageTitle || document.title,
+      referrer: document.referrer,
+    });
   }
 
   private trackPageViewDuration() {
@@ -166,26 +197,17 @@ class AnalyticsService {
     }
   }
 
-  private async sendPageViewDuration(duration: number) {
+  private sendPageViewDuration(duration: number) {
     if (!this.sessionId) return;
-    
-    try {
-      await fetch('/analytics/pageview', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          session_id: this.sessionId,
-          page_path: this.currentPage,
-          page_title: document.title,
-          referrer: document.referrer,
-          view_duration: duration,
-        }),
-      });
-    } catch (error) {
-      console.warn('Failed to track page view duration:', error);
-    }
+
+    this.enqueueEvent({
+      type: 'pageview',
+      session_id: this.sessionId,
+      page_path: this.currentPage,
+      page_title: document.title,
+      referrer: document.referrer,
+      view_duration: duration,
+    });
   }
 
   public trackPlaylistCreation(songCount: number, isPublic: boolean = false) {
@@ -198,18 +220,8 @@ class AnalyticsService {
     });
   }
 
-  private async sendPlaylistCreation(data: any) {
-    try {
-      await fetch('/analytics/playlist/create', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track playlist creation:', error);
-    }
+  private sendPlaylistCreation(data: any) {
+    this.enqueueEvent({ type: 'playlist', ...data });
   }
 
   public trackSongInteraction(
@@ -229,18 +241,8 @@ class AnalyticsService {
     });
   }
 
-  private async sendSongInteraction(data: any) {
-    try {
-      await fetch('/analytics/song/interaction', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track song interaction:', error);
-    }
+  private sendSongInteraction(data: any) {
+    this.enqueueEvent({ type: 'song_interaction', ...data });
   }
 
   public trackSearchQuery(
@@ -261,18 +263,8 @@ class AnalyticsService {
     });
   }
 
-  private async sendSearchQuery(data: any) {
-    try {
-      await fetch('/analytics/search/query', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track search query:', error);
-    }
+  private sendSearchQuery(data: any) {
+    this.enqueueEvent({ type: 'search_query', ...data });
   }
 
   public trackRecommendations(
@@ -293,22 +285,13 @@ class AnalyticsService {
       accepted_song_ids: acceptedSongIds || [],
       rejected_song_ids: rejectedSongIds || [],
       recommendation_algorithm: 'embedding_average',
+      embedding_version: getLastEmbeddingVersion(),
       response_time: responseTime,
     });
   }
 
-  private async sendRecommendations(data: any) {
-    try {
-      await fetch('/analytics/recommendations/request', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track recommendations:', error);
-    }
+  private sendRecommendations(data: any) {
+    this.enqueueEvent({ type: 'recommendation', ...data });
   }
 
   public trackError(errorType: string, errorMessage: string, stackTrace?: string) {
@@ -324,18 +307,8 @@ class AnalyticsService {
     });
   }
 
-  private async sendError(data: any) {
-    try {
-      await fetch('/analytics/error', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track error:', error);
-    }
+  private sendError(data: any) {
+    this.enqueueEvent({ type: 'error', ...data });
   }
 
   public trackPerformance(metricName: string, metricValue: number, metricUnit: string = 'ms') {
@@ -350,18 +323,8 @@ class AnalyticsService {
     });
   }
 
-  private async sendPerformance(data: any) {
-    try {
-      await fetch('/analytics/performance', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(data),
-      });
-    } catch (error) {
-      console.warn('Failed to track performance:', error);
-    }
+  private sendPerformance(data: any) {
+    this.enqueueEvent({ type: 'performance', ...data });
   }
 
   // Utility methods for common tracking scenarios
@@ -1,7 +1,16 @@
-import { Song, SearchResult } from '../types';
+import { Song, SearchResult, RecommendationBatchResult, RecommendationFilters } from '../types';
 
 const API_BASE_URL = process.env.REACT_APP_API_URL || '';
 
+// Embedding model version of the last recommendations, reported with analytics events
+let lastEmbeddingVersion: string | undefined;
+
+export const getLastEmbeddingVersion = (): string | undefined => lastEmbeddingVersion;
+
+const rememberEmbeddingVersion = (response: Response) => {
+  lastEmbeddingVersion = response.headers.get('X-Embedding-Version') ?? lastEmbeddingVersion;
+};
+
 export const searchSongs = async (query: string, limit: number = 50): Promise<SearchResult[]> => {
   try {
     const response = await fetch(
@@ -17,10 +26,27 @@ export const searchSongs = async (query: string, limit: number = 50): Promise<Se
   }
 };
 
+// Typeahead: served from the backend's in-memory prefix index, cheap enough per keystroke
+export const suggestSongs = async (query: string, limit: number = 8): Promise<SearchResult[]> => {
+  try {
+    const response = await fetch(
+      `${API_BASE_URL}/search/suggest?q=${encodeURIComponent(query)}&limit=${limit}`
+    );
+    if (!response.ok) {
+      throw new Error('Suggest failed');
+    }
+    return await response.json();
+  } catch (error) {
+    console.error('Suggest error:', error);
+    return [];
+  }
+};
+
 export const getRecommendations = async (
   songIds: string[],
   limit: number = 10,
-  accessToken?: string
+  accessToken?: string,
+  filters: RecommendationFilters = {}
 ): Promise<Song[]> => {
   const headers: HeadersInit = {};
   if (accessToken) {
@@ -28,9 +54,18 @@ export const getRecommendations = async (
   }
 
   try {
-    const songIdsParam = songIds.map(id => `song_ids=${encodeURIComponent(id)}`).join('&');
+    const params = new URLSearchParams();
+    songIds.forEach(id => params.append('song_ids', id));
+    params.set('limit', String(limit));
+    if (filters.minRelevance !== undefined) {
+      params.set('min_relevance', String(filters.minRelevance));
+    }
+    filters.excludeArtists?.forEach(artist => params.append('exclude_artists', artist));
+    if (filters.onePerArtist) {
+      params.set('one_per_artist', 'true');
+    }
     const response = await fetch(
-      `${API_BASE_URL}/recommend-average/?${songIdsParam}&limit=${limit}`,
+      `${API_BASE_URL}/recommend-average/?${params.toString()}`,
       { headers }
     );
 
@@ -49,6 +84,7 @@ export const getRecommendations = async (
       throw new Error(message);
     }
 
+    rememberEmbeddingVersion(response);
     return await response.json();
   } catch (error) {
     console.error('Recommendation error:', error);
@@ -58,3 +94,30 @@ export const getRecommendations = async (
     throw new Error('Recommendation failed');
   }
 };
+
+export const getBatchRecommendations = async (
+  seedSets: string[][],
+  limit: number = 10,
+  accessToken?: string
+): Promise<RecommendationBatchResult[]> => {
+  const headers: HeadersInit = { 'Content-Type': 'application/json' };
+  if (accessToken) {
+    headers.Authorization = `Bearer ${accessToken}`;
+  }
+
+  const response = await fetch(`${API_BASE_URL}/recommend-batch`, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify({
+      items: seedSets.map(songIds => ({ song_ids: songIds, limit })),
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error('Batch recommendation failed');
+  }
+
+  rememberEmbeddingVersion(response);
+  const body = await response.json();
+  return body.results;
+};
@@ -19,4 +19,20 @@ export interface PlaylistState {
   isLoading: boolean;
   searchQuery: string;
   searchResults: SearchResult[];
-} 
\ No newline at end of file
+} 
+export interface RecommendationBatchResult {
+  status: 'ok' | 'rejected';
+  recommendations?: Song[];
+  error?: {
+    message: string;
+    max_limit: number;
+    is_authenticated: boolean;
+    hint?: string;
+  };
+}
+
+export interface RecommendationFilters {
+  minRelevance?: number;
+  excludeArtists?: string[];
+  onePerArtist?: boolean;
+}
@@ -9,7 +9,12 @@ CREATE TABLE IF NOT EXISTS b25.songs (
     artist_name TEXT,
     track_external_urls TEXT,
     relevance INT,
-    embedding VECTOR(256)
+    embedding VECTOR(256),
+    -- track name outranks artist; 'simple' keeps names unstemmed and language-neutral
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(track_name, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(artist_name, '')), 'B')
+    ) STORED
 );
 
 -- Vector index for similarity search
@@ -17,12 +22,10 @@ CREATE INDEX IF NOT EXISTS songs_embedding_idx ON b25.songs
 USING hnsw (embedding vector_l2_ops)
 WITH (m = 16, ef_construction = 200);
 
--- Text search indexes
-CREATE INDEX IF NOT EXISTS songs_track_name_trgm_idx ON b25.songs USING gin (track_name gin_trgm_ops);
-CREATE INDEX IF NOT EXISTS songs_artist_name_trgm_idx ON b25.songs USING gin (artist_name gin_trgm_ops);
-CREATE INDEX IF NOT EXISTS songs_textsearch_idx ON b25.songs USING gin (
-  to_tsvector('english', track_name || ' ' || artist_name)
-);
+-- Text search indexes (GiST trigram: similarity and top-k by <->; GIN: word/prefix matches)
+CREATE INDEX IF NOT EXISTS songs_track_name_trgm_gist_idx ON b25.songs USING gist (track_name gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS songs_artist_name_trgm_gist_idx ON b25.songs USING gist (artist_name gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS songs_search_vector_idx ON b25.songs USING gin (search_vector);
 
 -- Waitlist signups for product launch
 CREATE TABLE IF NOT EXISTS b25.waitlist_signups (